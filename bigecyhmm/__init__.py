@@ -31,6 +31,8 @@ TEMPLATE_PHOSPHORUS_CYCLE = os.path.join(ROOT, 'templates', 'template_phosphorus
 TEMPLATE_PHOSPHORUS_GENE_CYCLE = os.path.join(ROOT, 'templates', 'template_phosphorus_genes.png')
 TEMPLATE_CUSTOM_CENTRAL_HYDROGEN = os.path.join(ROOT, 'templates', 'template_central_hydrogen.png')
 TEMPLATE_BACKGROUND_BIGECYHMM = os.path.join(ROOT, 'templates', 'template_background.png')
+# Position, colour and pathway of the labels drawn on each diagram template.
+DIAGRAM_LAYOUT_FILE = os.path.join(ROOT, 'templates', 'diagram_layout.json')
 
 CUSTOM_CARBON_CYCLE_NETWORK = os.path.join(ROOT, 'hmm_databases', 'custom_carbon_cycle.json')
 CUSTOM_SULFUR_CYCLE_NETWORK = os.path.join(ROOT, 'hmm_databases', 'custom_sulfur_cycle.json')
@@ -21,7 +21,8 @@ import time
 
 from bigecyhmm import __version__ as VERSION
 from bigecyhmm.utils import is_valid_dir
-from bigecyhmm.hmm_search import search_hmm
+from bigecyhmm.hmm_search import search_hmm, SEARCH_PROFILES
+from bigecyhmm.profiling import enable_profiling, write_profiles
 from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE
 
 MESSAGE = f'''
@@ -76,6 +77,38 @@ def main():
         type=int,
         default=1)
 
+    parser.add_argument(
+        '--sparse',
+        dest='sparse',
+        help='Also write function and pathway presences in a sparse format (Matrix Market), used by bigecyhmm_visualisation for large datasets.',
+        required=False,
+        action='store_true',
+        default=False)
+
+    parser.add_argument(
+        '--search-profile',
+        dest='search_profile',
+        help='Search profile: default (HMMER filter thresholds) or fast (tightened HMMER filter thresholds to screen many inputs, weak hits can be lost, see bigecyhmm_calibrate).',
+        required=False,
+        choices=list(SEARCH_PROFILES),
+        default='default')
+
+    parser.add_argument(
+        '--memory-budget',
+        dest='memory_budget',
+        help='Memory budget (in GB) for HMM searches: inputs are searched in parallel while their estimated memory fits in the budget and inputs too large for it are read by chunks of sequences.',
+        required=False,
+        type=float,
+        default=None)
+
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        help='Profile the stages of the run (search, filtering, aggregation, plotting) with cProfile in all processes. Merged profiles (bigecyhmm_profile_STAGE.pstats) and a summary of the slowest functions (bigecyhmm_profile.txt) are written in the output folder.',
+        required=False,
+        action='store_true',
+        default=False)
+
     args = parser.parse_args()
 
     # If no argument print the help.
@@ -98,8 +131,17 @@ def main():
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
+    if args.profile:
+        enable_profiling(args.output)
+
     logger.info("--- Launch HMM search ---")
-    search_hmm(args.input, args.output, core_number=args.core)
+    try:
+        search_hmm(args.input, args.output, core_number=args.core, sparse_output=args.sparse, search_profile=args.search_profile,
+                   memory_budget=args.memory_budget)
+    finally:
+        # Profiles are also written if the search fails, which removes their temporary folder.
+        if args.profile:
+            write_profiles(args.output, 'bigecyhmm')
 
     duration = time.time() - start_time
     logger.info("--- Total runtime %.2f seconds ---" % (duration))
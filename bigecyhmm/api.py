@@ -0,0 +1,192 @@
+# Copyright (C) 2024-2026 Arnaud Belcour - Univ. Grenoble Alpes, Inria, Grenoble, France Microcosme
+# Univ. Grenoble Alpes, Inria, Microcosme
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import io
+import logging
+import os
+import pyhmmer
+
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from bigecyhmm.utils import is_valid_dir
+from bigecyhmm.hmm_search import get_hmm_thresholds, load_hmm_profiles, optimize_hmm_profiles, query_sequences, get_hmm_functions, \
+    compute_function_presences, write_results, write_function_presence_file
+from bigecyhmm.diagram_cycles import get_diagram_pathways_hmms, check_diagram_pathways, write_pathway_presence_files
+from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE, MOTIF, MOTIF_PAIR
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HMMHit:
+    """Hit of an HMM on a protein (a row of hmm_results files)."""
+    organism: str
+    protein: str
+    hmm: str
+    evalue: float
+    score: float
+    length: int
+
+
+@dataclass
+class SearchResult:
+    """Results of the search of the HMM database on the protein sequences of an organism."""
+    name: str
+    hits: List[HMMHit] = field(default_factory=list)
+    function_presence: Dict[str, float] = field(default_factory=dict)
+    pathway_presence: Dict[str, int] = field(default_factory=dict)
+    pathway_hmms: Dict[str, str] = field(default_factory=dict)
+
+
+def read_input_sequences(input_sequences):
+    """Read protein sequences given as a path to a protein fasta file, the content of a fasta file, a dictionary or pyhmmer sequences.
+
+    Args:
+        input_sequences (str, dict or pyhmmer DigitalSequenceBlock): path to protein fasta file, protein sequences in fasta format,
+                                                                      dictionary with protein ID as key and protein sequence as value or DigitalSequenceBlock
+
+    Returns:
+        sequences (pyhmmer DigitalSequenceBlock): input protein sequences stored in pyhmmer object DigitalSequenceBlock
+    """
+    amino_alphabet = pyhmmer.easel.Alphabet.amino()
+    if isinstance(input_sequences, pyhmmer.easel.DigitalSequenceBlock):
+        sequences = input_sequences
+    elif isinstance(input_sequences, dict):
+        text_sequences = pyhmmer.easel.TextSequenceBlock([pyhmmer.easel.TextSequence(name=protein_id, sequence=protein_sequence)
+                                                          for protein_id, protein_sequence in input_sequences.items()])
+        sequences = text_sequences.digitize(amino_alphabet)
+    elif isinstance(input_sequences, str) and input_sequences.lstrip().startswith('>'):
+        with pyhmmer.easel.SequenceFile(io.BytesIO(input_sequences.encode('utf-8')), format='fasta', digital=True, alphabet=amino_alphabet) as seq_file:
+            sequences = seq_file.read_block()
+    else:
+        with pyhmmer.easel.SequenceFile(input_sequences, digital=True, alphabet=amino_alphabet) as seq_file:
+            sequences = seq_file.read_block()
+
+    return sequences
+
+
+class HMMDatabase:
+    """HMM database (HMM profiles, thresholds, functions and pathways) loaded once to search protein sequences in memory.
+
+    Example:
+        database = HMMDatabase()
+        search_result = database.search('org_1.faa')
+        pathway_presence = search_result.pathway_presence
+    """
+    def __init__(self, hmm_folder=HMM_FOLDER, hmm_template_file=HMM_TEMPLATE_FILE, pathway_template_file=PATHWAY_TEMPLATE_FILE,
+                 motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+        """Load the HMM database.
+
+        Args:
+            hmm_folder (str): path to HMM folder
+            hmm_template_file (str): path of HMM template file
+            pathway_template_file (str): path to pathway template file
+            motif_db (dict): dictionary containing gene name as key and motif to search as values
+            motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        """
+        self.hmm_folder = hmm_folder
+        self.hmm_template_file = hmm_template_file
+        self.pathway_template_file = pathway_template_file
+        self.motif_db = motif_db
+        self.motif_pair_db = motif_pair_db
+
+        self.hmm_thresholds = get_hmm_thresholds(hmm_template_file)
+        hmm_profiles, self.check_hmms = load_hmm_profiles(self.hmm_thresholds, hmm_folder)
+        # Profiles are optimized once, for both hmmsearch and hmmscan.
+        self.hmm_profiles, self.scan_profiles = optimize_hmm_profiles(hmm_profiles)
+        self.hmm_functions, self.hmm_to_functions = get_hmm_functions(hmm_template_file)
+        self.pathway_hmms, self.pathway_expression, self.sorted_pathways = get_diagram_pathways_hmms(pathway_template_file)
+
+    def search(self, input_sequences, name=None, pyhmmer_core=0, search_strategy='auto'):
+        """Search the HMMs of the database on protein sequences.
+
+        Args:
+            input_sequences (str, dict or pyhmmer DigitalSequenceBlock): protein sequences (see read_input_sequences)
+            name (str): name of the organism, by default the name of the protein fasta file (or 'input' for other sequences)
+            pyhmmer_core (int): number of core used by pyhmmer (0 to use all available cores)
+            search_strategy (str): 'search', 'scan' or 'auto' (hmmscan for a few sequences, hmmsearch otherwise)
+
+        Returns:
+            search_result (SearchResult): hits, function presences and pathway presences of the organism
+        """
+        if name is None:
+            if isinstance(input_sequences, (str, os.PathLike)) and os.path.isfile(input_sequences):
+                name = os.path.splitext(os.path.basename(input_sequences))[0]
+            else:
+                name = 'input'
+        sequences = read_input_sequences(input_sequences)
+
+        hmm_results = query_sequences(name, sequences, self.hmm_thresholds, self.hmm_profiles, self.check_hmms,
+                                      self.motif_db, self.motif_pair_db, pyhmmer_core, search_strategy, self.scan_profiles)
+        hmm_hits = {name: [hmm_result[2] for hmm_result in hmm_results]}
+        function_presences = compute_function_presences(hmm_hits, self.hmm_functions, self.hmm_to_functions)
+        _, org_pathways, org_pathways_hmms = check_diagram_pathways(self.sorted_pathways, self.pathway_expression, hmm_hits, self.pathway_hmms)
+
+        search_result = SearchResult(name, [HMMHit(*hmm_result) for hmm_result in hmm_results], function_presences[name],
+                                     org_pathways[name], org_pathways_hmms[name])
+
+        return search_result
+
+    def search_batch(self, inputs, pyhmmer_core=0, search_strategy='auto'):
+        """Search the HMMs of the database on several organisms, reusing the loaded HMM profiles.
+
+        Args:
+            inputs (list or dict): list of paths to protein fasta files or dictionary with organism name as key and its protein sequences as value
+            pyhmmer_core (int): number of core used by pyhmmer (0 to use all available cores)
+            search_strategy (str): 'search', 'scan' or 'auto' (hmmscan for a few sequences, hmmsearch otherwise)
+
+        Returns:
+            search_results (list): list of SearchResult (one per organism)
+        """
+        if isinstance(inputs, dict):
+            search_results = [self.search(input_sequences, name, pyhmmer_core, search_strategy) for name, input_sequences in inputs.items()]
+        else:
+            search_results = [self.search(input_sequences, pyhmmer_core=pyhmmer_core, search_strategy=search_strategy) for input_sequences in inputs]
+
+        return search_results
+
+
+def write_hit_files(search_results, hmm_output_folder):
+    """Write the hits of each organism in a tsv file (as the files of hmm_results folder).
+
+    Args:
+        search_results (list): list of SearchResult
+        hmm_output_folder (str): path to output folder
+    """
+    is_valid_dir(hmm_output_folder)
+    for search_result in search_results:
+        hmm_results = [[hit.organism, hit.protein, hit.hmm, hit.evalue, hit.score, hit.length] for hit in search_result.hits]
+        write_results(hmm_results, os.path.join(hmm_output_folder, search_result.name + '.tsv'))
+
+
+def write_presence_files(search_results, output_folder, database):
+    """Write function_presence.tsv, pathway_presence.tsv and pathway_presence_hmms.tsv for organisms.
+
+    Args:
+        search_results (list): list of SearchResult
+        output_folder (str): path to output folder
+        database (HMMDatabase): database used to search the organisms
+    """
+    is_valid_dir(output_folder)
+    org_list = [search_result.name for search_result in search_results]
+
+    function_presences = {search_result.name: search_result.function_presence for search_result in search_results}
+    write_function_presence_file(function_presences, list(database.hmm_functions), org_list, os.path.join(output_folder, 'function_presence.tsv'))
+
+    all_pathways = {pathway: sum(search_result.pathway_presence[pathway] for search_result in search_results) for pathway in database.sorted_pathways}
+    org_pathways = {search_result.name: search_result.pathway_presence for search_result in search_results}
+    org_pathways_hmms = {search_result.name: search_result.pathway_hmms for search_result in search_results}
+    write_pathway_presence_files(all_pathways, org_pathways, org_pathways_hmms, output_folder)
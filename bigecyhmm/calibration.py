@@ -0,0 +1,279 @@
+# Copyright (C) 2024-2026 Arnaud Belcour - Univ. Grenoble Alpes, Inria, Grenoble, France Microcosme
+# Univ. Grenoble Alpes, Inria, Microcosme
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import pyhmmer
+
+from multiprocessing import Pool
+
+from bigecyhmm import __version__ as bigecyhmm_version
+from bigecyhmm.utils import is_valid_dir, file_or_folder
+from bigecyhmm.hmm_search import get_hmm_thresholds, load_hmm_profiles, optimize_hmm_profiles, query_sequences, SEARCH_PROFILES
+from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, MOTIF, MOTIF_PAIR
+
+MESSAGE = '''
+Compare a search profile of bigecyhmm (such as fast) to the default search on a sample of protein fasta files: speedup and hits gained or lost for each HMM.
+'''
+REQUIRES = '''
+Requires: pyhmmer.
+'''
+
+logger = logging.getLogger('bigecyhmm')
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_SAMPLE_SIZE = 10
+
+
+def calibrate_input(input_filename, input_file_path, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR,
+                    search_profile='fast', pyhmmer_core=1):
+    """Search HMMs on a protein fasta file with the default search profile and with another search profile.
+
+    Args:
+        input_filename (str): name of protein fasta file
+        input_file_path (str): path of protein fasta file
+        hmm_thresholds (dict): threshold for each HMM
+        hmm_folder (str): path to HMM folder
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        search_profile (str): search profile compared to the default one (key of SEARCH_PROFILES)
+        pyhmmer_core (int): number of core used by pyhmmer
+
+    Returns:
+        input_calibration (dict): number of sequences, durations and hits (HMM basename as key and set of proteins as value) of each search profile
+    """
+    logger.info('Calibrate search profile {0} on {1}'.format(search_profile, input_file_path))
+    with pyhmmer.easel.SequenceFile(input_file_path, digital=True) as seq_file:
+        sequences = pyhmmer.easel.DigitalSequenceBlock(pyhmmer.easel.Alphabet.amino(), seq_file)
+
+    # Profiles are optimized once for both searches, so durations only measure the searches.
+    # HMMs are searched with hmmsearch, as in search_hmm (bigecyhmm --search-profile), whatever the number of sequences of the sample.
+    hmm_profiles, check_hmms = load_hmm_profiles(hmm_thresholds, hmm_folder)
+    optimized_profiles, _ = optimize_hmm_profiles(hmm_profiles)
+
+    input_calibration = {'nb_sequences': len(sequences), 'durations': {}, 'hits': {}}
+    for compared_search_profile in ['default', search_profile]:
+        start_time = time.perf_counter()
+        hmm_results = query_sequences(input_filename, sequences, hmm_thresholds, optimized_profiles, check_hmms, motif_db, motif_pair_db,
+                                      pyhmmer_core, search_strategy='search', search_profile=compared_search_profile)
+        input_calibration['durations'][compared_search_profile] = time.perf_counter() - start_time
+
+        profile_hits = {}
+        for hmm_result in hmm_results:
+            if hmm_result[2] not in profile_hits:
+                profile_hits[hmm_result[2]] = set()
+            profile_hits[hmm_result[2]].add(hmm_result[1])
+        input_calibration['hits'][compared_search_profile] = profile_hits
+
+    return input_calibration
+
+
+def calibrate_search_profile(input_variable, output_folder, search_profile='fast', sample_size=DEFAULT_SAMPLE_SIZE, core_number=1,
+                             hmm_folder=HMM_FOLDER, hmm_template_file=HMM_TEMPLATE_FILE, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+    """Compare a search profile to the default search on a sample of protein fasta files and write the speedup and the hits gained or lost for each HMM.
+    Hits are the ones kept with the thresholds of the HMM template file (as in hmm_results files).
+
+    Args:
+        input_variable (str): path to input file or folder
+        output_folder (str): path to output folder
+        search_profile (str): search profile compared to the default one (key of SEARCH_PROFILES)
+        sample_size (int): number of protein fasta files randomly sampled from the input folder
+        core_number (int): number of core to use for the multiprocessing
+        hmm_folder (str): path to HMM folder
+        hmm_template_file (str): path of HMM template file
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+
+    Returns:
+        calibration_summary (dict): durations of each search profile, speedup and number of hits gained or lost
+    """
+    if search_profile not in SEARCH_PROFILES or search_profile == 'default':
+        logger.critical('Search profile {0} can not be compared to default search profile, it must be one of {1}.'.format(
+                        search_profile, ', '.join([profile for profile in SEARCH_PROFILES if profile != 'default'])))
+        sys.exit(1)
+
+    input_dicts = file_or_folder(input_variable)
+    # The sample is reproducible for the same input folder.
+    sampled_inputs = sorted(input_dicts)
+    if len(sampled_inputs) > sample_size:
+        sampled_inputs = sorted(random.Random(0).sample(sampled_inputs, sample_size))
+    logger.info('Calibrate search profile {0} on {1} of {2} input files.'.format(search_profile, len(sampled_inputs), len(input_dicts)))
+
+    if len(sampled_inputs) == 1:
+        core_number = 1
+        pyhmmer_core = 0
+    else:
+        pyhmmer_core = 1
+
+    is_valid_dir(output_folder)
+    hmm_thresholds = get_hmm_thresholds(hmm_template_file)
+
+    calibration_pool = Pool(processes=core_number)
+    multiprocess_calibrations = [[input_filename, input_dicts[input_filename], hmm_thresholds, hmm_folder, motif_db, motif_pair_db,
+                                  search_profile, pyhmmer_core] for input_filename in sampled_inputs]
+    input_calibrations = calibration_pool.starmap(calibrate_input, multiprocess_calibrations)
+    calibration_pool.close()
+    calibration_pool.join()
+
+    # Hits of each HMM: organisms and proteins found with default and compared search profiles.
+    calibration_file = os.path.join(output_folder, 'calibration_{0}.tsv'.format(search_profile))
+    total_lost_hits = 0
+    total_gained_hits = 0
+    hmms_with_lost_hits = []
+    with open(calibration_file, 'w') as open_calibration_file:
+        csvwriter = csv.writer(open_calibration_file, delimiter='\t')
+        csvwriter.writerow(['HMM', 'threshold', 'default_hits', '{0}_hits'.format(search_profile), 'lost_hits', 'gained_hits',
+                            'lost_organisms', 'gained_organisms', 'lost_proteins'])
+        for hmm_filebasename in hmm_thresholds:
+            nb_hits = {'default': 0, search_profile: 0}
+            lost_proteins = []
+            gained_proteins = []
+            lost_organisms = 0
+            gained_organisms = 0
+            for input_filename, input_calibration in zip(sampled_inputs, input_calibrations):
+                default_proteins = input_calibration['hits']['default'].get(hmm_filebasename, set())
+                profile_proteins = input_calibration['hits'][search_profile].get(hmm_filebasename, set())
+                nb_hits['default'] += len(default_proteins)
+                nb_hits[search_profile] += len(profile_proteins)
+                lost_proteins.extend([input_filename + ':' + protein for protein in sorted(default_proteins - profile_proteins)])
+                gained_proteins.extend([input_filename + ':' + protein for protein in sorted(profile_proteins - default_proteins)])
+                # Presence of the HMM in the organism changed by the search profile.
+                if len(default_proteins) > 0 and len(profile_proteins) == 0:
+                    lost_organisms += 1
+                if len(default_proteins) == 0 and len(profile_proteins) > 0:
+                    gained_organisms += 1
+            total_lost_hits += len(lost_proteins)
+            total_gained_hits += len(gained_proteins)
+            if len(lost_proteins) > 0:
+                hmms_with_lost_hits.append(hmm_filebasename)
+            csvwriter.writerow([hmm_filebasename, hmm_thresholds[hmm_filebasename], nb_hits['default'], nb_hits[search_profile],
+                                len(lost_proteins), len(gained_proteins), lost_organisms, gained_organisms, ','.join(lost_proteins)])
+
+    default_duration = sum([input_calibration['durations']['default'] for input_calibration in input_calibrations])
+    profile_duration = sum([input_calibration['durations'][search_profile] for input_calibration in input_calibrations])
+    calibration_summary = {'search_profile': search_profile, 'pipeline_options': SEARCH_PROFILES[search_profile],
+                           'inputs': {input_filename: {'nb_sequences': input_calibration['nb_sequences'],
+                                                       'default_duration': input_calibration['durations']['default'],
+                                                       '{0}_duration'.format(search_profile): input_calibration['durations'][search_profile]}
+                                      for input_filename, input_calibration in zip(sampled_inputs, input_calibrations)},
+                           'default_duration': default_duration, '{0}_duration'.format(search_profile): profile_duration,
+                           'speedup': default_duration / profile_duration if profile_duration > 0 else None,
+                           'lost_hits': total_lost_hits, 'gained_hits': total_gained_hits, 'hmms_with_lost_hits': hmms_with_lost_hits,
+                           'bigecyhmm': bigecyhmm_version, 'pyhmmer': pyhmmer.__version__}
+
+    calibration_summary_file = os.path.join(output_folder, 'calibration_{0}.json'.format(search_profile))
+    with open(calibration_summary_file, 'w') as open_calibration_summary_file:
+        json.dump(calibration_summary, open_calibration_summary_file, indent=4)
+
+    logger.info('Default search: {0:.2f} seconds, {1} search: {2:.2f} seconds (speedup {3:.2f}).'.format(default_duration, search_profile,
+                                                                                                       profile_duration, calibration_summary['speedup'] or 0))
+    logger.info('Hits lost: {0} (for {1} HMMs), hits gained: {2}, see {3}.'.format(total_lost_hits, len(hmms_with_lost_hits), total_gained_hits,
+                                                                                   calibration_file))
+
+    return calibration_summary
+
+
+def main():
+    start_time = time.time()
+
+    parser = argparse.ArgumentParser(
+        'bigecyhmm_calibrate',
+        description=MESSAGE,
+        epilog=REQUIRES
+    )
+    parser.add_argument(
+        '--version',
+        action='version',
+        version='%(prog)s ' + bigecyhmm_version)
+
+    parser.add_argument(
+        '-i',
+        '--input',
+        dest='input',
+        required=True,
+        help='Input data, either a protein fasta file or a folder containing protein fasta files.',
+        metavar='INPUT_FILE_OR_FOLDER')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        required=True,
+        help='Output directory path.',
+        metavar='OUPUT_DIR')
+
+    parser.add_argument(
+        '--search-profile',
+        dest='search_profile',
+        help='Search profile compared to the default search (default: fast).',
+        required=False,
+        choices=[search_profile for search_profile in SEARCH_PROFILES if search_profile != 'default'],
+        default='fast')
+
+    parser.add_argument(
+        '--sample-size',
+        dest='sample_size',
+        help='Number of protein fasta files randomly sampled from the input folder (default: {0}).'.format(DEFAULT_SAMPLE_SIZE),
+        required=False,
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE)
+
+    parser.add_argument(
+        "-c",
+        "--core",
+        help="Number of cores for multiprocessing",
+        required=False,
+        type=int,
+        default=1)
+
+    args = parser.parse_args()
+
+    # If no argument print the help.
+    if len(sys.argv) == 1 or len(sys.argv) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    is_valid_dir(args.output)
+
+    # add logger in file
+    formatter = logging.Formatter('%(message)s')
+    log_file_path = os.path.join(args.output, 'bigecyhmm_calibrate.log')
+    file_handler = logging.FileHandler(log_file_path, 'w+')
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    # set up the default console logger
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+    logger.info("--- Launch search profile calibration ---")
+    calibrate_search_profile(args.input, args.output, args.search_profile, args.sample_size, args.core)
+
+    duration = time.time() - start_time
+    logger.info("--- Total runtime %.2f seconds ---" % (duration))
+    logger.warning(f'--- Logs written in {log_file_path} ---')
+
+
+if __name__ == '__main__':
+    main()
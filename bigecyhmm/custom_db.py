@@ -15,18 +15,24 @@
 
 import argparse
 import logging
+import io
 import json
+import mmap
 import os
 import shutil
 import csv
+import struct
 import sys
+import tempfile
 import time
 import pyhmmer
 
 from bigecyhmm.utils import is_valid_dir, file_or_folder
-from bigecyhmm.diagram_cycles import create_pathway_presence_files
-from bigecyhmm.hmm_search import get_hmm_thresholds, hmm_search_write_results, create_major_functions
-from bigecyhmm.utils import get_link_pathway_function_name, read_esmecata_proteome_file
+from bigecyhmm.profiling import profile_stage, enable_profiling, write_profiles
+from bigecyhmm.diagram_cycles import create_pathway_presence_files, get_diagram_pathways_hmms
+from bigecyhmm.hmm_search import get_hmm_thresholds, create_major_functions, get_hmm_digest, search_shared_hmms, select_shared_hits, write_results, \
+    get_file_digest, get_hmm_filter_settings, get_inclusion_score, select_previous_hits, HitTable
+from bigecyhmm.utils import write_pathway_function_names, read_esmecata_proteome_file
 from bigecyhmm.custom_tsv_parser import generate_custom_db_from_tsv_one_file
 from bigecyhmm import __version__ as bigecyhmm_version
 from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE, MOTIF, MOTIF_PAIR, CUSTOM_CARBON_CYCLE_NETWORK, \
@@ -37,6 +43,7 @@ from multiprocessing import Pool
 
 MESSAGE = '''
 Run bigecyhmm using a custom database (custom biogeochemical cycles with HMMs).
+Use bigecyhmm_custom compile to create a bundle file from a custom database.
 '''
 REQUIRES = '''
 Requires pyhmmer, networkx (with pygraphviz), matplotlib.
@@ -45,6 +52,15 @@ Requires pyhmmer, networkx (with pygraphviz), matplotlib.
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
+# Custom database bundle created by the compile subcommand.
+BUNDLE_EXTENSION = '.bigecyhmm'
+BUNDLE_MAGIC = b'BIGECYHMM_BUNDLE'
+BUNDLE_VERSION = 2
+# HMMs of the bundles loaded in the current process.
+BUNDLE_HMMS = {}
+# Margin (in bits) between threshold and inclusion score to reuse hits of a previous run searched with another search space size.
+INCLUSION_SCORE_MARGIN = 0.01
+
 try:
     import networkx as nx
     from networkx.readwrite import json_graph
@@ -52,6 +68,11 @@ except:
     logger.critical('networkx not installed, bigecyhmm_custom requires networkx installed: pip install networkx')
     sys.exit(1)
 
+try:
+    from matplotlib import __version__ as matplotlib_version
+except:
+    matplotlib_version = None
+
 
 def generate_pathway_file_from_json(custom_database_json, output_folder):
     """ Get pathway cycle data from custom json database.
@@ -160,27 +181,17 @@ def check_custom_db_input(custom_database_input, output_folder):
     return custom_hmm_template_file, custom_pathway_template_file, custom_bipartite_cycle_network, custom_hmm_folder
 
 
-def search_hmm_custom_db(input_variable, output_folder, hmm_folder=HMM_FOLDER, pathway_template_file=PATHWAY_TEMPLATE_FILE,
-                         hmm_template_file=HMM_TEMPLATE_FILE, core_number=1, motif_json=None, motif_pair_json=None, esmecata_output_folder=None):
-    """Main function to use HMM search on protein sequences and write results with a custom database.
+def check_custom_db_hmms(hmm_folder, pathway_template_file, hmm_template_file):
+    """Check that the HMMs of a custom database are consistent between HMM folder, pathway template file and HMM template file.
 
     Args:
-        input_variable (str): path to input file or folder
-        output_folder (str): path to output folder
         hmm_folder (str): path to HMM folder
         pathway_template_file (str): path to pathway tempalte file
         hmm_template_file (str): path to HMM template file
-        core_number (int): number of core to use for the multiprocessing
-        motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
-        motif_pair_json (str): JSON file containing association between two genes to check for predictions
-        esmecata_output_folder (str): path to esmecata output folder
-    """
-    start_time = time.time()
-    input_dicts = file_or_folder(input_variable)
-
-    hmm_output_folder = os.path.join(output_folder, 'hmm_results')
-    is_valid_dir(hmm_output_folder)
 
+    Returns:
+        hmm_thresholds (dict): threshold string for each HMM
+    """
     # Extract thresholds from HMM template file.
     hmm_thresholds = get_hmm_thresholds(hmm_template_file)
 
@@ -206,23 +217,310 @@ def search_hmm_custom_db(input_variable, output_folder, hmm_folder=HMM_FOLDER, p
         logger.critical("  Some HMMs present in {0} are not present in the HMM template file {1}: {2}".format(pathway_template_file, hmm_template_file, not_found_hmms))
         sys.exit(1)
 
-    # Map pathway to function name.
-    pathway_template_df = get_link_pathway_function_name(pathway_template_file, hmm_template_file)
-    mapping_pathway_function_file = os.path.join(output_folder, 'mapping_pathway_to_function_name.tsv')
-    pathway_template_df.to_csv(mapping_pathway_function_file, sep='\t', index=False)
+    return hmm_thresholds
 
-    # Get motif and motif_pair dictionaries.
+
+def read_motif_files(motif_json=None, motif_pair_json=None, default_motif_data=MOTIF, default_motif_pair_data=MOTIF_PAIR):
+    """Read motif and motif pair JSON files.
+
+    Args:
+        motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
+        motif_pair_json (str): JSON file containing association between two genes to check for predictions
+        default_motif_data (dict): motifs used if no motif_json is given
+        default_motif_pair_data (dict): motif pairs used if no motif_pair_json is given
+
+    Returns:
+        motif_data (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_data (dict): dictionary containing gene name as key and a second gene name as values
+    """
     if motif_json is not None:
         with open(motif_json, 'r') as open_motif_json:
             motif_data = json.load(open_motif_json)
     else:
-        motif_data = MOTIF
+        motif_data = default_motif_data
 
     if motif_pair_json is not None:
         with open(motif_pair_json, 'r') as open_motif_json:
             motif_pair_data = json.load(open_motif_json)
     else:
-        motif_pair_data = MOTIF_PAIR
+        motif_pair_data = default_motif_pair_data
+
+    return motif_data, motif_pair_data
+
+
+def plan_custom_db_searches(custom_databases):
+    """Merge the HMMs of several custom databases so that each HMM is searched only once on each protein fasta file.
+    HMMs are identified by the digest of their file, so the same HMM found in different HMM folders is searched once.
+
+    Args:
+        custom_databases (list): list of dictionaries (one per custom database) with output_folder, hmm_folder and hmm_thresholds as keys
+
+    Returns:
+        shared_hmms (dict): HMM digest as key and tuple (path of HMM file, smallest search space size of the databases using it) as value
+        custom_db_searches (list): list of dictionaries (one per custom database) containing the HMMs (basename and digest), thresholds,
+                                   search space size, check HMMs and HMM result folder of the database
+    """
+    shared_hmms = {}
+    hmm_digests = {}
+    custom_db_searches = []
+    for custom_database in custom_databases:
+        hmm_folder = custom_database['hmm_folder']
+        hmm_thresholds = custom_database['hmm_thresholds']
+        list_of_hmms = [hmm_filename for hmm_filename in os.listdir(hmm_folder) if hmm_filename.endswith('.hmm') and 'check' not in hmm_filename and hmm_filename in hmm_thresholds]
+        # As in query_fasta_file, the search space size of a database is its number of searched HMMs.
+        search_space_size = len(list_of_hmms)
+
+        database_hmms = []
+        for hmm_filebasename in list_of_hmms:
+            hmm_filename = os.path.join(hmm_folder, hmm_filebasename)
+            if hmm_filename not in hmm_digests:
+                hmm_digests[hmm_filename] = get_hmm_digest(hmm_filename)
+            hmm_digest = hmm_digests[hmm_filename]
+            if hmm_digest not in shared_hmms or search_space_size < shared_hmms[hmm_digest][1]:
+                shared_hmms[hmm_digest] = (hmm_filename, search_space_size)
+            database_hmms.append((hmm_filebasename, hmm_digest))
+
+        check_hmms = {hmm_filename.replace('.check.hmm', ''): os.path.join(hmm_folder, hmm_filename)
+                      for hmm_filename in os.listdir(hmm_folder) if hmm_filename.endswith('.hmm') and 'check' in hmm_filename}
+        custom_db_searches.append({'hmms': database_hmms, 'hmm_thresholds': hmm_thresholds, 'search_space_size': search_space_size,
+                                   'check_hmms': check_hmms, 'hmm_output_folder': os.path.join(custom_database['output_folder'], 'hmm_results')})
+
+    logger.info("  -> {0} distinct HMMs for {1} custom database(s).".format(len(shared_hmms), len(custom_databases)))
+
+    return shared_hmms, custom_db_searches
+
+
+def read_previous_run(previous_run_folder):
+    """Read the HMM search settings of a previous bigecyhmm run to reuse its hits.
+
+    Args:
+        previous_run_folder (str): path to output folder of a previous bigecyhmm run
+
+    Returns:
+        previous_run (dict): path to hmm_results folder, search space size, digests of input files and HMM settings (HMM digest as key
+                             and tuple (HMM basename, settings) as value) of the previous run, None if its HMM search settings are not usable
+    """
+    metadata_file = os.path.join(previous_run_folder, 'bigecyhmm_metadata.json')
+    if not os.path.exists(metadata_file):
+        logger.critical("  No bigecyhmm_metadata.json file in {0}, it is not a bigecyhmm output folder.".format(previous_run_folder))
+        sys.exit(1)
+
+    with open(metadata_file, 'r') as open_metadata_file:
+        metadata_json = json.load(open_metadata_file)
+
+    if 'hmm_search' not in metadata_json:
+        logger.warning("  -> {0} has been created by a bigecyhmm version not storing the HMM search settings, its hits will not be reused.".format(previous_run_folder))
+        return None
+    # Hits can change between HMMER versions.
+    previous_pyhmmer_version = metadata_json['tool_dependencies']['python_package']['pyhmmer']
+    if previous_pyhmmer_version != pyhmmer.__version__:
+        logger.warning("  -> {0} has been created with pyhmmer {1} (current one is {2}), its hits will not be reused.".format(previous_run_folder, previous_pyhmmer_version, pyhmmer.__version__))
+        return None
+    # Hits of a search with tightened pipeline filters (bigecyhmm --search-profile fast) can miss hits of the default search.
+    previous_search_profile = metadata_json['hmm_search'].get('search_profile', 'default')
+    if previous_search_profile != 'default':
+        logger.warning("  -> {0} has been created with the {1} search profile, its hits will not be reused.".format(previous_run_folder, previous_search_profile))
+        return None
+
+    previous_hmms = {}
+    for hmm_filebasename, hmm_settings in metadata_json['hmm_search']['hmms'].items():
+        if hmm_settings['digest'] not in previous_hmms:
+            previous_hmms[hmm_settings['digest']] = (hmm_filebasename, hmm_settings)
+
+    previous_run = {'hmm_results_folder': os.path.join(previous_run_folder, 'hmm_results'), 'search_space_size': metadata_json['hmm_search']['search_space_size'],
+                    'input_digests': metadata_json['hmm_search']['input_digests'], 'hmms': previous_hmms}
+
+    return previous_run
+
+
+def plan_previous_hits_reuse(previous_run, shared_hmms, custom_db_searches, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, custom_db_bundle=None):
+    """Find the HMMs of each custom database whose hits can be taken from a previous bigecyhmm run.
+    An HMM is reused if the previous run searched the same HMM file (same digest) with the same threshold and filter settings.
+    The previous hits have been included with the previous search space size Z, so they are also the hits of the database if:
+    the database has the same Z, or (for full sequence threshold) the database has a larger Z (hits are filtered with their new e-value)
+    or the threshold is above the score needed to be included with the previous Z (all hits above the threshold are in the previous results).
+
+    Args:
+        previous_run (dict): previous run settings from read_previous_run
+        shared_hmms (dict): HMM digest as key and tuple (path of HMM file or HMM digest in bundle, search space size) as value
+        custom_db_searches (list): list of dictionaries (one per custom database) from plan_custom_db_searches
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        custom_db_bundle (str): path to bundle file containing the HMMs (identified by their digest in shared_hmms and check HMMs)
+
+    Returns:
+        reused_hmms (list): for each custom database, a dictionary with HMM basename as key and basename of the HMM in previous run as value
+        searched_hmms (dict): shared_hmms restricted to the HMMs still searched by at least one custom database
+    """
+    previous_search_space_size = previous_run['search_space_size']
+    if custom_db_bundle is not None:
+        bundle_hmms = load_custom_db_bundle_hmms(custom_db_bundle)
+
+    reused_hmms = []
+    searched_hmm_digests = set()
+    for custom_db_search in custom_db_searches:
+        search_space_size = custom_db_search['search_space_size']
+        # In a bundle, check HMMs are already identified by their digest.
+        if custom_db_bundle is not None:
+            check_hmm_digests = custom_db_search['check_hmms']
+        else:
+            check_hmm_digests = {check_hmm_name: get_hmm_digest(check_hmm_filename) for check_hmm_name, check_hmm_filename in custom_db_search['check_hmms'].items()}
+
+        database_reused_hmms = {}
+        for hmm_filebasename, hmm_digest in custom_db_search['hmms']:
+            reuse_hmm = False
+            if hmm_digest in previous_run['hmms']:
+                previous_hmm_filebasename, previous_settings = previous_run['hmms'][hmm_digest]
+                hmm_threshold = custom_db_search['hmm_thresholds'][hmm_filebasename]
+                filter_settings = get_hmm_filter_settings(hmm_filebasename.replace('.hmm', ''), check_hmm_digests, motif_db, motif_pair_db)
+                same_settings = previous_settings['threshold'] == hmm_threshold and all(previous_settings[setting] == filter_settings[setting] for setting in filter_settings)
+                if same_settings:
+                    # As in query_fasta_file, only the first threshold is applied.
+                    threshold, threshold_type = hmm_threshold.split(', ')[0].split('|')
+                    if search_space_size == previous_search_space_size:
+                        reuse_hmm = True
+                    elif threshold_type == 'full':
+                        if search_space_size > previous_search_space_size:
+                            reuse_hmm = True
+                        else:
+                            if custom_db_bundle is not None:
+                                hmms = bundle_hmms[hmm_digest]
+                            else:
+                                with pyhmmer.plan7.HMMFile(shared_hmms[hmm_digest][0]) as hmm_file:
+                                    hmms = list(hmm_file)
+                            # Small margin to not depend on the rounding of scores at the inclusion limit.
+                            reuse_hmm = float(threshold) > get_inclusion_score(hmms, previous_search_space_size) + INCLUSION_SCORE_MARGIN
+            if reuse_hmm:
+                database_reused_hmms[hmm_filebasename] = previous_hmm_filebasename
+            else:
+                searched_hmm_digests.add(hmm_digest)
+
+        reused_hmms.append(database_reused_hmms)
+        logger.info("  -> {0} of {1} HMMs of {2} reused from previous run.".format(len(database_reused_hmms), len(custom_db_search['hmms']),
+                                                                                    os.path.basename(os.path.dirname(custom_db_search['hmm_output_folder']))))
+
+    searched_hmms = {hmm_digest: shared_hmms[hmm_digest] for hmm_digest in shared_hmms if hmm_digest in searched_hmm_digests}
+
+    return reused_hmms, searched_hmms
+
+
+def read_previous_hits(hmm_results_file):
+    """Read the hits of a previous hmm_results file.
+
+    Args:
+        hmm_results_file (str): path to hmm_results tsv file of a previous run
+
+    Returns:
+        previous_hits (dict): HMM basename as key and HitTable of the hits of the HMM as value
+    """
+    previous_hits = {}
+    with open(hmm_results_file, 'r') as open_hmm_results_file:
+        csvreader = csv.reader(open_hmm_results_file, delimiter='\t')
+        next(csvreader)
+        for line in csvreader:
+            hmm_filebasename = line[2]
+            if hmm_filebasename not in previous_hits:
+                previous_hits[hmm_filebasename] = HitTable()
+            previous_hits[hmm_filebasename].append(line)
+
+    return previous_hits
+
+
+@profile_stage('search')
+def hmm_search_custom_dbs_write_results(input_file_path, shared_hmms, custom_db_searches, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, custom_db_bundle=None,
+                                        previous_hits=None):
+    """Little functions for the starmap multiprocessing to search the HMMs of all custom databases on a protein fasta file and write the results of each database.
+
+    Args:
+        input_file_path (str): path of protein fasta file
+        shared_hmms (dict): HMM digest as key and tuple (path of HMM file or HMM digest in bundle, search space size) as value
+        custom_db_searches (list): list of dictionaries (one per custom database) from plan_custom_db_searches
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        custom_db_bundle (str): path to bundle file containing the HMMs (identified by their digest in shared_hmms and check HMMs)
+        previous_hits (dict): hmm_results file and search space size of a previous run for the protein fasta file and the HMMs reused by
+                              each custom database (from plan_previous_hits_reuse), None if no hits are reused
+    """
+    logger.info('Search for HMMs on ' + input_file_path)
+    input_filename = os.path.splitext(os.path.basename(input_file_path))[0]
+
+    # Extract the sequence from the protein fasta files.
+    with pyhmmer.easel.SequenceFile(input_file_path, digital=True) as seq_file:
+        sequences = pyhmmer.easel.DigitalSequenceBlock(pyhmmer.easel.Alphabet.amino(), seq_file)
+
+    if custom_db_bundle is not None:
+        bundle_hmms = load_custom_db_bundle_hmms(custom_db_bundle)
+        shared_hmms = {hmm_digest: (bundle_hmms[hmm_digest], search_space_size) for hmm_digest, (_, search_space_size) in shared_hmms.items()}
+
+    shared_hits = search_shared_hmms(sequences, shared_hmms)
+
+    if previous_hits is not None:
+        previous_results = read_previous_hits(previous_hits['hmm_results_file'])
+
+    for custom_db_index, custom_db_search in enumerate(custom_db_searches):
+        check_hmms = custom_db_search['check_hmms']
+        if custom_db_bundle is not None:
+            check_hmms = {check_hmm_name: bundle_hmms[check_hmm_digest] for check_hmm_name, check_hmm_digest in check_hmms.items()}
+        if previous_hits is not None:
+            reused_hmms = previous_hits['reused_hmms'][custom_db_index]
+        else:
+            reused_hmms = {}
+        hmm_results = HitTable()
+        # The filtering stage is opened once for all the HMMs of the database, not for each HMM.
+        with profile_stage('filtering'):
+            for hmm_filebasename, hmm_digest in custom_db_search['hmms']:
+                if hmm_filebasename in reused_hmms:
+                    hmm_results.extend(select_previous_hits(input_filename, hmm_filebasename, previous_results.get(reused_hmms[hmm_filebasename], HitTable()),
+                                                            previous_hits['search_space_size'], custom_db_search['search_space_size']))
+                else:
+                    hmm_results.extend(select_shared_hits(input_filename, hmm_filebasename, shared_hits[hmm_digest],
+                                                          custom_db_search['hmm_thresholds'][hmm_filebasename], custom_db_search['search_space_size'],
+                                                          sequences, check_hmms, motif_db, motif_pair_db))
+        output_file = os.path.join(custom_db_search['hmm_output_folder'], input_filename + '.tsv')
+        write_results(hmm_results, output_file)
+
+
+def search_hmm_custom_dbs(input_variable, custom_databases, core_number=1, motif_json=None, motif_pair_json=None, esmecata_output_folder=None,
+                          custom_db_bundle=None, previous_run_folder=None):
+    """Main function to use HMM search on protein sequences and write results with several custom databases.
+    Each HMM is searched once on each protein fasta file, then the thresholds of each database are applied to the shared hits.
+
+    Args:
+        input_variable (str): path to input file or folder
+        custom_databases (list): list of dictionaries (one per custom database) with output_folder, hmm_folder, pathway_template_file and hmm_template_file as keys
+        core_number (int): number of core to use for the multiprocessing
+        motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
+        motif_pair_json (str): JSON file containing association between two genes to check for predictions
+        esmecata_output_folder (str): path to esmecata output folder
+        custom_db_bundle (str): path to the bundle from which custom_databases have been extracted, its HMMs and search plan are used without checking the databases again
+        previous_run_folder (str): path to output folder of a previous bigecyhmm run on the same protein fasta files, whose hits are reused for HMMs with the same settings
+    """
+    start_time = time.time()
+    input_dicts = file_or_folder(input_variable)
+
+    if custom_db_bundle is not None:
+        bundle_metadata, bundle_mmap, hmm_start = read_custom_db_bundle(custom_db_bundle)
+        bundle_mmap.close()
+
+    checked_custom_databases = []
+    for custom_database in custom_databases:
+        output_folder = custom_database['output_folder']
+        hmm_output_folder = os.path.join(output_folder, 'hmm_results')
+        is_valid_dir(hmm_output_folder)
+
+        if custom_db_bundle is None:
+            hmm_thresholds = check_custom_db_hmms(custom_database['hmm_folder'], custom_database['pathway_template_file'], custom_database['hmm_template_file'])
+            checked_custom_databases.append({**custom_database, 'hmm_thresholds': hmm_thresholds})
+
+        # Map pathway to function name.
+        mapping_pathway_function_file = os.path.join(output_folder, 'mapping_pathway_to_function_name.tsv')
+        write_pathway_function_names(custom_database['pathway_template_file'], custom_database['hmm_template_file'], mapping_pathway_function_file)
+
+    # Get motif and motif_pair dictionaries.
+    if custom_db_bundle is not None:
+        motif_data, motif_pair_data = read_motif_files(motif_json, motif_pair_json, bundle_metadata['motif'], bundle_metadata['motif_pair'])
+    else:
+        motif_data, motif_pair_data = read_motif_files(motif_json, motif_pair_json)
 
     # Get observation name and taxon names from esmecata.
     if esmecata_output_folder is not None:
@@ -237,62 +535,109 @@ def search_hmm_custom_db(input_variable, output_folder, hmm_folder=HMM_FOLDER, p
             else:
                 tax_id_names_observation_names[tax_id_name].append(observation_name)
 
-    hmm_search_pool = Pool(processes=core_number)
+    if custom_db_bundle is None:
+        shared_hmms, custom_db_searches = plan_custom_db_searches(checked_custom_databases)
+    else:
+        # The search plan has been computed when compiling the bundle, HMMs are identified by their digest in the bundle.
+        shared_hmms = {hmm_digest: (hmm_digest, search_space_size) for hmm_digest, search_space_size in bundle_metadata['shared_hmms'].items()}
+        custom_db_searches = [{'hmms': bundle_database['hmms'], 'hmm_thresholds': bundle_database['hmm_thresholds'],
+                               'search_space_size': bundle_database['search_space_size'], 'check_hmms': bundle_database['check_hmms'],
+                               'hmm_output_folder': os.path.join(custom_database['output_folder'], 'hmm_results')}
+                              for bundle_database, custom_database in zip(bundle_metadata['databases'], custom_databases)]
+
+    if previous_run_folder is not None:
+        logger.info("  -> Read previous bigecyhmm run {0}.".format(previous_run_folder))
+        previous_run = read_previous_run(previous_run_folder)
+    else:
+        previous_run = None
+    if previous_run is not None:
+        reused_hmms, searched_hmms = plan_previous_hits_reuse(previous_run, shared_hmms, custom_db_searches, motif_data, motif_pair_data, custom_db_bundle)
+        logger.info("  -> {0} of {1} distinct HMMs to search on protein fasta files of the previous run.".format(len(searched_hmms), len(shared_hmms)))
 
     multiprocess_input_hmm_searches = []
     for input_filename in input_dicts:
-        output_file = os.path.join(hmm_output_folder, input_filename + '.tsv')
         input_file_path = input_dicts[input_filename]
-        multiprocess_input_hmm_searches.append([input_file_path, output_file, hmm_thresholds, hmm_folder, motif_data, motif_pair_data])
-
-    hmm_search_pool.starmap(hmm_search_write_results, multiprocess_input_hmm_searches)
-
-    hmm_search_pool.close()
-    hmm_search_pool.join()
+        # Hits of the previous run are only reused if it has been run on the same protein fasta file.
+        if previous_run is not None:
+            previous_hmm_results_file = os.path.join(previous_run['hmm_results_folder'], input_filename + '.tsv')
+        if previous_run is not None and previous_run['input_digests'].get(input_filename) == get_file_digest(input_file_path) and os.path.exists(previous_hmm_results_file):
+            previous_hits = {'hmm_results_file': previous_hmm_results_file, 'search_space_size': previous_run['search_space_size'], 'reused_hmms': reused_hmms}
+            multiprocess_input_hmm_searches.append([input_file_path, searched_hmms, custom_db_searches, motif_data, motif_pair_data, custom_db_bundle, previous_hits])
+        else:
+            if previous_run is not None:
+                logger.info("  -> {0} not found in previous run, all HMMs are searched on it.".format(input_file_path))
+            multiprocess_input_hmm_searches.append([input_file_path, shared_hmms, custom_db_searches, motif_data, motif_pair_data, custom_db_bundle, None])
 
-    logger.info("  -> Create output files.")
-    function_matrix_file = os.path.join(output_folder, 'function_presence.tsv')
-    create_major_functions(hmm_output_folder, function_matrix_file, hmm_template_file)
-    create_pathway_presence_files(hmm_output_folder, output_folder, pathway_template_file)
+    # The pool is created once the previous run has been validated, as read_previous_run can exit.
+    with Pool(processes=core_number) as hmm_search_pool:
+        hmm_search_pool.starmap(hmm_search_custom_dbs_write_results, multiprocess_input_hmm_searches)
+        hmm_search_pool.close()
+        hmm_search_pool.join()
 
     duration = time.time() - start_time
-    metadata_json = {}
-    metadata_json['tool_dependencies'] = {}
-    metadata_json['tool_dependencies']['python_package'] = {}
-    metadata_json['tool_dependencies']['python_package']['Python_version'] = sys.version
-    metadata_json['tool_dependencies']['python_package']['bigecyhmm'] = bigecyhmm_version
-    metadata_json['tool_dependencies']['python_package']['pyhmmer'] = pyhmmer.__version__
-    metadata_json['tool_dependencies']['python_package']['networkx'] = nx.__version__
+    for custom_database in custom_databases:
+        output_folder = custom_database['output_folder']
+        hmm_output_folder = os.path.join(output_folder, 'hmm_results')
+        logger.info("  -> Create output files in {0}.".format(output_folder))
+        with profile_stage('aggregation'):
+            function_matrix_file = os.path.join(output_folder, 'function_presence.tsv')
+            create_major_functions(hmm_output_folder, function_matrix_file, custom_database['hmm_template_file'])
+            create_pathway_presence_files(hmm_output_folder, output_folder, custom_database['pathway_template_file'])
+
+        metadata_json = {}
+        metadata_json['tool_dependencies'] = {}
+        metadata_json['tool_dependencies']['python_package'] = {}
+        metadata_json['tool_dependencies']['python_package']['Python_version'] = sys.version
+        metadata_json['tool_dependencies']['python_package']['bigecyhmm'] = bigecyhmm_version
+        metadata_json['tool_dependencies']['python_package']['pyhmmer'] = pyhmmer.__version__
+        metadata_json['tool_dependencies']['python_package']['networkx'] = nx.__version__
+
+        metadata_json['input_parameters'] = {'input_variable': input_variable, 'output_folder': output_folder, 'core_number': core_number,
+                                             'motif_json': motif_json, 'motif_pair_json': motif_pair_json, 'esmecata_output_folder': esmecata_output_folder,
+                                             'previous_run_folder': previous_run_folder}
+        metadata_json['input_parameters']['custom_db'] = {'hmm_folder': custom_database['hmm_folder'], 'hmm_template_file': custom_database['hmm_template_file'],
+                                                          'pathway_template_file': custom_database['pathway_template_file']}
+
+        # The HMM search is shared between the databases, so the duration is the one of the search of all databases.
+        metadata_json['duration'] = duration
+
+        metadata_file = os.path.join(output_folder, 'bigecyhmm_custom_metadata.json')
+        with open(metadata_file, 'w') as ouput_file:
+            json.dump(metadata_json, ouput_file, indent=4)
 
-    metadata_json['input_parameters'] = {'input_variable': input_variable, 'output_folder': output_folder, 'core_number': core_number,
-                                         'motif_json': motif_json, 'motif_pair_json': motif_pair_json, 'esmecata_output_folder': esmecata_output_folder}
-    metadata_json['input_parameters']['custom_db'] = {'hmm_folder': hmm_folder, 'hmm_template_file': hmm_template_file,
-                                                      'pathway_template_file': pathway_template_file}
 
-    metadata_json['duration'] = duration
-
-    metadata_file = os.path.join(output_folder, 'bigecyhmm_custom_metadata.json')
-    with open(metadata_file, 'w') as ouput_file:
-        json.dump(metadata_json, ouput_file, indent=4)
-
-
-def identify_run_custom_db_search(input_variable, custom_database_folder, output_folder, core_number=1, motif_json=None, motif_pair_json=None,
-                         esmecata_output_folder=None):
+def search_hmm_custom_db(input_variable, output_folder, hmm_folder=HMM_FOLDER, pathway_template_file=PATHWAY_TEMPLATE_FILE,
+                         hmm_template_file=HMM_TEMPLATE_FILE, core_number=1, motif_json=None, motif_pair_json=None, esmecata_output_folder=None):
     """Main function to use HMM search on protein sequences and write results with a custom database.
 
     Args:
         input_variable (str): path to input file or folder
-        custom_database_folder (str): path to file/folder containing custom database
         output_folder (str): path to output folder
+        hmm_folder (str): path to HMM folder
+        pathway_template_file (str): path to pathway tempalte file
+        hmm_template_file (str): path to HMM template file
         core_number (int): number of core to use for the multiprocessing
         motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
         motif_pair_json (str): JSON file containing association between two genes to check for predictions
         esmecata_output_folder (str): path to esmecata output folder
     """
-    start_time = time.time()
+    custom_database = {'output_folder': output_folder, 'hmm_folder': hmm_folder, 'pathway_template_file': pathway_template_file,
+                       'hmm_template_file': hmm_template_file}
+    search_hmm_custom_dbs(input_variable, [custom_database], core_number=core_number, motif_json=motif_json, motif_pair_json=motif_pair_json,
+                          esmecata_output_folder=esmecata_output_folder)
 
-    is_valid_dir(output_folder)
 
+def resolve_custom_database_input(custom_database_folder, output_folder):
+    """Resolve internal database names and find the custom database files (json or tsv) of the input.
+
+    Args:
+        custom_database_folder (str): path to file/folder containing custom database or name of an internal database
+        output_folder (str): path to output folder (used to write the json file of internal_all)
+
+    Returns:
+        custom_database_folder (str): path to file/folder containing custom database
+        input_dicts (dict): custom database name as key and path to its file as value
+    """
     # Search for json files in input custom database.
     if custom_database_folder == 'internal_hydrogen_table':
         custom_database_folder = CUSTOM_HYDROGEN_TABLE
@@ -327,24 +672,266 @@ def identify_run_custom_db_search(input_variable, custom_database_folder, output
     second_extension_to_checks = ['.tsv']
     input_dicts = file_or_folder(custom_database_folder, json_extensions, second_extension_to_checks)
 
+    return custom_database_folder, input_dicts
+
+
+def prepare_custom_databases(input_dicts, output_folder):
+    """Generate the files of each custom database in its output folder.
+
+    Args:
+        input_dicts (dict): custom database name as key and path to its file as value
+        output_folder (str): path to output folder
+
+    Returns:
+        custom_databases (list): list of dictionaries (one per custom database) with output_folder, hmm_folder, pathway_template_file,
+                                 hmm_template_file and input_graph_file as keys
+    """
+    custom_databases = []
     for input_filename in input_dicts:
-        logger.info("Launch HMM search on custom database {0}.".format(input_filename))
+        logger.info("Prepare custom database {0}.".format(input_filename))
 
         # Create specific output folder for custom database.
         output_folder_custom_db = os.path.join(output_folder, input_filename)
         is_valid_dir(output_folder_custom_db)
 
-        # Generate custom database files from input file.
+        # Generate custom database files from input file (in the folder of the custom database, as all databases are searched together).
         custom_database_file = input_dicts[input_filename]
-        custom_hmm_template_file, custom_pathway_template_file, custom_bipartite_cycle_file, custom_hmm_folder = check_custom_db_input(custom_database_file, output_folder)
-
-        search_hmm_custom_db(input_variable, output_folder_custom_db, custom_hmm_folder, custom_pathway_template_file,
-                            custom_hmm_template_file, core_number=core_number, motif_json=motif_json, motif_pair_json=motif_pair_json,
-                            esmecata_output_folder=esmecata_output_folder)
+        custom_hmm_template_file, custom_pathway_template_file, custom_bipartite_cycle_file, custom_hmm_folder = check_custom_db_input(custom_database_file, output_folder_custom_db)
 
         input_graph_file = os.path.join(output_folder_custom_db, 'input_graph.graphml')
         shutil.copyfile(custom_bipartite_cycle_file, input_graph_file)
 
+        custom_databases.append({'output_folder': output_folder_custom_db, 'hmm_folder': custom_hmm_folder, 'pathway_template_file': custom_pathway_template_file,
+                                 'hmm_template_file': custom_hmm_template_file, 'input_graph_file': input_graph_file})
+
+    return custom_databases
+
+
+def compile_custom_db(custom_database_folder, bundle_file, motif_json=None, motif_pair_json=None):
+    """Compile custom database(s) into a single bundle file, so that later searches do not have to parse and check the database again.
+    The bundle contains: a header (BUNDLE_MAGIC and the size of the metadata), the metadata as json (thresholds, HMM template file, parsed pathways, graph,
+    motif tables and HMMs of each database) and the HMMs of all databases, written once in HMMER binary format.
+
+    Args:
+        custom_database_folder (str): path to file/folder containing custom database or name of an internal database
+        bundle_file (str): path to output bundle file (with BUNDLE_EXTENSION)
+        motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
+        motif_pair_json (str): JSON file containing association between two genes to check for predictions
+    """
+    start_time = time.time()
+    if not bundle_file.endswith(BUNDLE_EXTENSION):
+        logger.critical("  Custom database bundle file {0} must end with {1}.".format(bundle_file, BUNDLE_EXTENSION))
+        sys.exit(1)
+
+    motif_data, motif_pair_data = read_motif_files(motif_json, motif_pair_json)
+
+    with tempfile.TemporaryDirectory() as work_folder:
+        resolved_custom_database_folder, input_dicts = resolve_custom_database_input(custom_database_folder, work_folder)
+        custom_databases = prepare_custom_databases(input_dicts, work_folder)
+        for custom_database in custom_databases:
+            custom_database['hmm_thresholds'] = check_custom_db_hmms(custom_database['hmm_folder'], custom_database['pathway_template_file'], custom_database['hmm_template_file'])
+        shared_hmms, custom_db_searches = plan_custom_db_searches(custom_databases)
+
+        # HMM files to store, including the check HMMs used by motif pairs.
+        bundle_hmm_files = {hmm_digest: shared_hmms[hmm_digest][0] for hmm_digest in shared_hmms}
+        bundle_databases = []
+        for custom_database, custom_db_search in zip(custom_databases, custom_db_searches):
+            check_hmms = {}
+            for check_hmm_name, check_hmm_filename in custom_db_search['check_hmms'].items():
+                check_hmm_digest = get_hmm_digest(check_hmm_filename)
+                bundle_hmm_files[check_hmm_digest] = check_hmm_filename
+                check_hmms[check_hmm_name] = check_hmm_digest
+
+            bundle_database = {'name': os.path.basename(custom_database['output_folder']), 'hmms': custom_db_search['hmms'],
+                               'hmm_thresholds': custom_db_search['hmm_thresholds'], 'search_space_size': custom_db_search['search_space_size'],
+                               'check_hmms': check_hmms}
+            for file_key, bundle_key in [('hmm_template_file', 'hmm_template'), ('input_graph_file', 'input_graph')]:
+                with open(custom_database[file_key], 'r') as open_database_file:
+                    bundle_database[bundle_key] = open_database_file.read()
+            # Pathways are stored parsed, so that the pathway template does not have to be parsed again.
+            pathway_hmms, pathway_expression, sorted_pathways = get_diagram_pathways_hmms(custom_database['pathway_template_file'])
+            bundle_database['pathways'] = {'pathway_hmms': pathway_hmms, 'pathway_expression': pathway_expression, 'sorted_pathways': sorted_pathways}
+            bundle_databases.append(bundle_database)
+
+        # Write HMMs in binary format, which is faster to read than the text format.
+        hmm_buffer = io.BytesIO()
+        hmm_index = {}
+        for hmm_digest, hmm_filename in bundle_hmm_files.items():
+            hmm_offset = hmm_buffer.tell()
+            with pyhmmer.plan7.HMMFile(hmm_filename) as hmm_file:
+                for hmm in hmm_file:
+                    hmm.write(hmm_buffer, binary=True)
+            hmm_index[hmm_digest] = [hmm_offset, hmm_buffer.tell() - hmm_offset]
+
+    bundle_metadata = {'bundle_version': BUNDLE_VERSION, 'bigecyhmm': bigecyhmm_version, 'pyhmmer': pyhmmer.__version__,
+                       'custom_database': resolved_custom_database_folder, 'motif': motif_data, 'motif_pair': motif_pair_data,
+                       'shared_hmms': {hmm_digest: shared_hmms[hmm_digest][1] for hmm_digest in shared_hmms},
+                       'hmm_index': hmm_index, 'databases': bundle_databases}
+    bundle_metadata_bytes = json.dumps(bundle_metadata).encode('utf-8')
+
+    bundle_folder = os.path.dirname(bundle_file)
+    if bundle_folder != '':
+        is_valid_dir(bundle_folder)
+    with open(bundle_file, 'wb') as open_bundle_file:
+        open_bundle_file.write(BUNDLE_MAGIC)
+        open_bundle_file.write(struct.pack('<Q', len(bundle_metadata_bytes)))
+        open_bundle_file.write(bundle_metadata_bytes)
+        open_bundle_file.write(hmm_buffer.getbuffer())
+
+    duration = time.time() - start_time
+    logger.info("  -> Custom database bundle {0} written ({1} database(s), {2} HMM files) in {3:.2f} seconds.".format(bundle_file, len(bundle_databases),
+                                                                                                                  len(hmm_index), duration))
+
+
+def read_custom_db_bundle(bundle_file):
+    """Memory-map a custom database bundle and read its metadata.
+
+    Args:
+        bundle_file (str): path to bundle file
+
+    Returns:
+        bundle_metadata (dict): metadata of the bundle
+        bundle_mmap (mmap.mmap): memory-mapped bundle file
+        hmm_start (int): position of the HMMs in the bundle file
+    """
+    with open(bundle_file, 'rb') as open_bundle_file:
+        bundle_mmap = mmap.mmap(open_bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header_size = len(BUNDLE_MAGIC) + 8
+    if bundle_mmap[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        logger.critical("  {0} is not a custom database bundle, create one with: bigecyhmm_custom compile.".format(bundle_file))
+        sys.exit(1)
+    bundle_metadata_size = struct.unpack('<Q', bundle_mmap[len(BUNDLE_MAGIC):header_size])[0]
+    bundle_metadata = json.loads(bundle_mmap[header_size:header_size + bundle_metadata_size].decode('utf-8'))
+    if bundle_metadata['bundle_version'] != BUNDLE_VERSION:
+        logger.critical("  Custom database bundle {0} has version {1} but this bigecyhmm version expects version {2}, compile it again.".format(bundle_file,
+                        bundle_metadata['bundle_version'], BUNDLE_VERSION))
+        sys.exit(1)
+
+    return bundle_metadata, bundle_mmap, header_size + bundle_metadata_size
+
+
+class BundleHMMReader(io.RawIOBase):
+    """Binary file object reading the HMMs of a bundle from a memoryview slice of the memory-mapped bundle (hmm_view), without copying the slice.
+    pyhmmer HMMFile expects a file object, so the slice cannot be given directly.
+    """
+    def __init__(self, hmm_view):
+        self.hmm_view = hmm_view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """Copy the next bytes of the slice into buffer.
+
+        Args:
+            buffer (memoryview): buffer to fill
+
+        Returns:
+            nb_bytes (int): number of bytes copied (0 at the end of the slice)
+        """
+        nb_bytes = min(len(buffer), len(self.hmm_view) - self.position)
+        buffer[:nb_bytes] = self.hmm_view[self.position:self.position + nb_bytes]
+        self.position += nb_bytes
+        return nb_bytes
+
+
+def load_custom_db_bundle_hmms(bundle_file):
+    """Load the HMMs of a custom database bundle, once per process.
+
+    Args:
+        bundle_file (str): path to bundle file
+
+    Returns:
+        bundle_hmms (dict): HMM digest as key and list of pyhmmer HMM as value
+    """
+    if bundle_file not in BUNDLE_HMMS:
+        bundle_metadata, bundle_mmap, hmm_start = read_custom_db_bundle(bundle_file)
+        bundle_hmms = {}
+        with memoryview(bundle_mmap) as bundle_view:
+            for hmm_digest, (hmm_offset, hmm_size) in bundle_metadata['hmm_index'].items():
+                hmm_position = hmm_start + hmm_offset
+                with bundle_view[hmm_position:hmm_position + hmm_size] as hmm_view:
+                    with pyhmmer.plan7.HMMFile(BundleHMMReader(hmm_view)) as hmm_file:
+                        bundle_hmms[hmm_digest] = list(hmm_file)
+        bundle_mmap.close()
+        BUNDLE_HMMS[bundle_file] = bundle_hmms
+
+    return BUNDLE_HMMS[bundle_file]
+
+
+def extract_custom_db_bundle(bundle_file, output_folder):
+    """Write the files of each custom database of a bundle in its output folder.
+
+    Args:
+        bundle_file (str): path to bundle file
+        output_folder (str): path to output folder
+
+    Returns:
+        custom_databases (list): list of dictionaries (one per custom database) with output_folder, hmm_folder, pathway_template_file,
+                                 hmm_template_file and input_graph_file as keys
+    """
+    bundle_metadata, bundle_mmap, hmm_start = read_custom_db_bundle(bundle_file)
+    bundle_mmap.close()
+
+    custom_databases = []
+    for bundle_database in bundle_metadata['databases']:
+        output_folder_custom_db = os.path.join(output_folder, bundle_database['name'])
+        database_folder = os.path.join(output_folder_custom_db, 'database')
+        is_valid_dir(database_folder)
+
+        custom_database = {'output_folder': output_folder_custom_db, 'hmm_folder': bundle_file,
+                           'pathway_template_file': os.path.join(database_folder, 'pathway_template_file.tsv'),
+                           'hmm_template_file': os.path.join(database_folder, 'hmm_template_file.tsv'),
+                           'input_graph_file': os.path.join(output_folder_custom_db, 'input_graph.graphml')}
+        for file_key, bundle_key in [('hmm_template_file', 'hmm_template'), ('input_graph_file', 'input_graph')]:
+            with open(custom_database[file_key], 'w') as open_database_file:
+                open_database_file.write(bundle_database[bundle_key])
+        with open(custom_database['pathway_template_file'], 'w') as open_pathway_template_file:
+            csvwriter = csv.writer(open_pathway_template_file, delimiter='\t')
+            csvwriter.writerow(['Pathways', 'HMMs'])
+            for pathway, hmm_boolean_expression in bundle_database['pathways']['pathway_expression'].items():
+                csvwriter.writerow([pathway, hmm_boolean_expression])
+        # As for a custom database folder, keep a copy of the graph in database folder (used by bigecyhmm_visualisation).
+        shutil.copyfile(custom_database['input_graph_file'], os.path.join(database_folder, 'input_graph.graphml'))
+        custom_databases.append(custom_database)
+
+    return custom_databases
+
+
+def identify_run_custom_db_search(input_variable, custom_database_folder, output_folder, core_number=1, motif_json=None, motif_pair_json=None,
+                         esmecata_output_folder=None, previous_run_folder=None):
+    """Main function to use HMM search on protein sequences and write results with a custom database.
+
+    Args:
+        input_variable (str): path to input file or folder
+        custom_database_folder (str): path to file/folder containing custom database or to a bundle compiled with compile_custom_db
+        output_folder (str): path to output folder
+        core_number (int): number of core to use for the multiprocessing
+        motif_json (str): JSON file containing gene associated with protein motifs to check for predictions
+        motif_pair_json (str): JSON file containing association between two genes to check for predictions
+        esmecata_output_folder (str): path to esmecata output folder
+        previous_run_folder (str): path to output folder of a previous bigecyhmm run on the same protein fasta files, whose hits are reused for HMMs with the same settings
+    """
+    start_time = time.time()
+
+    is_valid_dir(output_folder)
+
+    if custom_database_folder.endswith(BUNDLE_EXTENSION):
+        # Compiled custom database: database files come from the bundle.
+        logger.info("Read custom database bundle {0}.".format(custom_database_folder))
+        custom_databases = extract_custom_db_bundle(custom_database_folder, output_folder)
+        custom_db_bundle = custom_database_folder
+    else:
+        custom_database_folder, input_dicts = resolve_custom_database_input(custom_database_folder, output_folder)
+        custom_databases = prepare_custom_databases(input_dicts, output_folder)
+        custom_db_bundle = None
+
+    logger.info("Launch HMM search on custom database(s) {0}.".format(', '.join([os.path.basename(custom_database['output_folder']) for custom_database in custom_databases])))
+    search_hmm_custom_dbs(input_variable, custom_databases, core_number=core_number, motif_json=motif_json, motif_pair_json=motif_pair_json,
+                          esmecata_output_folder=esmecata_output_folder, custom_db_bundle=custom_db_bundle, previous_run_folder=previous_run_folder)
+
     duration = time.time() - start_time
     metadata_json = {}
     metadata_json['tool_dependencies'] = {}
@@ -356,7 +943,8 @@ def identify_run_custom_db_search(input_variable, custom_database_folder, output
     metadata_json['tool_dependencies']['python_package']['matplotlib'] = matplotlib_version
 
     metadata_json['input_parameters'] = {'input_variable': input_variable, 'custom_database_folder': custom_database_folder, 'output_folder': output_folder,
-                                         'core_number': core_number, 'motif_json': motif_json, 'motif_pair_json': motif_pair_json, 'esmecata_output_folder': esmecata_output_folder}
+                                         'core_number': core_number, 'motif_json': motif_json, 'motif_pair_json': motif_pair_json, 'esmecata_output_folder': esmecata_output_folder,
+                                         'previous_run_folder': previous_run_folder}
 
     metadata_json['duration'] = duration
 
@@ -365,9 +953,66 @@ def identify_run_custom_db_search(input_variable, custom_database_folder, output
         json.dump(metadata_json, ouput_file, indent=4)
 
 
+def compile_main():
+    parser = argparse.ArgumentParser(
+        'bigecyhmm_custom compile',
+        description='Compile custom database(s) into a single bundle file, which can be given to bigecyhmm_custom -d to skip the parsing and checks of the database.',
+        epilog=REQUIRES
+    )
+
+    parser.add_argument(
+        '-d',
+        '--database',
+        dest='custom_database',
+        required=True,
+        help='Path to a tsv file, json file or folder containing a representation of the custom cycle (or name of an internal database), as for bigecyhmm_custom -d.',
+        metavar='CUSTOM_DATABASE_FILE_OR_FOLDER')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        required=True,
+        help='Output bundle file path (ending with {0}).'.format(BUNDLE_EXTENSION),
+        metavar='OUPUT_BUNDLE_FILE')
+
+    parser.add_argument(
+        "-m",
+        "--motif",
+        dest='motif_file',
+        help="JSON file containing gene associated with protein motifs to check for predictions, stored in the bundle.",
+        required=False,
+        default=None)
+
+    parser.add_argument(
+        "-p",
+        "--motif-pair",
+        dest='motif_pair_file',
+        help="JSON file containing association between two genes to check for predictions, stored in the bundle.",
+        required=False,
+        default=None)
+
+    args = parser.parse_args(sys.argv[2:])
+
+    # set up the default console logger
+    formatter = logging.Formatter('%(message)s')
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+    logger.info("--- Compile custom database ---")
+    compile_custom_db(args.custom_database, args.output, args.motif_file, args.motif_pair_file)
+
+
 def main():
     start_time = time.time()
 
+    # Compilation of custom database is a subcommand: bigecyhmm_custom compile -d custom_database -o custom_database.bigecyhmm
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        compile_main()
+        return
+
     parser = argparse.ArgumentParser(
         'bigecyhmm_custom',
         description=MESSAGE + ' For specific help on each subcommand use: bigecyhmm_custom {cmd} --help',
@@ -393,7 +1038,8 @@ def main():
         required=True,
         help='''Path to a tsv file, json file or folder containing a representation of the custom cycle.\
             It will also search for associated tsv and zip file. If it is a folder, it will do the same but for each json in the folder.\
-            It is aslo possible to give a string for specific internal databases: 'internal_all' (corresponds to default metabolic cycle), 'internal_hydrogen_table' (focus on hydrogen consumption).''',
+            It is aslo possible to give a string for specific internal databases: 'internal_all' (corresponds to default metabolic cycle), 'internal_hydrogen_table' (focus on hydrogen consumption).\
+            It can also be a bundle file created with: bigecyhmm_custom compile.''',
         metavar='CUSTOM_DATABASE_FILE_OR_FOLDER')
 
     parser.add_argument(
@@ -436,6 +1082,22 @@ def main():
         metavar='INPUT_FILE',
         default=None)
 
+    parser.add_argument(
+        '--previous-run',
+        dest='previous_run',
+        required=False,
+        help='Output folder of a previous bigecyhmm run on the same input. Hits of HMMs searched with the same settings are taken from it instead of being searched again.',
+        metavar='BIGECYHMM_OUTPUT_FOLDER',
+        default=None)
+
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        help='Profile the stages of the run (search, filtering, aggregation, plotting) with cProfile in all processes. Merged profiles (bigecyhmm_custom_profile_STAGE.pstats) and a summary of the slowest functions (bigecyhmm_custom_profile.txt) are written in the output folder.',
+        required=False,
+        action='store_true',
+        default=False)
+
     args = parser.parse_args()
 
     # If no argument print the help.
@@ -458,8 +1120,17 @@ def main():
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
+    if args.profile:
+        enable_profiling(args.output)
+
     logger.info("--- Launch HMM search on custom database ---")
-    identify_run_custom_db_search(args.input, args.custom_database, args.output, args.core, args.motif_file, args.motif_pair_file, args.esmecata_folder)
+    try:
+        identify_run_custom_db_search(args.input, args.custom_database, args.output, args.core, args.motif_file, args.motif_pair_file, args.esmecata_folder,
+                                      previous_run_folder=args.previous_run)
+    finally:
+        # Profiles are also written if the search fails, which removes their temporary folder.
+        if args.profile:
+            write_profiles(args.output, 'bigecyhmm_custom')
 
     duration = time.time() - start_time
     logger.info("--- Total runtime %.2f seconds ---" % (duration))
@@ -14,20 +14,31 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
 import csv
+import json
 import os
+import shutil
 import sys
 import logging
 
 from PIL import Image, ImageDraw, ImageFont
+from xml.sax.saxutils import escape, quoteattr
 
-from bigecyhmm.utils import parse_result_files
+from bigecyhmm.utils import parse_result_files, write_sparse_presence
 from collections import Counter
 
-from bigecyhmm import  PATHWAY_TEMPLATE_FILE, TEMPLATE_CARBON_CYCLE, TEMPLATE_NITROGEN_CYCLE, \
-    TEMPLATE_SULFUR_CYCLE, TEMPLATE_OTHER_CYCLE, TEMPLATE_PHOSPHORUS_CYCLE, TEMPLATE_PHOSPHORUS_GENE_CYCLE
+from bigecyhmm import  PATHWAY_TEMPLATE_FILE, DIAGRAM_LAYOUT_FILE
 
 logger = logging.getLogger(__name__)
 
+# Diagrams drawn by default (their layouts are in DIAGRAM_LAYOUT_FILE).
+DIAGRAM_CYCLES = ['carbon_cycle', 'nitrogen_cycle', 'sulfur_cycle', 'other_cycle', 'phosphorus_cycle']
+DIAGRAM_FONT_SIZE = 20
+# Output formats of the diagrams: png draws the labels in a copy of the template,
+# svg links to the template (copied once in the output folder) and overlays the labels as text.
+DIAGRAM_FORMATS = ['png', 'svg']
+# Spacing (in pixels) between lines of a label, same as the default of PIL multiline text.
+DIAGRAM_LINE_SPACING = 4
+
 
 def check_boolean_expression(hmm_boolean_expression, org_hmms, pathway_hmms):
     """ Check presence of pathway according to boolean expression of hmm combinations.
@@ -69,6 +80,58 @@ def check_boolean_expression(hmm_boolean_expression, org_hmms, pathway_hmms):
     return pathway_presence
 
 
+def compile_pathway_expression(hmm_boolean_expression, pathway_hmms):
+    """Compile a boolean expression of HMMs so that it can be evaluated on all samples (or organisms) at once.
+    HMMs are replaced by the rows of a boolean presence matrix (ordered as pathway_hmms) and "and", "or", "not" by the element-wise operators "&", "|", "~".
+
+    Args:
+        hmm_boolean_expression (str): combination of boolean operators and hmm to infer pathway presence
+        pathway_hmms (list): list of HMMs associated with the pathway
+
+    Returns:
+        compiled_expression (code): compiled expression to evaluate with a hmm_presence boolean matrix (HMMs as rows, samples as columns)
+        positive_hmms (list): HMMs of the expression that are not negated by "not"
+    """
+    if hmm_boolean_expression.count('(') - hmm_boolean_expression.count(')'):
+        logger.critical('Incorrect number of parenthesis in boolean expression: ' + hmm_boolean_expression)
+        sys.exit(1)
+
+    hmm_indexes = {hmm: hmm_index for hmm_index, hmm in enumerate(pathway_hmms)}
+    boolean_operators = {'and': '&', 'or': '|', 'not': '~', '(': '(', ')': ')'}
+
+    vectorized_tokens = []
+    positive_hmms = []
+    previous_token = None
+    for token in hmm_boolean_expression.replace('(', ' ( ').replace(')', ' ) ').split():
+        if token in boolean_operators:
+            vectorized_tokens.append(boolean_operators[token])
+        elif token in hmm_indexes:
+            vectorized_tokens.append('hmm_presence[{0}]'.format(hmm_indexes[token]))
+            if previous_token != 'not' and token not in positive_hmms:
+                positive_hmms.append(token)
+        else:
+            logger.critical('Incorrect element in the boolean expression: ' + token)
+            sys.exit(1)
+        previous_token = token
+
+    compiled_expression = compile(' '.join(vectorized_tokens), '<pathway expression>', 'eval')
+
+    return compiled_expression, positive_hmms
+
+
+def evaluate_pathway_expression(compiled_expression, hmm_presence):
+    """Evaluate a compiled pathway expression on a boolean presence matrix.
+
+    Args:
+        compiled_expression (code): expression compiled by compile_pathway_expression
+        hmm_presence (np.ndarray): boolean matrix with HMMs of the pathway as rows (same order as in compile_pathway_expression) and samples as columns
+
+    Returns:
+        pathway_presence (np.ndarray): boolean array with the presence of the pathway in each sample
+    """
+    return eval(compiled_expression, {'__builtins__': {}}, {'hmm_presence': hmm_presence})
+
+
 def get_diagram_pathways_hmms(pathway_template_file=PATHWAY_TEMPLATE_FILE):
     """From PATHWAY_TEMPLATE_FILE extract HMMs associated with cycles of the diagrams.
 
@@ -141,9 +204,11 @@ def check_diagram_pathways(sorted_pathways, pathway_expression, org_hmms, pathwa
     for org in org_hmms:
         if org not in org_pathways_hmms:
             org_pathways_hmms[org] = {}
+        # Set of HMMs of the organism, computed once and shared by all pathways.
+        org_hmm_set = set(org_hmms[org])
         for pathway in sorted_pathways:
             hmm_boolean_expression = pathway_expression[pathway]
-            pathway_presence = check_boolean_expression(hmm_boolean_expression, org_hmms[org], pathway_hmms[pathway])
+            pathway_presence = check_boolean_expression(hmm_boolean_expression, org_hmm_set, pathway_hmms[pathway])
             if pathway_presence is True:
                 if org not in org_pathways:
                     org_pathways[org] = {}
@@ -156,7 +221,7 @@ def check_diagram_pathways(sorted_pathways, pathway_expression, org_hmms, pathwa
                 if org not in org_pathways:
                     org_pathways[org] = {}
                 org_pathways[org][pathway] = 0
-            hmms_in_org = list(set(org_hmms[org]).intersection(set(pathway_hmms[pathway])))
+            hmms_in_org = list(org_hmm_set.intersection(pathway_hmms[pathway]))
             if len(hmms_in_org) > 0:
                 org_pathways_hmms[org][pathway] = '; '.join(hmms_in_org)
             else:
@@ -196,18 +261,32 @@ def create_input_diagram(input_folder, output_diagram_folder, output_folder, pat
             csvwriter.writerow([pathway, all_pathways[pathway], all_pathways[pathway] / len(org_hmms)])
 
 
-def create_pathway_presence_files(input_folder, output_folder, pathway_template_file=PATHWAY_TEMPLATE_FILE):
+def create_pathway_presence_files(input_folder, output_folder, pathway_template_file=PATHWAY_TEMPLATE_FILE, sparse_output_folder=None):
     """Create fiels showcasing the occurrence of pathway in organisms.
 
     Args:
         input_folder (str): path to HMM search results folder (one tsv file per organism)
         output_folder (str): path to output folder
         pathway_template_file (str): path to pathway template file
+        sparse_output_folder (str): if not None, path to a folder where the pathway presences are also written in sparse format
     """
     pathway_hmms, pathway_expression, sorted_pathways = get_diagram_pathways_hmms(pathway_template_file)
     org_hmms = parse_result_files(input_folder)
     all_pathways, org_pathways, org_pathways_hmms = check_diagram_pathways(sorted_pathways, pathway_expression, org_hmms, pathway_hmms)
 
+    write_pathway_presence_files(all_pathways, org_pathways, org_pathways_hmms, output_folder, sparse_output_folder)
+
+
+def write_pathway_presence_files(all_pathways, org_pathways, org_pathways_hmms, output_folder, sparse_output_folder=None):
+    """Write the pathway presences (pathway_presence.tsv) and the HMMs found for each pathway (pathway_presence_hmms.tsv) in organisms.
+
+    Args:
+        all_pathways (dict): pathway as key and number of organisms having it as value
+        org_pathways (dict): organism as key and subdict with pathway presence as value
+        org_pathways_hmms (dict): organism as key and subdict with pathway and the associated HMMs in the organism
+        output_folder (str): path to output folder
+        sparse_output_folder (str): if not None, path to a folder where the pathway presences are also written in sparse format
+    """
     pathway_presence_file = os.path.join(output_folder, 'pathway_presence.tsv')
     all_orgs = list(set([org for org in org_pathways]))
     with open(pathway_presence_file, 'w') as open_pathway_presence_file:
@@ -224,6 +303,9 @@ def create_pathway_presence_files(input_folder, output_folder, pathway_template_
         for pathway in all_pathways:
             csvwriter.writerow([pathway, *[org_pathways_hmms[org][pathway] for org in all_orgs]])
 
+    if sparse_output_folder is not None:
+        write_sparse_presence(org_pathways, list(all_pathways), all_orgs, sparse_output_folder)
+
 
 def parse_diagram_file(input_diagram_file):
     """Parse functions in Total.R_input.txt.
@@ -245,46 +327,230 @@ def parse_diagram_file(input_diagram_file):
     return diagram_data
 
 
-def create_carbon_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
-    """From png TEMPLATE_CARBON_CYCLE and input_diagram_folder file, create carbon cycle figure.
+def get_diagram_layout(diagram_layout_file=DIAGRAM_LAYOUT_FILE):
+    """Read the layout file describing where the pathway labels are drawn on each diagram template.
+
+    Args:
+        diagram_layout_file (str): path to diagram layout json file
+
+    Returns:
+        diagram_layout (dict): cycle name as key and subdict with template, output size and labels (pathway, title, position, colour) as value
+    """
+    with open(diagram_layout_file, 'r') as open_diagram_layout_file:
+        diagram_layout = json.load(open_diagram_layout_file)
+
+    # Template paths are relative to the layout file.
+    layout_folder = os.path.dirname(diagram_layout_file)
+    for cycle_name in diagram_layout:
+        diagram_layout[cycle_name]['template'] = os.path.join(layout_folder, diagram_layout[cycle_name]['template'])
+
+    return diagram_layout
+
+
+def load_diagram_templates(diagram_layout, cycle_names):
+    """Open the template images of the diagrams once, so they can be shared between several renderings.
+
+    Args:
+        diagram_layout (dict): cycle name as key and subdict with template, output size and labels as value
+        cycle_names (list): list of cycle names to load
+
+    Returns:
+        diagram_templates (dict): cycle name as key and PIL Image of the template as value
+    """
+    diagram_templates = {}
+    for cycle_name in cycle_names:
+        with Image.open(diagram_layout[cycle_name]['template'], 'r') as template_img:
+            template_img.load()
+            diagram_templates[cycle_name] = template_img.copy()
+
+    return diagram_templates
+
+
+def draw_cycle_diagram(template_img, cycle_layout, diagram_data, output_file, font, first_term='Genomes', second_term='Coverage'):
+    """Draw the values of the pathways on a copy of the template image and save it.
 
     Args:
+        template_img (PIL Image): template image of the diagram
+        cycle_layout (dict): layout of the diagram (template, output size and labels)
         diagram_data (dict): functions as key and (nb genomes containing in it, percentage coverage) as value
         output_file (str): path to output file
+        font (PIL ImageFont): font used to write the labels
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_CARBON_CYCLE, 'r')
+    img = template_img.copy()
     imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['C-S-01:Organic carbon oxidation']
-    data_step_02 = diagram_data['C-S-02:Carbon fixation']
-    data_step_03 = diagram_data['C-S-03:Ethanol oxidation']
-    data_step_04 = diagram_data['C-S-04:Acetate oxidation']
-    data_step_05 = diagram_data['C-S-05:Hydrogen generation']
-    data_step_06 = diagram_data['C-S-06:Fermentation']
-    data_step_07 = diagram_data['C-S-07:Methanogenesis']
-    data_step_08 = diagram_data['C-S-08:Methanotrophy']
-    data_step_09 = diagram_data['C-S-09:Hydrogen oxidation']
-    data_step_10 = diagram_data['C-S-10:Acetogenesis WL']
-
-    imgdraw.text((800,80), 'Step1: Organic carbon\n oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (0,0,0), font=font)
-    imgdraw.text((100,70), 'Step2: Carbon fixation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (139,137,137), font=font)
-    imgdraw.text((750,320), 'Step3: Ethanol oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (0,0,0), font=font)
-    imgdraw.text((150,400), 'Step4: Acetate oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (0,0,0), font=font)
-    imgdraw.text((530,225), 'Step5: Hydrogen generation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_05[0], second_term, data_step_05[1]), (139,117,0), font=font)
-    imgdraw.text((375,150), 'Step6: Fermentation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_06[0], second_term, data_step_06[1]), (139,117,0), font=font)
-    imgdraw.text((350,450), 'Step7: Methanogenesis\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_07[0], second_term, data_step_07[1]), (93,71,139), font=font)
-    imgdraw.text((300,650), 'Step8: Methanotrophy\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_08[0], second_term, data_step_08[1]), (205,186,150), font=font)
-    imgdraw.text((575,400), 'Step9: Hydrogen oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_09[0], second_term, data_step_09[1]), (238,162,173), font=font)
-    imgdraw.text((275,300), 'Step10: Acetogenesis WL\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_10[0], second_term, data_step_10[1]), (0,134,139), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
+
+    for label in cycle_layout['labels']:
+        data_step = diagram_data[label['pathway']]
+        label_text = '{0}\n{1}: {2}\n{3}: {4}%'.format(label['title'], first_term, data_step[0], second_term, data_step[1])
+        imgdraw.text(tuple(label['position']), label_text, tuple(label['color']), font=font)
+
+    img = img.resize(tuple(cycle_layout['size']), Image.Resampling.LANCZOS)
     img.save(output_file, dpi=(300, 300), quality=100)
     img.close()
 
 
+def write_svg_cycle_diagram(template_href, template_size, cycle_layout, diagram_data, output_file, font, first_term='Genomes', second_term='Coverage'):
+    """Write a SVG diagram linking to the template image and overlaying the values of the pathways as text.
+    The labels are placed at the same positions as in the png diagram.
+
+    Args:
+        template_href (str): path to the template image relative to the output file
+        template_size (tuple): width and height of the template image
+        cycle_layout (dict): layout of the diagram (template, output size and labels)
+        diagram_data (dict): functions as key and (nb genomes containing in it, percentage coverage) as value
+        output_file (str): path to output file
+        font (PIL ImageFont): font used to write the labels (to compute line positions)
+        first_term (str): first term name used in figure describing the first value
+        second_term (str): second term name used in figure describing the second value
+    """
+    template_width, template_height = template_size
+    output_width, output_height = cycle_layout['size']
+    # PIL draws text from the top of the line whereas SVG uses the baseline.
+    font_ascent = font.getmetrics()[0]
+    line_height = font.getbbox('A')[3] + DIAGRAM_LINE_SPACING
+    font_family = ', '.join([font.getname()[0], 'Helvetica', 'Arial', 'sans-serif'])
+
+    svg_lines = ['<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{0}" height="{1}" viewBox="0 0 {2} {3}">'.format(output_width, output_height, template_width, template_height),
+                 '<image x="0" y="0" width="{0}" height="{1}" href={2} xlink:href={2}/>'.format(template_width, template_height, quoteattr(template_href)),
+                 '<g font-family={0} font-size="{1}">'.format(quoteattr(font_family), DIAGRAM_FONT_SIZE)]
+    for label in cycle_layout['labels']:
+        data_step = diagram_data[label['pathway']]
+        label_text = '{0}\n{1}: {2}\n{3}: {4}%'.format(label['title'], first_term, data_step[0], second_term, data_step[1])
+        label_lines = label_text.split('\n')
+        x, y = label['position']
+        svg_lines.append('<text fill="rgb({0},{1},{2})">'.format(*label['color']))
+        for index, label_line in enumerate(label_lines):
+            svg_lines.append('<tspan x="{0}" y="{1}">{2}</tspan>'.format(x, y + font_ascent + index * line_height, escape(label_line)))
+        svg_lines.append('</text>')
+    svg_lines.append('</g>')
+    svg_lines.append('</svg>')
+
+    with open(output_file, 'w') as open_output_file:
+        open_output_file.write('\n'.join(svg_lines) + '\n')
+
+
+def copy_diagram_templates(diagram_layout, cycle_names, output_folder):
+    """Copy the template images of the diagrams in a subfolder of the output folder, so that SVG diagrams can link to them.
+
+    Args:
+        diagram_layout (dict): cycle name as key and subdict with template, output size and labels as value
+        cycle_names (list): list of cycle names to copy
+        output_folder (str): path to output folder
+
+    Returns:
+        template_files (dict): cycle name as key and path to the copied template as value
+    """
+    template_folder = os.path.join(output_folder, 'diagram_templates')
+    if not os.path.exists(template_folder):
+        os.mkdir(template_folder)
+
+    template_files = {}
+    for cycle_name in cycle_names:
+        template_file = os.path.join(template_folder, os.path.basename(diagram_layout[cycle_name]['template']))
+        if not os.path.exists(template_file):
+            shutil.copyfile(diagram_layout[cycle_name]['template'], template_file)
+        template_files[cycle_name] = template_file
+
+    return template_files
+
+
+def create_cycle_diagrams(samples_diagram_data, output_folder, cycle_names=DIAGRAM_CYCLES, first_term='Genomes', second_term='Coverage',
+                          filename_pattern='{sample}_{cycle}', diagram_layout_file=DIAGRAM_LAYOUT_FILE, output_format='png'):
+    """Create the cycle diagrams of several samples in one call.
+    Layout, templates and font are loaded once and shared by all the samples.
+    With svg format, the templates are copied once in output_folder/diagram_templates and each diagram links to them.
+
+    Args:
+        samples_diagram_data (dict): sample as key and a subdict with functions as key and (first value, second value) as value
+        output_folder (str): path to output folder
+        cycle_names (list): list of cycle names (from the layout file) to draw for each sample
+        first_term (str): first term name used in figure describing the first value
+        second_term (str): second term name used in figure describing the second value
+        filename_pattern (str): pattern of the output file names (without extension), filled with sample and cycle names
+        diagram_layout_file (str): path to diagram layout json file
+        output_format (str): format of the diagrams, png or svg
+
+    Returns:
+        output_files (dict): sample as key and a subdict with cycle name as key and path to the created figure as value
+    """
+    if output_format not in DIAGRAM_FORMATS:
+        logger.critical('|bigecyhmm|diagram| Unknown diagram format "{0}", it must be one of: {1}.'.format(output_format, ', '.join(DIAGRAM_FORMATS)))
+        sys.exit(1)
+
+    diagram_layout = get_diagram_layout(diagram_layout_file)
+    font = ImageFont.load_default(DIAGRAM_FONT_SIZE)
+
+    if output_format == 'png':
+        diagram_templates = load_diagram_templates(diagram_layout, cycle_names)
+    elif output_format == 'svg':
+        template_files = copy_diagram_templates(diagram_layout, cycle_names, output_folder)
+        template_sizes = {}
+        for cycle_name in cycle_names:
+            with Image.open(template_files[cycle_name], 'r') as template_img:
+                template_sizes[cycle_name] = template_img.size
+
+    output_files = {}
+    for sample in samples_diagram_data:
+        output_files[sample] = {}
+        for cycle_name in cycle_names:
+            output_file = os.path.join(output_folder, filename_pattern.format(sample=sample, cycle=cycle_name) + '.' + output_format)
+            if output_format == 'png':
+                draw_cycle_diagram(diagram_templates[cycle_name], diagram_layout[cycle_name], samples_diagram_data[sample], output_file,
+                                   font, first_term, second_term)
+            elif output_format == 'svg':
+                template_href = os.path.relpath(template_files[cycle_name], os.path.dirname(output_file)).replace(os.sep, '/')
+                write_svg_cycle_diagram(template_href, template_sizes[cycle_name], diagram_layout[cycle_name], samples_diagram_data[sample],
+                                        output_file, font, first_term, second_term)
+            output_files[sample][cycle_name] = output_file
+
+    if output_format == 'png':
+        for cycle_name in diagram_templates:
+            diagram_templates[cycle_name].close()
+
+    return output_files
+
+
+def create_cycle_diagram(cycle_name, diagram_data, output_file, first_term='Genomes', second_term='Coverage', diagram_layout_file=DIAGRAM_LAYOUT_FILE,
+                         output_format='png'):
+    """Create one cycle diagram from its template and layout.
+
+    Args:
+        cycle_name (str): name of the cycle in the layout file
+        diagram_data (dict): functions as key and (nb genomes containing in it, percentage coverage) as value
+        output_file (str): path to output file
+        first_term (str): first term name used in figure describing the first value
+        second_term (str): second term name used in figure describing the second value
+        diagram_layout_file (str): path to diagram layout json file
+        output_format (str): format of the diagram, png or svg (the template is then copied next to output_file)
+    """
+    if output_format == 'png':
+        diagram_layout = get_diagram_layout(diagram_layout_file)
+        diagram_templates = load_diagram_templates(diagram_layout, [cycle_name])
+        font = ImageFont.load_default(DIAGRAM_FONT_SIZE)
+
+        draw_cycle_diagram(diagram_templates[cycle_name], diagram_layout[cycle_name], diagram_data, output_file, font, first_term, second_term)
+        diagram_templates[cycle_name].close()
+    else:
+        output_folder = os.path.dirname(output_file)
+        filename_pattern = os.path.splitext(os.path.basename(output_file))[0]
+        create_cycle_diagrams({cycle_name: diagram_data}, output_folder, [cycle_name], first_term, second_term, filename_pattern,
+                              diagram_layout_file, output_format)
+
+
+def create_carbon_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
+    """From png TEMPLATE_CARBON_CYCLE and input_diagram_folder file, create carbon cycle figure.
+
+    Args:
+        diagram_data (dict): functions as key and (nb genomes containing in it, percentage coverage) as value
+        output_file (str): path to output file
+        first_term (str): first term name used in figure describing the first value
+        second_term (str): second term name used in figure describing the second value
+    """
+    create_cycle_diagram('carbon_cycle', diagram_data, output_file, first_term, second_term)
+
+
 def create_nitrogen_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
     """From png TEMPLATE_NITROGEN_CYCLE and input_diagram_folder file, create nitrogen cycle figure.
 
@@ -294,35 +560,7 @@ def create_nitrogen_cycle(diagram_data, output_file, first_term='Genomes', secon
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_NITROGEN_CYCLE, 'r')
-    imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['N-S-01:Nitrogen fixation']
-    data_step_02 = diagram_data['N-S-02:Ammonia oxidation']
-    data_step_03 = diagram_data['N-S-03:Nitrite oxidation']
-    data_step_04 = diagram_data['N-S-04:Nitrate reduction']
-    data_step_05 = diagram_data['N-S-05:Nitrite reduction']
-    data_step_06 = diagram_data['N-S-06:Nitric oxide reduction']
-    data_step_07 = diagram_data['N-S-07:Nitrous oxide reduction']
-    data_step_08 = diagram_data['N-S-08:Nitrite ammonification']
-    data_step_09 = diagram_data['N-S-09:Anammox']
-    data_step_10 = diagram_data['N-S-10:Nitric oxide dismutase']
-
-    imgdraw.text((700,120), 'Step1: Nitrogen fixation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (205,16,118), font=font)
-    imgdraw.text((800,360), 'Step2: Ammonia oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (0,205,205), font=font)
-    imgdraw.text((650,650), 'Step3: Nitrite oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (139,69,0), font=font)
-    imgdraw.text((250,600), 'Step4: Nitrate reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (16,78,139), font=font)
-    imgdraw.text((50,425), 'Step5: Nitrite reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_05[0], second_term, data_step_05[1]), (16,78,139), font=font)
-    imgdraw.text((50,300), 'Step6: Nitric oxide reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_06[0], second_term, data_step_06[1]), (16,78,139), font=font)
-    imgdraw.text((225,120), 'Step7: Nitrous oxide reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_07[0], second_term, data_step_07[1]), (16,78,139), font=font)
-    imgdraw.text((410,415), 'Step8: Nitrite ammonification\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_08[0], second_term, data_step_08[1]), (95,158,160), font=font)
-    imgdraw.text((500,275), 'Step9: Anammox\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_09[0], second_term, data_step_09[1]), (102,205,0), font=font)
-    imgdraw.text((400,200), 'Step10: Nitric oxide dismutase\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_10[0], second_term, data_step_10[1]), (154,50,205), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
-    img.save(output_file, dpi=(300, 300), quality=100)
-    img.close()
+    create_cycle_diagram('nitrogen_cycle', diagram_data, output_file, first_term, second_term)
 
 
 def create_sulfur_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
@@ -334,33 +572,7 @@ def create_sulfur_cycle(diagram_data, output_file, first_term='Genomes', second_
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_SULFUR_CYCLE, 'r')
-    imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['S-S-01:Sulfide oxidation']
-    data_step_02 = diagram_data['S-S-02:Sulfur reduction']
-    data_step_03 = diagram_data['S-S-03:Sulfur oxidation']
-    data_step_04 = diagram_data['S-S-04:Sulfite oxidation']
-    data_step_05 = diagram_data['S-S-05:Sulfate reduction']
-    data_step_06 = diagram_data['S-S-06:Sulfite reduction']
-    data_step_07 = diagram_data['S-S-07:Thiosulfate oxidation']
-    data_step_08 = diagram_data['S-S-08:Thiosulfate disproportionation 1']
-    data_step_09 = diagram_data['S-S-09:Thiosulfate disproportionation 2']
-
-    imgdraw.text((700,80), 'Step1: Sulfide oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (238,118,0), font=font)
-    imgdraw.text((600,200), 'Step2: Sulfur reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (122,197,205), font=font)
-    imgdraw.text((850,360), 'Step3: Sulfur oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (154,50,205), font=font)
-    imgdraw.text((650,650), 'Step4: Sulfite oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (162,205,90), font=font)
-    imgdraw.text((100,550), 'Step5: Sulfate reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_05[0], second_term, data_step_05[1]), (139,69,19), font=font)
-    imgdraw.text((150,150), 'Step6: Sulfite reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_06[0], second_term, data_step_06[1]), (139,69,19), font=font)
-    imgdraw.text((375,500), 'Step7: Thiosulfate oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_07[0], second_term, data_step_07[1]), (0,104,139), font=font)
-    imgdraw.text((400,250), 'Step8: Thiosulfate \ndisproportionation 1\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_08[0], second_term, data_step_08[1]), (0,104,139), font=font)
-    imgdraw.text((625,400), 'Step9: Thiosulfate \ndisproportionation 2\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_09[0], second_term, data_step_09[1]), (0,104,139), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
-    img.save(output_file, dpi=(300, 300), quality=100)
-    img.close()
+    create_cycle_diagram('sulfur_cycle', diagram_data, output_file, first_term, second_term)
 
 
 def create_other_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
@@ -372,27 +584,7 @@ def create_other_cycle(diagram_data, output_file, first_term='Genomes', second_t
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_OTHER_CYCLE, 'r')
-    imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['O-S-01:Iron reduction']
-    data_step_02 = diagram_data['O-S-02:Iron oxidation']
-    data_step_03 = diagram_data['O-S-03:Arsenate reduction']
-    data_step_04 = diagram_data['O-S-04:Arsenite oxidation']
-    data_step_05 = diagram_data['O-S-05:Selenate reduction']
-    data_step_06 = diagram_data['O-S-06:Aerobic respiration']
-
-    imgdraw.text((100,175), 'Step1: Iron reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (0,100,0), font=font)
-    imgdraw.text((375,175), 'Step2: Iron oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (0,100,0), font=font)
-    imgdraw.text((10,575), 'Step3: Arsenate reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (205,102,0), font=font)
-    imgdraw.text((330,575), 'Step4: Arsenite oxidation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (205,102,0), font=font)
-    imgdraw.text((800,575), 'Step5: Selenate reduction\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_05[0], second_term, data_step_05[1]), (0,0,0), font=font)
-    imgdraw.text((800,175), 'Step5: Cytochrome-c\n    oxidase\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_06[0], second_term, data_step_06[1]), (115,68,171), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
-    img.save(output_file, dpi=(300, 300), quality=100)
-    img.close()
+    create_cycle_diagram('other_cycle', diagram_data, output_file, first_term, second_term)
 
 
 def create_phosphorus_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
@@ -404,23 +596,7 @@ def create_phosphorus_cycle(diagram_data, output_file, first_term='Genomes', sec
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_PHOSPHORUS_CYCLE, 'r')
-    imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['P-S-01:Immobilisation (P-rich)']
-    data_step_02 = diagram_data['P-S-01:Immobilisation (P-poor)']
-    data_step_03 = diagram_data['P-S-02:Mineralisation']
-    data_step_04 = diagram_data['P-S-03:Dissolution']
-
-    imgdraw.text((250,280), 'Immobilisation (P-rich)\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (193,67,124), font=font)
-    imgdraw.text((240,80), 'Immobilisation (P-poor)\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (129,159,188), font=font)
-    imgdraw.text((260,570), 'Mineralisation\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (33,179,124), font=font)
-    imgdraw.text((720,580), 'Dissolution\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (62,67,177), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
-    img.save(output_file, dpi=(300, 300), quality=100)
-    img.close()
+    create_cycle_diagram('phosphorus_cycle', diagram_data, output_file, first_term, second_term)
 
 
 def create_phosphorus_gene_cycle(diagram_data, output_file, first_term='Genomes', second_term='Coverage'):
@@ -432,58 +608,16 @@ def create_phosphorus_gene_cycle(diagram_data, output_file, first_term='Genomes'
         first_term (str): first term name used in figure describing the first value
         second_term (str): second term name used in figure describing the second value
     """
-    img = Image.open(TEMPLATE_PHOSPHORUS_GENE_CYCLE, 'r')
-    imgdraw = ImageDraw.Draw(img)
-    font = ImageFont.load_default(20)
-
-    data_step_01 = diagram_data['P-S-01:PhnD']
-    data_step_02 = diagram_data['P-S-02:C-P lyase']
-    data_step_03 = diagram_data['P-S-03:PitA']
-    data_step_04 = diagram_data['P-S-04:PstS']
-    data_step_05 = diagram_data['P-S-05:PNaS']
-    data_step_06 = diagram_data['P-S-06:HtxB']
-    data_step_07 = diagram_data['P-S-07:HtxA']
-    data_step_08 = diagram_data['P-S-08:PtxD']
-    data_step_09 = diagram_data['P-S-09:PtxB']
-    data_step_10 = diagram_data['P-S-10:Phosphonate production']
-    data_step_11 = diagram_data['P-S-11:Phosphonate catabolism']
-    data_step_12 = diagram_data['P-S-12:Phytate degradation']
-    data_step_13 = diagram_data['P-S-13:Phosphatase']
-    data_step_14 = diagram_data['P-S-14:ppa']
-    data_step_15 = diagram_data['P-S-15:ppx']
-    data_step_16 = diagram_data['P-S-16:ppk1']
-    data_step_17 = diagram_data['P-S-17:gcd and pqqC']
-    data_step_18 = diagram_data['P-S-18:Pho regulon']
-
-    imgdraw.text((30,140), 'PhnD\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_01[0], second_term, data_step_01[1]), (193,67,124), font=font)
-    imgdraw.text((250,250), 'C-P lyase\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_02[0], second_term, data_step_02[1]), (193,67,124), font=font)
-    imgdraw.text((30,520), 'PitA\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_03[0], second_term, data_step_03[1]), (219,205,46), font=font)
-    imgdraw.text((100,620), 'PstS\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_04[0], second_term, data_step_04[1]), (219,205,46), font=font)
-    imgdraw.text((300,700), 'PNaS\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_05[0], second_term, data_step_05[1]), (219,205,46), font=font)
-    imgdraw.text((810,140), 'HtxB\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_06[0], second_term, data_step_06[1]), (125,125,124), font=font)
-    imgdraw.text((850,350), 'HtxA\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_07[0], second_term, data_step_07[1]), (125,125,124), font=font)
-    imgdraw.text((600,600), 'PtxD\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_08[0], second_term, data_step_08[1]), (62,67,177), font=font)
-    imgdraw.text((850,610), 'PtxB\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_09[0], second_term, data_step_09[1]), (62,67,177), font=font)
-    imgdraw.text((380,80), 'Production\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_10[0], second_term, data_step_10[1]), (193,67,124), font=font)
-    imgdraw.text((400,200), 'Catabolism\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_11[0], second_term, data_step_11[1]), (193,67,124), font=font)
-    imgdraw.text((550,500), 'Phytase\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_12[0], second_term, data_step_12[1]), (56,104,0), font=font)
-    imgdraw.text((660,400), 'Phosphatase\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_13[0], second_term, data_step_13[1]), (223,87,37), font=font)
-    imgdraw.text((450,400), 'ppa\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_14[0], second_term, data_step_14[1]), (191,32,124), font=font)
-    imgdraw.text((320,470), 'ppx\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_15[0], second_term, data_step_15[1]), (33,179,124), font=font)
-    imgdraw.text((220,400), 'ppk1\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_16[0], second_term, data_step_16[1]), (33,179,124), font=font)
-    imgdraw.text((40,440), 'gcd and pqqC\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_17[0], second_term, data_step_17[1]), (224,179,124), font=font)
-    imgdraw.text((675,720), 'Pho regulon\n{0}: {1}\n{2}: {3}%'.format(first_term, data_step_18[0], second_term, data_step_18[1]), (150,33,0), font=font)
-
-    img = img.resize((2112, 1632), Image.Resampling.LANCZOS)
-    img.save(output_file, dpi=(300, 300), quality=100)
-    img.close()
+    create_cycle_diagram('phosphorus_gene_cycle', diagram_data, output_file, first_term, second_term)
 
 
-def create_diagram_figures(input_diagram_file, output_folder):
-    """From png TEMPLATE_OTHER_CYCLE and input_diagram_folder file, create other cycle figure.
+def create_diagram_figures(input_diagram_file, output_folder, diagram_format='png'):
+    """From Total.R_input.txt file, create the figures of all the cycle diagrams.
 
     Args:
+        input_diagram_file (str): path to Total.R_input.txt file containg number of pathways in community
         output_folder (str): path to bigecyhmm output folder
+        diagram_format (str): format of the diagrams, png or svg
     """
     logger.info('Creating biogeochemical cycle figures.')
 
@@ -496,17 +630,5 @@ def create_diagram_figures(input_diagram_file, output_folder):
     first_term = 'Occurrence'
     second_term = 'Percentage'
 
-    carbon_cycle_file = os.path.join(biogeochemical_diagram_folder, 'carbon_cycle.png')
-    create_carbon_cycle(diagram_data, carbon_cycle_file, first_term, second_term)
-
-    nitrogen_cycle_file = os.path.join(biogeochemical_diagram_folder, 'nitrogen_cycle.png')
-    create_nitrogen_cycle(diagram_data, nitrogen_cycle_file, first_term, second_term)
-
-    sulfur_cycle_file = os.path.join(biogeochemical_diagram_folder, 'sulfur_cycle.png')
-    create_sulfur_cycle(diagram_data, sulfur_cycle_file, first_term, second_term)
-
-    other_cycle_file = os.path.join(biogeochemical_diagram_folder, 'other_cycle.png')
-    create_other_cycle(diagram_data, other_cycle_file, first_term, second_term)
-
-    phosphorus_cycle_file = os.path.join(biogeochemical_diagram_folder, 'phosphorus_cycle.png')
-    create_phosphorus_cycle(diagram_data, phosphorus_cycle_file, first_term, second_term)
\ No newline at end of file
+    create_cycle_diagrams({'Total': diagram_data}, biogeochemical_diagram_folder, DIAGRAM_CYCLES, first_term, second_term,
+                          filename_pattern='{cycle}', output_format=diagram_format)
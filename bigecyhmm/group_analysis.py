@@ -1,18 +1,20 @@
 import os
 import csv
+import math
 import tempfile
 import pandas as pd
 import numpy as np
 import logging
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from itertools import combinations
+from multiprocessing import Pool
 from typing import List, Tuple, Optional
 
 from bigecyhmm.group_plot import plot_donut, plot_table, combine_images_side_by_side
 from bigecyhmm import PATHWAY_TEMPLATE_FILE
 
-from scipy.stats import kruskal
-from statsmodels.stats.multitest import multipletests
+from scipy.stats import rankdata, chi2, norm
 
 #Default file paths and groups. 
 DEFAULT_INPUT_TSV = os.path.join('function_abundance', 'cycle_abundance_sample.tsv')
@@ -29,6 +31,12 @@ DEFAULT_GROUPS = {'All Samples': ['']}
 #DEFAULTS
 ROUND_TOLERANCE = 1e-12  #small tolerance for near-zero checks 
 ALPHA = 0.05             #significance level
+STAT_TESTS = ['kruskal', 'permutation']  #kruskal: chi2 p-values, permutation: exact or permutation p-values of the H statistic
+NB_PERMUTATIONS = 9999   #default number of permutations
+PERMUTATION_SEED = 0     #default seed of the permutations
+PERMUTATION_BLOCK_SIZE = 100  #permutations evaluated at once for all functions
+PERMUTATION_ROUND_BLOCKS = 10 #blocks computed between two early stopping checks
+PERMUTATION_STOP_Z = 3.09     #one-sided 99.9% normal bound used to stop permutations of clearly non-significant functions
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -45,6 +53,8 @@ class FunctionStatResults:
     p: Optional[float]
     p_bh: Optional[float]
     significant: bool
+    dunn_z: List[Optional[float]] = field(default_factory=list)
+    dunn_p_bh: List[Optional[float]] = field(default_factory=list)
 
 
 def get_group_col_names(df: pd.DataFrame, mapping_df: pd.DataFrame) -> Tuple[List[str], List[List[str]], dict]:
@@ -80,97 +90,385 @@ def get_group_col_names(df: pd.DataFrame, mapping_df: pd.DataFrame) -> Tuple[Lis
     return group_names, resolved_groups, groups_dict
 
 
-def run_statistics(df: pd.DataFrame, group_col_names: List[List[str]]) -> List[FunctionStatResults]:
+def build_group_matrix(df: pd.DataFrame, group_col_names: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """ Gather the values of the samples of all groups in one matrix (a sample present in several groups is repeated).
+
+    Args:
+        df (pd.DataFrame): dataframe containing samples as columns and metabolic pathway as row, indicating abundance of metabolic pathway
+        group_col_names (list): list of lists, each list is linked to a group and contains the samples associated with the group
+
+    Returns:
+        group_values (np.ndarray): matrix with metabolic pathways as rows and the samples of each group as columns
+        group_labels (np.ndarray): index of the group of each column of group_values
+    """
+    all_cols = [col for cols in group_col_names for col in cols]
+    group_labels = np.array([group_index for group_index, cols in enumerate(group_col_names) for _ in cols], dtype=int)
+    group_values = df[all_cols].to_numpy(dtype=float) if all_cols else np.empty((len(df.index), 0), dtype=float)
+
+    return group_values, group_labels
+
+
+def rank_rows(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Rank the values of each row (average rank for ties), missing values are not ranked.
+
+    Args:
+        values (np.ndarray): matrix of values, NaN for missing values
+
+    Returns:
+        ranks (np.ndarray): matrix with the rank of each value in its row (NaN for missing values)
+        tie_sums (np.ndarray): for each row, sum of t^3 - t over the groups of t tied values (used for tie correction)
+    """
+    missing = np.isnan(values)
+    # Missing values are ranked after all the other values, so they do not change their ranks.
+    ranked_values = np.where(missing, np.inf, values)
+    min_ranks = rankdata(ranked_values, method='min', axis=1)
+    max_ranks = rankdata(ranked_values, method='max', axis=1)
+    ranks = np.where(missing, np.nan, (min_ranks + max_ranks) / 2)
+    # Each value of a group of t tied values is counted t^2 - 1 times, so the row sum is the sum of t^3 - t.
+    tie_sizes = max_ranks - min_ranks + 1
+    tie_sums = np.where(missing, 0, tie_sizes**2 - 1).sum(axis=1)
+
+    return ranks, tie_sums
+
+
+def compute_h_statistics(group_rank_sums: np.ndarray, group_counts: np.ndarray, tie_sums: np.ndarray) -> np.ndarray:
+    """ Compute tie-corrected Kruskal-Wallis H statistics from the sums of ranks and the number of values of each group (groups on the last axis).
+
+    Args:
+        group_rank_sums (np.ndarray): sum of the ranks of each group
+        group_counts (np.ndarray): number of non-missing values of each group
+        tie_sums (np.ndarray): sum of t^3 - t over the groups of t tied values (broadcastable to group_rank_sums without its last axis)
+
+    Returns:
+        H_stats (np.ndarray): H statistics
+    """
+    nb_values = group_counts.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rank_sum_terms = np.where(group_counts > 0, group_rank_sums**2 / group_counts, 0).sum(axis=-1)
+        H_stats = 12.0 / (nb_values * (nb_values + 1)) * rank_sum_terms - 3 * (nb_values + 1)
+        H_stats = H_stats / (1 - tie_sums / (nb_values**3 - nb_values))
+
+    return H_stats
+
+
+def compute_kruskal_wallis(ranks: np.ndarray, tie_sums: np.ndarray, group_labels: np.ndarray, nb_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Compute Kruskal-Wallis test for all rows at once from their ranks (same results as scipy.stats.kruskal on the non-missing values of each group).
+
+    Args:
+        ranks (np.ndarray): matrix with the rank of each value in its row (NaN for missing values)
+        tie_sums (np.ndarray): for each row, sum of t^3 - t over the groups of t tied values
+        group_labels (np.ndarray): index of the group of each column of ranks
+        nb_groups (int): number of groups
+
+    Returns:
+        H_stats (np.ndarray): H statistic of each row
+        p_values (np.ndarray): p-value of each row
+        effect_sizes_eps2 (np.ndarray): epsilon squared effect size of each row (NaN if there are not more values than groups)
+        nb_valid_groups (np.ndarray): number of groups with at least one value for each row
+        nb_values (np.ndarray): number of non-missing values for each row
+    """
+    # Indicator matrix of the group of each column, to sum ranks and counts per group with matrix products.
+    group_indicator = np.zeros((len(group_labels), nb_groups))
+    group_indicator[np.arange(len(group_labels)), group_labels] = 1
+    valid = ~np.isnan(ranks)
+    group_counts = valid.astype(float) @ group_indicator
+    group_rank_sums = np.where(valid, ranks, 0) @ group_indicator
+
+    H_stats = compute_h_statistics(group_rank_sums, group_counts, tie_sums)
+    nb_values = group_counts.sum(axis=1)
+    nb_valid_groups = (group_counts > 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_values = chi2.sf(H_stats, nb_valid_groups - 1)
+        effect_sizes_eps2 = np.where(nb_values - nb_valid_groups > 0,
+                                     np.maximum((H_stats - nb_valid_groups + 1) / (nb_values - nb_valid_groups), 0), np.nan)
+
+    return H_stats, p_values, effect_sizes_eps2, nb_valid_groups, nb_values
+
+
+def benjamini_hochberg(p_values: np.ndarray, alpha: float = ALPHA) -> Tuple[np.ndarray, np.ndarray]:
+    """ Benjamini–Hochberg correction of p-values (same results as statsmodels multipletests with fdr_bh), missing p-values are ignored.
+    With a matrix, each row is corrected independently (correction along the last axis).
+
+    Args:
+        p_values (np.ndarray): p-values, NaN for missing values
+        alpha (float): family-wise error rate
+
+    Returns:
+        p_values_bh (np.ndarray): corrected p-values (NaN for missing p-values)
+        rejected (np.ndarray): True if the hypothesis is rejected
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    missing = np.isnan(p_values)
+    # Missing p-values are sorted last, so they do not change the rank of the other p-values.
+    sorted_indexes = np.argsort(p_values, axis=-1, kind='mergesort')
+    sorted_p_values = np.take_along_axis(p_values, sorted_indexes, axis=-1)
+    nb_tests = (~missing).sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore'):
+        sorted_p_bh = np.where(np.isnan(sorted_p_values), np.inf, sorted_p_values * nb_tests / np.arange(1, p_values.shape[-1] + 1))
+    # Cumulative minimum from the largest p-value to keep corrected p-values monotonic.
+    sorted_p_bh = np.minimum(np.flip(np.minimum.accumulate(np.flip(sorted_p_bh, axis=-1), axis=-1), axis=-1), 1)
+    p_values_bh = np.empty_like(p_values)
+    np.put_along_axis(p_values_bh, sorted_indexes, sorted_p_bh, axis=-1)
+    p_values_bh[missing] = np.nan
+    rejected = np.where(np.isnan(p_values_bh), False, p_values_bh <= alpha)
+
+    return p_values_bh, rejected
+
+
+def compute_dunn(ranks: np.ndarray, tie_sums: np.ndarray, group_labels: np.ndarray, nb_groups: int) -> Tuple[np.ndarray, np.ndarray, List[Tuple[int, int]]]:
+    """ Compute Dunn post-hoc tests between all pairs of groups for all rows at once, from the ranks of the Kruskal-Wallis test.
+    p-values are corrected with Benjamini–Hochberg between the pairs of groups of each row.
+
+    Args:
+        ranks (np.ndarray): matrix with the rank of each value in its row (NaN for missing values)
+        tie_sums (np.ndarray): for each row, sum of t^3 - t over the groups of t tied values
+        group_labels (np.ndarray): index of the group of each column of ranks
+        nb_groups (int): number of groups
+
+    Returns:
+        dunn_z (np.ndarray): matrix with rows and pairs of groups as columns, containing the z statistic (mean rank of first group minus mean rank of second group)
+        dunn_p_bh (np.ndarray): matrix with rows and pairs of groups as columns, containing the corrected two-sided p-values
+        group_pairs (list): pairs of group indexes of the columns of dunn_z and dunn_p_bh
+    """
+    group_pairs = list(combinations(range(nb_groups), 2))
+    group_indicator = np.zeros((len(group_labels), nb_groups))
+    group_indicator[np.arange(len(group_labels)), group_labels] = 1
+    valid = ~np.isnan(ranks)
+    group_counts = valid.astype(float) @ group_indicator
+    group_rank_sums = np.where(valid, ranks, 0) @ group_indicator
+
+    first_groups = [first_group for first_group, _ in group_pairs]
+    second_groups = [second_group for _, second_group in group_pairs]
+    nb_values = group_counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_ranks = group_rank_sums / group_counts
+        # Variance of the mean rank difference, with tie correction.
+        rank_variances = nb_values * (nb_values + 1) / 12 - tie_sums[:, None] / (12 * (nb_values - 1))
+        pair_variances = rank_variances * (1 / group_counts[:, first_groups] + 1 / group_counts[:, second_groups])
+        dunn_z = (mean_ranks[:, first_groups] - mean_ranks[:, second_groups]) / np.sqrt(pair_variances)
+    dunn_z = np.where(np.isfinite(dunn_z), dunn_z, np.nan)
+    dunn_p = 2 * norm.sf(np.abs(dunn_z))
+    dunn_p_bh, _ = benjamini_hochberg(dunn_p)
+
+    return dunn_z, dunn_p_bh, group_pairs
+
+
+def count_group_labelings(group_labels: np.ndarray) -> int:
+    """ Count the number of distinct assignments of the columns to groups of the same sizes.
+
+    Args:
+        group_labels (np.ndarray): index of the group of each column
+
+    Returns:
+        nb_labelings (int): multinomial coefficient of the group sizes
+    """
+    nb_labelings = 1
+    nb_remaining_columns = len(group_labels)
+    for group_size in np.bincount(group_labels).tolist():
+        nb_labelings *= math.comb(nb_remaining_columns, group_size)
+        nb_remaining_columns -= group_size
+
+    return nb_labelings
+
+
+def enumerate_group_labelings(group_labels: np.ndarray) -> np.ndarray:
+    """ Enumerate all distinct assignments of the columns to groups of the same sizes (used for exact tests).
+
+    Args:
+        group_labels (np.ndarray): index of the group of each column
+
+    Returns:
+        labelings (np.ndarray): matrix with one assignment per row and the group of each column as values
+    """
+    group_sizes = np.bincount(group_labels).tolist()
+    labelings = []
+
+    def assign_group(labeling, free_columns, group_index):
+        if group_index == len(group_sizes) - 1:
+            labeling[free_columns] = group_index
+            labelings.append(labeling.copy())
+            return
+        for group_columns in combinations(free_columns, group_sizes[group_index]):
+            labeling[list(group_columns)] = group_index
+            assign_group(labeling, [column for column in free_columns if column not in group_columns], group_index + 1)
+
+    assign_group(np.zeros(len(group_labels), dtype=int), list(range(len(group_labels))), 0)
+
+    return np.array(labelings, dtype=int)
+
+
+def count_permutation_exceedances(permutation_block: tuple) -> np.ndarray:
+    """ Compute the H statistics of all rows for a block of group labelings and count the labelings with a H statistic at least as large as the observed one.
+
+    Args:
+        permutation_block (tuple): ranks (with 0 for missing values), valid (1 for non-missing values), tie_sums, observed H statistics,
+                                   number of groups and either a matrix of labelings (one per row) or a tuple (group_labels, number of permutations, np.random.SeedSequence)
+
+    Returns:
+        exceedances (np.ndarray): for each row, number of labelings of the block with a H statistic at least as large as the observed one
+    """
+    filled_ranks, valid, tie_sums, observed_H, nb_groups, labelings = permutation_block
+    if isinstance(labelings, tuple):
+        group_labels, nb_block_permutations, seed_sequence = labelings
+        rng = np.random.default_rng(seed_sequence)
+        labelings = rng.permuted(np.tile(group_labels, (nb_block_permutations, 1)), axis=1)
+    nb_block_permutations, nb_columns = labelings.shape
+
+    # One indicator column per (labeling, group): all labelings are evaluated with two matrix products.
+    group_indicator = np.zeros((nb_columns, nb_block_permutations * nb_groups))
+    group_indicator[np.arange(nb_columns)[None, :], np.arange(nb_block_permutations)[:, None] * nb_groups + labelings] = 1
+    group_rank_sums = (filled_ranks @ group_indicator).reshape(-1, nb_block_permutations, nb_groups)
+    group_counts = (valid @ group_indicator).reshape(-1, nb_block_permutations, nb_groups)
+    H_stats = compute_h_statistics(group_rank_sums, group_counts, tie_sums[:, None])
+
+    # Relative tolerance to count permuted H statistics equal to the observed one despite rounding errors.
+    return (H_stats >= observed_H[:, None] - 1e-9 * np.abs(observed_H[:, None])).sum(axis=1)
+
+
+def compute_permutation_p_values(ranks: np.ndarray, tie_sums: np.ndarray, group_labels: np.ndarray, nb_groups: int, observed_H: np.ndarray,
+                                 nb_permutations: int = NB_PERMUTATIONS, seed: Optional[int] = PERMUTATION_SEED, core_number: int = 1,
+                                 alpha: float = ALPHA) -> Tuple[np.ndarray, np.ndarray]:
+    """ Compute p-values of the Kruskal-Wallis H statistics of all rows by permuting group labels.
+    If the number of distinct group labelings is lower than nb_permutations, all of them are enumerated (exact test),
+    otherwise nb_permutations random labelings are drawn by blocks (p-value = (exceedances + 1) / (permutations + 1)).
+    Permutations of a row are stopped when its p-value is clearly above alpha (such a row can not be significant after Benjamini–Hochberg correction).
+    Each block has its own seed derived from seed, so results do not depend on core_number.
+
+    Args:
+        ranks (np.ndarray): matrix with the rank of each value in its row (NaN for missing values)
+        tie_sums (np.ndarray): for each row, sum of t^3 - t over the groups of t tied values
+        group_labels (np.ndarray): index of the group of each column of ranks
+        nb_groups (int): number of groups
+        observed_H (np.ndarray): observed H statistic of each row
+        nb_permutations (int): maximal number of permutations
+        seed (int): seed of the permutations
+        core_number (int): number of processes computing blocks of permutations
+        alpha (float): significance level used for early stopping
+
+    Returns:
+        p_values (np.ndarray): permutation p-value of each row
+        nb_row_permutations (np.ndarray): number of permutations used for each row
+    """
+    valid = (~np.isnan(ranks)).astype(float)
+    filled_ranks = np.where(np.isnan(ranks), 0, ranks)
+    nb_rows = len(observed_H)
+    exceedances = np.zeros(nb_rows, dtype=int)
+    nb_row_permutations = np.zeros(nb_rows, dtype=int)
+
+    exact_test = count_group_labelings(group_labels) <= nb_permutations
+    if exact_test:
+        all_labelings = enumerate_group_labelings(group_labels)
+        block_labelings = [all_labelings[block_start:block_start+PERMUTATION_BLOCK_SIZE] for block_start in range(0, len(all_labelings), PERMUTATION_BLOCK_SIZE)]
+        rounds = [block_labelings]
+    else:
+        block_sizes = [min(PERMUTATION_BLOCK_SIZE, nb_permutations - block_start) for block_start in range(0, nb_permutations, PERMUTATION_BLOCK_SIZE)]
+        block_seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+        block_labelings = [(group_labels, block_size, block_seed) for block_size, block_seed in zip(block_sizes, block_seeds)]
+        rounds = [block_labelings[round_start:round_start+PERMUTATION_ROUND_BLOCKS] for round_start in range(0, len(block_labelings), PERMUTATION_ROUND_BLOCKS)]
+
+    active_rows = np.flatnonzero(~np.isnan(observed_H))
+    pool = Pool(core_number) if core_number > 1 else None
+    try:
+        for round_labelings in rounds:
+            if len(active_rows) == 0:
+                break
+            permutation_blocks = [(filled_ranks[active_rows], valid[active_rows], tie_sums[active_rows], observed_H[active_rows], nb_groups, labelings)
+                                  for labelings in round_labelings]
+            if pool is not None:
+                block_exceedances = pool.map(count_permutation_exceedances, permutation_blocks, chunksize=1)
+            else:
+                block_exceedances = [count_permutation_exceedances(permutation_block) for permutation_block in permutation_blocks]
+            exceedances[active_rows] += np.sum(block_exceedances, axis=0)
+            nb_row_permutations[active_rows] += sum([len(labelings) if not isinstance(labelings, tuple) else labelings[1] for labelings in round_labelings])
+
+            if not exact_test:
+                # Stop rows whose p-value is above alpha with a high confidence.
+                current_p_values = (exceedances[active_rows] + 1) / (nb_row_permutations[active_rows] + 1)
+                standard_errors = np.sqrt(current_p_values * (1 - current_p_values) / nb_row_permutations[active_rows])
+                active_rows = active_rows[current_p_values - PERMUTATION_STOP_Z * standard_errors <= alpha]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if exact_test:
+            p_values = exceedances / nb_row_permutations
+        else:
+            p_values = (exceedances + 1) / (nb_row_permutations + 1)
+    p_values = np.where(np.isnan(observed_H), np.nan, p_values)
+
+    return p_values, nb_row_permutations
+
+
+def run_statistics(df: pd.DataFrame, group_col_names: List[List[str]], stat_test: str = 'kruskal', nb_permutations: int = NB_PERMUTATIONS,
+                   seed: Optional[int] = PERMUTATION_SEED, core_number: int = 1) -> List[FunctionStatResults]:
     """ Compute Kruskal-Wallis test on abundance of metabolic pathways between sample of different groups, then ran Benjamini–Hochberg correction.
+    All metabolic pathways are tested at once with array operations on their ranks.
 
     Args:
         df (pd.DataFrame): dataframe containing samples as columns and metabolic pathway as row, indicating abundance of metabolic pathway
         group_col_names (list): list of lists, each list is linked to a group and contains the samples associated with the group
+        stat_test (str): kruskal (p-values from chi2 distribution) or permutation (exact or permutation p-values of the H statistic)
+        nb_permutations (int): maximal number of permutations (with permutation)
+        seed (int): seed of the permutations (with permutation)
+        core_number (int): number of processes computing permutations (with permutation)
 
     Returns:
         results (list): list of FunctionStatResults objects, indicating for each metabolic function the associated stats linked to group comparison
     """
     # Get metabolic function names.
     function_names = df.index.tolist()
-    results: List[FunctionStatResults] = []
 
-    # Compute median, count and quantile per-group Series (one Series per group) using pandas aggregations.
-    med_series_list = [df[cols].median(axis=1).astype(float) if cols else pd.Series(np.nan, index=df.index) for cols in group_col_names]
-    count_series_list = [df[cols].count(axis=1).astype(int) if cols else pd.Series(0, index=df.index) for cols in group_col_names]
-    iqr_series_list = [(df[cols].quantile(0.75, axis=1) - df[cols].quantile(0.25, axis=1)).astype(float) if cols else pd.Series(np.nan, index=df.index) for cols in group_col_names]
+    # Compute median, count, quantile and percentage of zero per-group (one column per group) using pandas aggregations.
+    nan_column = np.full(len(function_names), np.nan)
+    medians = np.column_stack([df[cols].median(axis=1).to_numpy(dtype=float) if cols else nan_column for cols in group_col_names])
+    counts = np.column_stack([df[cols].count(axis=1).to_numpy(dtype=int) if cols else np.zeros(len(function_names), dtype=int) for cols in group_col_names])
+    iq_ranges = np.column_stack([(df[cols].quantile(0.75, axis=1) - df[cols].quantile(0.25, axis=1)).to_numpy(dtype=float) if cols else nan_column for cols in group_col_names])
+    percent_zeros = np.column_stack([np.isclose(df[cols].to_numpy(dtype=float), 0.0, atol=ROUND_TOLERANCE).sum(axis=1) / len(cols) * 100 if cols else nan_column for cols in group_col_names])
+
+    # Kruskal–Wallis for all functions.
+    group_values, group_labels = build_group_matrix(df, group_col_names)
+    ranks, tie_sums = rank_rows(group_values)
+    H_stats, p_values, effect_sizes_eps2, nb_valid_groups, nb_values = compute_kruskal_wallis(ranks, tie_sums, group_labels, len(group_col_names))
+
+    # Kruskal–Wallis is not computed with less than two groups with values, or if all values are zero or identical.
+    all_zero = np.all(np.isclose(group_values, 0.0, atol=ROUND_TOLERANCE) | np.isnan(group_values), axis=1)
+    all_identical = tie_sums == nb_values**3 - nb_values
+    do_kw = (nb_valid_groups >= 2) & ~all_zero & ~all_identical
+    H_stats = np.where(do_kw, H_stats, np.nan)
+    p_values = np.where(do_kw, p_values, np.nan)
+    effect_sizes_eps2 = np.where(do_kw, effect_sizes_eps2, np.nan)
+    if stat_test == 'permutation':
+        p_values, _ = compute_permutation_p_values(ranks, tie_sums, group_labels, len(group_col_names), H_stats, nb_permutations=nb_permutations,
+                                                   seed=seed, core_number=core_number)
 
-    percent_zero_series_list: List[pd.Series] = []
-    for cols in group_col_names:
-        if cols:
-            is_zero = df[cols].map(lambda v: np.isclose(v, 0.0, atol=ROUND_TOLERANCE)).sum(axis=1)
-            percent_zero_series_list.append((is_zero / len(cols) * 100).astype(float))
-        else:
-            percent_zero_series_list.append(pd.Series(np.nan, index=df.index))
-
-    for function_name in function_names:
-        med_row = [float(s.loc[function_name]) if pd.notna(s.loc[function_name]) else np.nan for s in med_series_list]
-        counts = [int(s.loc[function_name]) if pd.notna(s.loc[function_name]) else 0 for s in count_series_list]
-        iq_range = [float(s.loc[function_name]) if pd.notna(s.loc[function_name]) else np.nan for s in iqr_series_list]
-        percent_zero = [float(s.loc[function_name]) if pd.notna(s.loc[function_name]) else np.nan for s in percent_zero_series_list]
-
-        # Numeric arrays per group for Kruskal
-        data_per_group = [df.loc[function_name, cols].dropna().values.astype(float) if len(cols) > 0 else np.array([], dtype=float) for cols in group_col_names]
-
-        # Decide whether Kruskal–Wallis can be computed
-        valid_groups = [arr for arr in data_per_group if len(arr) > 0]
-        do_kw = len(valid_groups) >= 2
-        if do_kw:
-            all_values = np.concatenate(valid_groups)
-            if all_values.size == 0 or np.all(np.isclose(all_values, 0.0, atol=ROUND_TOLERANCE)) or len(np.unique(all_values)) <= 1:
-                do_kw = False
-
-        if do_kw:
-            H_stat, p_value = kruskal(*valid_groups)
-            n_valid = len(valid_groups)
-            tot_n = sum(len(g) for g in valid_groups)
-            if tot_n - n_valid <= 0:
-                effect_size_eps2 = np.nan
-            else:
-                effect_size_eps2 = (H_stat - n_valid + 1) / (tot_n - n_valid)
-                effect_size_eps2 = np.maximum(effect_size_eps2, 0)
-        else:
-            H_stat, p_value, effect_size_eps2 = np.nan, np.nan, np.nan
+    # Benjamini–Hochberg correction
+    p_values_bh, rejected = benjamini_hochberg(p_values, alpha=ALPHA)
+
+    # Dunn post-hoc tests between pairs of groups, from the same ranks.
+    dunn_z, dunn_p_bh, _ = compute_dunn(ranks, tie_sums, group_labels, len(group_col_names))
+    dunn_z[~do_kw] = np.nan
+    dunn_p_bh[~do_kw] = np.nan
 
+    results: List[FunctionStatResults] = []
+    for function_index, function_name in enumerate(function_names):
         fr = FunctionStatResults(
             name=function_name,
-            medians=med_row,
-            counts=counts,
-            iq_range=iq_range,
-            percent_zero=percent_zero,
-            H=H_stat,
-            eps2=effect_size_eps2,
-            p=p_value,
-            p_bh=np.nan,
-            significant=False,
+            medians=medians[function_index].tolist(),
+            counts=counts[function_index].tolist(),
+            iq_range=iq_ranges[function_index].tolist(),
+            percent_zero=percent_zeros[function_index].tolist(),
+            H=float(H_stats[function_index]),
+            eps2=float(effect_sizes_eps2[function_index]),
+            p=float(p_values[function_index]),
+            p_bh=float(p_values_bh[function_index]),
+            significant=bool(rejected[function_index]),
+            dunn_z=dunn_z[function_index].tolist(),
+            dunn_p_bh=dunn_p_bh[function_index].tolist(),
         )
         results.append(fr)
 
-    # Benjamini–Hochberg correction
-    p_series = pd.Series([r.p for r in results], index=[r.name for r in results], dtype='float64')
-    valid_mask = p_series.notna()
-    if valid_mask.any():
-        valid_index = p_series[valid_mask].index.tolist()
-        valid_p = p_series[valid_mask].values
-        reject, pvals_corr, _, _ = multipletests(valid_p, alpha=ALPHA, method='fdr_bh')
-        pvals_dict = dict(zip(valid_index, pvals_corr))
-        reject_dict = dict(zip(valid_index, reject))
-        for r in results:
-            if r.name in pvals_dict:
-                r.p_bh = float(pvals_dict[r.name]) if not np.isnan(pvals_dict[r.name]) else np.nan
-                r.significant = bool(reject_dict.get(r.name, False))
-            else:
-                r.p_bh = np.nan
-                r.significant = False
-    else:
-        for r in results:
-            r.p_bh = np.nan
-            r.significant = False
-
     return results
 
 
@@ -201,6 +499,10 @@ def results_to_dataframe(results: List[FunctionStatResults], groups: dict) -> Tu
             row[f'n {g}'] = r.counts[i] if i < len(r.counts) else 0
             row[f'iq_range {g}'] = r.iq_range[i] if i < len(r.iq_range) else np.nan
             row[f'%0 {g}'] = r.percent_zero[i] if i < len(r.percent_zero) else np.nan
+        # Dunn post-hoc tests between pairs of groups.
+        for pair_index, (first_group, second_group) in enumerate(combinations(group_names, 2)):
+            row[f'Dunn z {first_group} vs {second_group}'] = r.dunn_z[pair_index] if pair_index < len(r.dunn_z) else np.nan
+            row[f'Dunn p_bh {first_group} vs {second_group}'] = r.dunn_p_bh[pair_index] if pair_index < len(r.dunn_p_bh) else np.nan
         rows.append(row)
     df_res = pd.DataFrame(rows)
 
@@ -214,11 +516,16 @@ def results_to_dataframe(results: List[FunctionStatResults], groups: dict) -> Tu
     display_df['p'] = display_df['p'].apply(lambda x: f"{x:.4g}" if pd.notna(x) else "n/a")
     display_df['p_bh'] = display_df['p_bh'].apply(lambda x: f"{x:.4g}" if pd.notna(x) else "n/a")
     display_df['significant'] = display_df['significant'].apply(lambda x: 'Yes' if x else 'No')
+    for c in [c for c in display_df.columns if c.startswith('Dunn z ')]:
+        display_df[c] = display_df[c].apply(lambda x: f"{x:.3f}" if pd.notna(x) else "")
+    for c in [c for c in display_df.columns if c.startswith('Dunn p_bh ')]:
+        display_df[c] = display_df[c].apply(lambda x: f"{x:.4g}" if pd.notna(x) else "n/a")
 
     return df_res, display_df
 
 
-def compute_and_save(input_df: pd.DataFrame, mapping_df: pd.DataFrame, output_csv: str, cleaned_output_csv: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def compute_and_save(input_df: pd.DataFrame, mapping_df: pd.DataFrame, output_csv: str, cleaned_output_csv: str, stat_test: str = 'kruskal',
+                     nb_permutations: int = NB_PERMUTATIONS, seed: Optional[int] = PERMUTATION_SEED, core_number: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """ Retrieve gorups, compute statistics, generate stat output file.
 
     Args:
@@ -226,6 +533,10 @@ def compute_and_save(input_df: pd.DataFrame, mapping_df: pd.DataFrame, output_cs
         mapping_df (pd.DataFrame): dataframe linking sample to group
         output_stats_csv (str): path to output file containing statistical results
         cleaned_output_csv (str): path to cleaned file containg abundance of metabolic pathways in samples
+        stat_test (str): kruskal (p-values from chi2 distribution) or permutation (exact or permutation p-values of the H statistic)
+        nb_permutations (int): maximal number of permutations (with permutation)
+        seed (int): seed of the permutations (with permutation)
+        core_number (int): number of processes computing permutations (with permutation)
 
     Returns:
         cleaned_df (pd.DataFrame): cleaned DataFrame containg abundance of metabolic pathways in samples
@@ -239,7 +550,7 @@ def compute_and_save(input_df: pd.DataFrame, mapping_df: pd.DataFrame, output_cs
     cleaned_df.to_csv(cleaned_output_csv)
     logger.info(f"Saved cleaned data to {cleaned_output_csv}")
 
-    results = run_statistics(input_df, group_col_names)
+    results = run_statistics(input_df, group_col_names, stat_test=stat_test, nb_permutations=nb_permutations, seed=seed, core_number=core_number)
     df_res, display_df = results_to_dataframe(results, groups_dict)
 
     df_res.to_csv(output_csv, index=False)
@@ -256,7 +567,11 @@ def statNut_run(input_tsv: str = DEFAULT_INPUT_TSV,
          output_table_png: str = DEFAULT_TABLE_PNG,
          background_path: str = DEFAULT_BACKGROUND_PATH,
          background_offset: tuple = (0.016, -0.006),
-         background_scale: float = 0.60):
+         background_scale: float = 0.60,
+         stat_test: str = 'kruskal',
+         nb_permutations: int = NB_PERMUTATIONS,
+         seed: Optional[int] = PERMUTATION_SEED,
+         core_number: int = 1):
     """ From a tsv file showing abundance of metabolic pathways in samples, another file linking sampels to group and a background file, generate a donut plot.
 
     Args:
@@ -269,6 +584,10 @@ def statNut_run(input_tsv: str = DEFAULT_INPUT_TSV,
         background_path (str): path to background image for donut plot
         background_offset (tuple): adjust background image position (right, up)
         background_scale (float): adjust background image scale relative to donut
+        stat_test (str): kruskal (p-values from chi2 distribution) or permutation (exact or permutation p-values of the H statistic)
+        nb_permutations (int): maximal number of permutations (with permutation)
+        seed (int): seed of the permutations (with permutation)
+        core_number (int): number of processes computing permutations (with permutation)
     """
     # Load input tsv, first column (metabo. funct. name) is index.
     df = pd.read_csv(input_tsv, sep='\t', index_col=0)
@@ -297,7 +616,11 @@ def statNut_run(input_tsv: str = DEFAULT_INPUT_TSV,
     cleaned_df, group_col_names, groups_dict, display_df = compute_and_save(input_df=df,
                                             mapping_df=mapping_df,
                                             output_csv=output_stats_csv,
-                                            cleaned_output_csv=output_cleaned_csv)
+                                            cleaned_output_csv=output_cleaned_csv,
+                                            stat_test=stat_test,
+                                            nb_permutations=nb_permutations,
+                                            seed=seed,
+                                            core_number=core_number)
 
     # Use index labels for plotting.
     metabolic_labels = df.index.tolist()
@@ -3,6 +3,9 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba
+from matplotlib.path import Path
 from typing import List, Tuple
 
 from PIL import Image
@@ -22,6 +25,58 @@ ALPHABET_PROJECT_DISTINCT_HEX_COLORS = ["#F0A3FF",
     "#740AFF", "#990000", "#FFFF80", "#FFFF00",
     "#FF5005"]
 
+# Number of points used to draw a full circle of the donut plot.
+ARC_POINTS = 1000
+
+
+def compute_band_paths(segment_angles: np.ndarray, inner_radii: np.ndarray, outer_radii: np.ndarray) -> List[Path]:
+    """ Compute one path per band, filling each segment between an inner and an outer radius.
+
+    Args:
+        segment_angles (np.ndarray): angles of the arc points of each segment (segments x points)
+        inner_radii (np.ndarray): inner radius of each segment (segments)
+        outer_radii (np.ndarray): outer radius of each segment for each band (bands x segments)
+
+    Returns:
+        band_paths (list): one compound path per band with a closed polygon (as theta, r) per non-empty segment
+    """
+    nb_points = segment_angles.shape[1]
+    # Go along the arc at the inner radius, come back at the outer radius and close the polygon.
+    polygon_thetas = np.concatenate([segment_angles, segment_angles[:, ::-1], segment_angles[:, :1]], axis=1)
+    polygon_codes = np.full(2 * nb_points + 1, Path.LINETO, dtype=Path.code_type)
+    polygon_codes[0] = Path.MOVETO
+    polygon_codes[-1] = Path.CLOSEPOLY
+
+    band_paths = []
+    for band_outer_radii in outer_radii:
+        # Empty polygons (no interquartile range or missing values) are not drawn.
+        kept = np.isfinite(inner_radii) & np.isfinite(band_outer_radii) & (inner_radii != band_outer_radii)
+        polygon_radii = np.concatenate([np.repeat(inner_radii[kept, None], nb_points, axis=1),
+                                        np.repeat(band_outer_radii[kept, None], nb_points + 1, axis=1)], axis=1)
+        vertices = np.stack([polygon_thetas[kept], polygon_radii], axis=2).reshape(-1, 2)
+        band_paths.append(Path(vertices, np.tile(polygon_codes, kept.sum())))
+
+    return band_paths
+
+
+def compute_sample_angles(value_mask: np.ndarray, group_centers: np.ndarray, intra_sample_span: float) -> np.ndarray:
+    """ Compute the angle of each sample dot, spreading the non-missing values of a segment around the group center.
+
+    Args:
+        value_mask (np.ndarray): boolean mask of non-missing values (segments x samples)
+        group_centers (np.ndarray): angle of the group center in each segment (segments)
+        intra_sample_span (float): angular span on which the samples of a group are spread
+
+    Returns:
+        thetas (np.ndarray): angle of each sample dot, only meaningful where value_mask is True (segments x samples)
+    """
+    nb_values = value_mask.sum(axis=1, keepdims=True)
+    value_positions = np.cumsum(value_mask, axis=1) - 1
+    # A single value is placed on the group center.
+    relative_positions = np.where(nb_values > 1, value_positions / np.maximum(nb_values - 1, 1) - 0.5, 0.0)
+
+    return group_centers[:, None] + relative_positions * intra_sample_span
+
 
 def plot_table(display_df: pd.DataFrame, output_path: str = os.path.join('plots', 'group_stats_table.png')) -> None:
     """ Plot table showcasing statistical analysis for the different comparison.
@@ -38,11 +93,13 @@ def plot_table(display_df: pd.DataFrame, output_path: str = os.path.join('plots'
     data_frame.insert(0, 'ID', range(1, len(data_frame) + 1))
     # Median columns start with 'Median '.
     median_cols = [c for c in data_frame.columns if c.startswith('Median ')]
-    desired_cols = ['ID', 'Metabolic Function', 'p', 'p_bh', 'significant'] + median_cols
+    # Corrected p-values of Dunn post-hoc tests start with 'Dunn p_bh '.
+    dunn_cols = [c for c in data_frame.columns if c.startswith('Dunn p_bh ')]
+    desired_cols = ['ID', 'Metabolic Function', 'p', 'p_bh', 'significant'] + median_cols + dunn_cols
     df = data_frame[desired_cols]
 
     # Use the same figure height as the donut plot (20 inches) so combined figures align vertically.
-    fig, ax = plt.subplots(figsize=(8, 20))
+    fig, ax = plt.subplots(figsize=(8 + 2 * len(dunn_cols), 20))
     ax.axis('off')
 
     # Generate the dataframe as a table on an ax object.
@@ -234,10 +291,13 @@ def plot_donut(df: pd.DataFrame, groups: dict, metabolic_labels: List[str], outp
                 )
 
     #prepare radial series and draw filled bands + median lines
-    angles = np.linspace(0, 2 * np.pi, 1000)
-    segment_angles = np.linspace(0, 2 * np.pi, num_segments + 1)
+    #each segment arc is sampled as densely as a 1000-point circle so bands follow the polar curvature
+    nb_arc_points = int(np.ceil(ARC_POINTS / num_segments)) + 2
+    segment_angles = angle_ticks[:-1, None] + np.diff(angle_ticks)[:, None] * np.linspace(0, 1, nb_arc_points)
 
     n_steps = 30 #steps for IQR shading from median outward
+    step_fracs = np.arange(1, n_steps + 1) / n_steps
+    step_alphas = 0.20 * np.exp(-4 * np.arange(n_steps) / n_steps)
 
     #If caller supplied precomputed column lists use them; otherwise resolve from `groups` dict by exact sample names
     if group_col_names is None:
@@ -261,48 +321,32 @@ def plot_donut(df: pd.DataFrame, groups: dict, metabolic_labels: List[str], outp
     else:
         colors = GROUP_COLORS
 
+    #separate segments with NaN to avoid boundary bridging artifacts on median lines
+    nan_pad = np.full((num_segments, 1), np.nan)
+    r_angles = np.concatenate([segment_angles, nan_pad], axis=1).ravel()
+
     for grp_idx, (gname, cols) in enumerate(zip(group_names, group_col_names)):
         if not cols:
             continue
+        group_color = colors[grp_idx % len(colors)]
 
         median_series = df[cols].median(axis=1).to_numpy(dtype=float)
         q25_series = df[cols].quantile(0.25, axis=1).to_numpy(dtype=float)
         q75_series = df[cols].quantile(0.75, axis=1).to_numpy(dtype=float)
 
-        #Build per-segment arrays and separate segments with NaN to avoid boundary bridging artifacts.
-        nan_pad = np.array([np.nan])
-        seg_a_parts, seg_med_parts, seg_q25_parts, seg_q75_parts = [], [], [], []
-        for i in range(num_segments):
-            sa_start = segment_angles[i]
-            sa_end = segment_angles[i + 1]
-            seg_a = angles[(angles > sa_start) & (angles < sa_end)]
-            seg_a = np.concatenate([[sa_start], seg_a, [sa_end]])
-            seg_med = np.full_like(seg_a, median_series[i])
-            seg_q25 = np.full_like(seg_a, q25_series[i])
-            seg_q75 = np.full_like(seg_a, q75_series[i])
-            seg_a_parts.append(np.concatenate([seg_a, nan_pad]))
-            seg_med_parts.append(np.concatenate([seg_med, nan_pad]))
-            seg_q25_parts.append(np.concatenate([seg_q25, nan_pad]))
-            seg_q75_parts.append(np.concatenate([seg_q75, nan_pad]))
-
-        r_angles = np.concatenate(seg_a_parts)
-        r_median = np.concatenate(seg_med_parts)
-        r_q25 = np.concatenate(seg_q25_parts)
-        r_q75 = np.concatenate(seg_q75_parts)
-
-        #upper/lower IQR fill bands with exponential alpha decay from the median
-        for step in range(n_steps):
-            frac = (step + 1) / n_steps
-            alpha = 0.20 * np.exp(-4 * step / n_steps)
-            r_upper = r_median + (r_q75 - r_median) * frac
-            ax.fill_between(r_angles, r_median, r_upper, color=colors[grp_idx % len(colors)], alpha=alpha)
-        for step in range(n_steps):
-            frac = (step + 1) / n_steps
-            alpha = 0.20 * np.exp(-4 * step / n_steps)
-            r_lower = r_median - (r_median - r_q25) * frac
-            ax.fill_between(r_angles, r_lower, r_median, color=colors[grp_idx % len(colors)], alpha=alpha)
-
-        ax.plot(r_angles, r_median, color=colors[grp_idx % len(colors)], label=gname, zorder=3)
+        #upper/lower IQR fill bands with exponential alpha decay from the median, drawn as a single collection
+        upper_radii = median_series[None, :] + (q75_series - median_series)[None, :] * step_fracs[:, None]
+        lower_radii = median_series[None, :] - (median_series - q25_series)[None, :] * step_fracs[:, None]
+        band_radii = np.concatenate([upper_radii, lower_radii])
+        band_alphas = np.tile(step_alphas, 2)
+        band_colors = np.tile(to_rgba(group_color), (len(band_alphas), 1))
+        band_colors[:, 3] = band_alphas
+        band_collection = PathCollection(compute_band_paths(segment_angles, median_series, band_radii),
+                                         facecolors=band_colors, edgecolors='none', transform=ax.transData)
+        ax.add_collection(band_collection, autolim=False)
+
+        r_median = np.concatenate([np.repeat(median_series[:, None], nb_arc_points, axis=1), nan_pad], axis=1).ravel()
+        ax.plot(r_angles, r_median, color=group_color, label=gname, zorder=3)
 
     # Per-sample scatter points with group/sample angular separation in each segment.
     n_groups = len(group_col_names)
@@ -312,38 +356,29 @@ def plot_donut(df: pd.DataFrame, groups: dict, metabolic_labels: List[str], outp
         group_band_width = inter_group_span / n_groups
         intra_sample_span = group_band_width * 0.65
 
-        for seg_idx in range(num_segments):
-            for grp_idx, cols in enumerate(group_col_names):
-                if not cols:
-                    continue
-                vals = pd.to_numeric(df.iloc[seg_idx][cols], errors='coerce').dropna().values.astype(float)
-                n_vals = len(vals)
-                if n_vals == 0:
-                    continue
-
-                group_offset = (grp_idx - (n_groups - 1) / 2.0) * group_band_width
-                group_center = mid_angles[seg_idx] + group_offset
-
-                if n_vals == 1:
-                    thetas = np.array([group_center])
-                else:
-                    thetas = group_center + np.linspace(-intra_sample_span / 2, intra_sample_span / 2, n_vals)
-
-                # This adds for each sample a dot linked to a function showing the abundance of this function.
-                ax.scatter(
-                    thetas,
-                    vals,
-                    s=10,
-                    color=colors[grp_idx % len(colors)],
-                    alpha=0.75,
-                    edgecolors='none',
-                    zorder=2,
-                )
+        for grp_idx, cols in enumerate(group_col_names):
+            if not cols:
+                continue
+            values = df[cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+            group_offset = (grp_idx - (n_groups - 1) / 2.0) * group_band_width
+            value_mask = ~np.isnan(values)
+            thetas = compute_sample_angles(value_mask, mid_angles + group_offset, intra_sample_span)
+
+            # This adds for each sample a dot linked to a function showing the abundance of this function.
+            ax.scatter(
+                thetas[value_mask],
+                values[value_mask],
+                s=10,
+                color=colors[grp_idx % len(colors)],
+                alpha=0.75,
+                edgecolors='none',
+                zorder=2,
+            )
 
     ax.grid(True, color='lightgrey', linewidth=0.5)
     ax.legend(prop={'size': 12})
 
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    fig.savefig(output_path, dpi=300, bbox_inches='tight')
     plt.close(fig)
 
     # Resize the figure.
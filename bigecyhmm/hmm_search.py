@@ -21,17 +21,217 @@ import time
 import re
 import sys
 import json
+import hashlib
+import math
+import threading
 
+from array import array
+from dataclasses import dataclass, field, replace
+from itertools import compress
 from multiprocessing import Pool
 from PIL import __version__ as pillow_version
 
-from bigecyhmm.utils import is_valid_dir, file_or_folder, parse_result_files, get_link_pathway_function_name
+from bigecyhmm.utils import is_valid_dir, file_or_folder, parse_result_files, write_pathway_function_names, write_sparse_presence, get_peak_rss
+from bigecyhmm.profiling import profile_stage, is_profiling_enabled
+from bigecyhmm.progress import SearchProgress, init_progress_worker, report_task_start, report_task_end
 from bigecyhmm.diagram_cycles import create_input_diagram, create_diagram_figures, create_pathway_presence_files
 from bigecyhmm import __version__ as bigecyhmm_version
 from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE, MOTIF, MOTIF_PAIR
 
 logger = logging.getLogger(__name__)
 
+# Default reporting and inclusion e-value thresholds of HMMER (and pyhmmer) for sequences and domains.
+REPORTING_EVALUE = 10.0
+INCLUSION_EVALUE = 0.01
+
+# HMMs are searched either with one hmmsearch per HMM on all sequences or with one hmmscan per sequence on all HMMs.
+SEARCH_STRATEGIES = ['auto', 'search', 'scan']
+# With 'auto', hmmscan is used when there is less than one sequence for SCAN_HMMS_PER_SEQUENCE HMMs: for a few sequences, the cost of hmmsearch
+# is dominated by its call for each HMM (hmmscan was faster up to 20 sequences for the 455 HMMs of the internal database, hmmsearch from 50 sequences).
+SCAN_HMMS_PER_SEQUENCE = 20
+
+# Options of the HMMER pipeline for each search profile. 'default' keeps HMMER filter thresholds (F1=0.02, F2=1e-3, F3=1e-5, with bias filter).
+# 'fast' tightens the MSV (F1), Viterbi (F2) and Forward (F3) filters to screen inputs for presence/absence of functions,
+# some weak hits can be lost (use bigecyhmm_calibrate to measure the speedup and the hits lost on a sample of inputs).
+SEARCH_PROFILES = {'default': {},
+                   'fast': {'F1': 0.005, 'F2': 2e-4, 'F3': 2e-6, 'bias_filter': True}}
+
+# Estimation of the peak memory of a search task (in bytes), used to schedule tasks under a memory budget.
+# A worker uses WORKER_BASE_MEMORY and HMM_FILE_MEMORY_FACTOR x the size of the HMM files (profiles and search pipelines),
+# the digital sequences use RESIDUE_MEMORY per residue, SEQUENCE_MEMORY per sequence and the size of their headers.
+# The number of residues and sequences are read from the fasta index (.fai) of the file when it exists, otherwise the digital sequences
+# use FASTA_FILE_MEMORY_FACTOR x the size of the fasta file (the size of the file being an upper bound of its number of residues).
+WORKER_BASE_MEMORY = 64 * 1024 ** 2
+HMM_FILE_MEMORY_FACTOR = 3
+RESIDUE_MEMORY = 2
+SEQUENCE_MEMORY = 512
+FASTA_FILE_MEMORY_FACTOR = 3
+# Number of residues of the chunks of sequences read at once for inputs which do not fit in the memory budget.
+CHUNK_RESIDUES = 10_000_000
+
+# Header of hmm_results files, which are written as csv.writer writes them (tab delimiter and '\r\n' line terminator).
+HMM_RESULTS_HEADER = ['organism', 'protein', 'HMM', 'evalue', 'score', 'length']
+# Characters for which csv.writer quotes a field (delimiter, quote character and line breaks).
+TSV_QUOTED_CHARACTERS = ['\t', '"', '\r', '\n']
+
+
+@dataclass
+class SharedDomain:
+    """Domain of a shared hit, with its P-value to compute its inclusion for any database."""
+    score: float
+    pvalue: float
+
+
+@dataclass
+class SharedHit:
+    """Hit of an HMM searched once for several databases.
+    The e-value depends on the number of HMMs of each database, so it is only set when the hit is selected for a database.
+    """
+    name: str
+    score: float
+    pvalue: float
+    length: int
+    domains: list = field(default_factory=list)
+    evalue: float = None
+
+
+class HitTable:
+    """Hits kept for an input (rows of hmm_results files), stored by columns to use little memory on inputs with millions of hits.
+    Organism, protein and HMM names are stored once and referenced by their index in arrays, e-values, scores and lengths are stored
+    in arrays of C numbers (36 bytes by hit and each name once, instead of about 240 bytes by hit for a list of Python objects).
+    Hits are given as rows (organism, protein, HMM, evalue, score, length) when iterating on the table.
+    """
+    __slots__ = ['names', 'name_indexes', 'organism_indexes', 'protein_indexes', 'hmm_indexes', 'evalues', 'scores', 'lengths']
+
+    def __init__(self, rows=()):
+        self.names = []
+        self.name_indexes = {}
+        self.organism_indexes = array('I')
+        self.protein_indexes = array('I')
+        self.hmm_indexes = array('I')
+        self.evalues = array('d')
+        self.scores = array('d')
+        self.lengths = array('q')
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.evalues)
+
+    def __getitem__(self, hit_index):
+        return (self.names[self.organism_indexes[hit_index]], self.names[self.protein_indexes[hit_index]], self.names[self.hmm_indexes[hit_index]],
+                self.evalues[hit_index], self.scores[hit_index], self.lengths[hit_index])
+
+    def __iter__(self):
+        names = self.names
+        for organism_index, protein_index, hmm_index, evalue, score, length in zip(self.organism_indexes, self.protein_indexes, self.hmm_indexes,
+                                                                                   self.evalues, self.scores, self.lengths):
+            yield (names[organism_index], names[protein_index], names[hmm_index], evalue, score, length)
+
+    def get_name_index(self, name):
+        """Get the index of an organism, protein or HMM name, the name is added to the table if it is new.
+
+        Args:
+            name (str): organism, protein or HMM name
+
+        Returns:
+            name_index (int): index of the name in the table
+        """
+        name_index = self.name_indexes.get(name)
+        if name_index is None:
+            name_index = len(self.names)
+            self.name_indexes[name] = name_index
+            self.names.append(name)
+
+        return name_index
+
+    def append(self, row):
+        """Add a hit to the table.
+
+        Args:
+            row (list): hit given as organism, protein, HMM, evalue, score and length (numbers can be strings read from a hmm_results file)
+        """
+        organism, protein, hmm_filebasename, evalue, score, length = row
+        self.organism_indexes.append(self.get_name_index(organism))
+        self.protein_indexes.append(self.get_name_index(protein))
+        self.hmm_indexes.append(self.get_name_index(hmm_filebasename))
+        self.evalues.append(float(evalue))
+        self.scores.append(float(score))
+        self.lengths.append(int(length))
+
+    def extend(self, rows):
+        """Add hits to the table, the columns of another HitTable are added at once.
+
+        Args:
+            rows (HitTable or iterable): hits to add, as a HitTable or as rows
+        """
+        if isinstance(rows, HitTable):
+            # Indexes of the names of the other table in this table.
+            name_mapping = [self.get_name_index(name) for name in rows.names]
+            self.organism_indexes.extend([name_mapping[name_index] for name_index in rows.organism_indexes])
+            self.protein_indexes.extend([name_mapping[name_index] for name_index in rows.protein_indexes])
+            self.hmm_indexes.extend([name_mapping[name_index] for name_index in rows.hmm_indexes])
+            self.evalues.extend(rows.evalues)
+            self.scores.extend(rows.scores)
+            self.lengths.extend(rows.lengths)
+        else:
+            for row in rows:
+                self.append(row)
+
+    def select(self, selected_hits):
+        """Select hits with a boolean for each hit, each column is filtered at once.
+
+        Args:
+            selected_hits (list): boolean for each hit, True to keep the hit
+
+        Returns:
+            selected_table (HitTable): table of the selected hits
+        """
+        selected_table = HitTable()
+        selected_table.names = list(self.names)
+        selected_table.name_indexes = dict(self.name_indexes)
+        for column in ['organism_indexes', 'protein_indexes', 'hmm_indexes', 'evalues', 'scores', 'lengths']:
+            column_values = getattr(self, column)
+            setattr(selected_table, column, array(column_values.typecode, compress(column_values, selected_hits)))
+
+        return selected_table
+
+    def set_organism_and_hmm(self, organism, hmm_filebasename):
+        """Set the same organism and HMM for all hits (such as hits of a previous run selected for an HMM of another database).
+
+        Args:
+            organism (str): organism name
+            hmm_filebasename (str): basename of HMM file
+        """
+        self.organism_indexes = array('I', [self.get_name_index(organism)]) * len(self)
+        self.hmm_indexes = array('I', [self.get_name_index(hmm_filebasename)]) * len(self)
+
+    def write_rows(self, open_output_file):
+        """Write the hits as tsv rows formatted as csv.writer formats them (same quoting, number representation and line terminator).
+
+        Args:
+            open_output_file (file object): tsv file opened for writing
+        """
+        # Names are formatted once, rows are generated while written so they are not all kept in memory.
+        formatted_names = [format_tsv_field(name) for name in self.names]
+        open_output_file.writelines(f'{formatted_names[organism_index]}\t{formatted_names[protein_index]}\t{formatted_names[hmm_index]}\t{evalue!r}\t{score!r}\t{length}\r\n'
+                                    for organism_index, protein_index, hmm_index, evalue, score, length
+                                    in zip(self.organism_indexes, self.protein_indexes, self.hmm_indexes, self.evalues, self.scores, self.lengths))
+
+
+def format_tsv_field(value):
+    """Format a field of a tsv row as csv.writer (with default quoting), which quotes fields containing the delimiter, quotes or line breaks.
+
+    Args:
+        value (str): value of the field
+
+    Returns:
+        formatted_value (str): value of the field in the tsv row
+    """
+    if any(quoted_character in value for quoted_character in TSV_QUOTED_CHARACTERS):
+        return '"' + value.replace('"', '""') + '"'
+
+    return value
+
 
 def get_hmm_thresholds(hmm_template_file):
     """Extract threhsolds from HMM template file.
@@ -98,29 +298,41 @@ def check_motif_pair(input_sequence, hmm_filename, pair_hmm_filename):
 
     Args:
         input_sequence (list): list of input sequences to check
-        hmm_filename (str): path to the first HMM file
-        pair_hmm_filename (str): path to the second HMM file
+        hmm_filename (str, pyhmmer HMM or list): path to the first HMM file (or already loaded HMM or list of HMMs)
+        pair_hmm_filename (str, pyhmmer HMM or list): path to the second HMM file (or already loaded HMM or list of HMMs)
 
     Returns:
         boolean: True if first HMM has a better association with the sequence than the second HMM, False if not
     """
-    with pyhmmer.plan7.HMMFile(hmm_filename) as hmm_file:
-        check_scores = [hit.score
-                            for hits in pyhmmer.hmmsearch(hmm_file, input_sequence, cpus=1)
-                            for hit in hits]
-        if len(check_scores) > 0:
-            motif_check_score = max(check_scores)
-        else:
-            motif_check_score = 0
-
-    with pyhmmer.plan7.HMMFile(pair_hmm_filename) as pair_hmm_file:
-        anti_check_scores = [second_hit.score
-                                for second_hits in pyhmmer.hmmsearch(pair_hmm_file, input_sequence, cpus=1)
-                                for second_hit in second_hits]
-        if len(anti_check_scores) > 0:
-            motif_anti_check_score = max(anti_check_scores)
-        else:
-            motif_anti_check_score = 0
+    if isinstance(hmm_filename, str):
+        with pyhmmer.plan7.HMMFile(hmm_filename) as hmm_file:
+            check_hmms = list(hmm_file)
+    elif isinstance(hmm_filename, list):
+        check_hmms = hmm_filename
+    else:
+        check_hmms = [hmm_filename]
+    check_scores = [hit.score
+                        for hits in pyhmmer.hmmsearch(check_hmms, input_sequence, cpus=1)
+                        for hit in hits]
+    if len(check_scores) > 0:
+        motif_check_score = max(check_scores)
+    else:
+        motif_check_score = 0
+
+    if isinstance(pair_hmm_filename, str):
+        with pyhmmer.plan7.HMMFile(pair_hmm_filename) as pair_hmm_file:
+            pair_check_hmms = list(pair_hmm_file)
+    elif isinstance(pair_hmm_filename, list):
+        pair_check_hmms = pair_hmm_filename
+    else:
+        pair_check_hmms = [pair_hmm_filename]
+    anti_check_scores = [second_hit.score
+                            for second_hits in pyhmmer.hmmsearch(pair_check_hmms, input_sequence, cpus=1)
+                            for second_hit in second_hits]
+    if len(anti_check_scores) > 0:
+        motif_anti_check_score = max(anti_check_scores)
+    else:
+        motif_anti_check_score = 0
 
     if motif_check_score >= motif_anti_check_score and motif_check_score != 0:
         return True
@@ -185,7 +397,196 @@ def filtering_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms,
         return None
 
 
-def query_fasta_file(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1):
+def load_hmm_profiles(hmm_thresholds, hmm_folder=HMM_FOLDER):
+    """Read the HMMs of a database once, so that they can be searched on several protein sequences without reading the HMM files again.
+
+    Args:
+        hmm_thresholds (dict): threshold for each HMM
+        hmm_folder (str): path to HMM folder
+
+    Returns:
+        hmm_profiles (dict): HMM basename as key and list of pyhmmer HMM as value (only HMMs with threshold, in the order of the HMM folder)
+        check_hmms (dict): check HMM name as key and list of pyhmmer HMM as value
+    """
+    hmm_profiles = {}
+    for hmm_filebasename in os.listdir(hmm_folder):
+        if hmm_filebasename.endswith('.hmm') and 'check' not in hmm_filebasename and hmm_filebasename in hmm_thresholds:
+            with pyhmmer.plan7.HMMFile(os.path.join(hmm_folder, hmm_filebasename)) as hmm_file:
+                hmm_profiles[hmm_filebasename] = list(hmm_file)
+
+    check_hmms = {}
+    for hmm_filename in os.listdir(hmm_folder):
+        if hmm_filename.endswith('.hmm') and 'check' in hmm_filename:
+            with pyhmmer.plan7.HMMFile(os.path.join(hmm_folder, hmm_filename)) as hmm_file:
+                check_hmms[hmm_filename.replace('.check.hmm', '')] = list(hmm_file)
+
+    return hmm_profiles, check_hmms
+
+
+def optimize_hmm_profiles(hmm_profiles):
+    """Convert the HMMs of a database to optimized profiles, which are used by both hmmsearch and hmmscan.
+    As HMM names are not unique in databases, each profile is named by its HMM basename and its index in the HMM file.
+
+    Args:
+        hmm_profiles (dict): HMM basename as key and list of pyhmmer HMM as value
+
+    Returns:
+        optimized_profiles (dict): HMM basename as key and list of pyhmmer OptimizedProfile as value
+        scan_profiles (pyhmmer OptimizedProfileBlock): all optimized profiles, searched by hmmscan
+    """
+    amino_alphabet = pyhmmer.easel.Alphabet.amino()
+    background = pyhmmer.plan7.Background(amino_alphabet)
+
+    optimized_profiles = {}
+    for hmm_filebasename, hmms in hmm_profiles.items():
+        optimized_profiles[hmm_filebasename] = []
+        for profile_index, hmm in enumerate(hmms):
+            named_hmm = hmm.copy()
+            named_hmm.name = '{0}:{1}'.format(hmm_filebasename, profile_index)
+            profile = pyhmmer.plan7.Profile(named_hmm.M, amino_alphabet)
+            profile.configure(named_hmm, background)
+            optimized_profiles[hmm_filebasename].append(profile.to_optimized())
+    scan_profiles = pyhmmer.plan7.OptimizedProfileBlock(amino_alphabet, [optimized_profile for hmm_filebasename in optimized_profiles
+                                                                        for optimized_profile in optimized_profiles[hmm_filebasename]])
+
+    return optimized_profiles, scan_profiles
+
+
+def choose_search_strategy(nb_sequences, nb_hmms, search_strategy='auto'):
+    """Choose between hmmsearch and hmmscan to search HMMs on sequences.
+
+    Args:
+        nb_sequences (int): number of protein sequences
+        nb_hmms (int): number of HMMs
+        search_strategy (str): 'search', 'scan' or 'auto' (choose according to the number of sequences and HMMs)
+
+    Returns:
+        search_strategy (str): 'search' or 'scan'
+    """
+    if search_strategy not in SEARCH_STRATEGIES:
+        logger.critical('Unknown search strategy {0}, it must be one of {1}.'.format(search_strategy, ', '.join(SEARCH_STRATEGIES)))
+        sys.exit(1)
+    if search_strategy == 'auto':
+        if nb_sequences * SCAN_HMMS_PER_SEQUENCE <= nb_hmms:
+            search_strategy = 'scan'
+        else:
+            search_strategy = 'search'
+
+    return search_strategy
+
+
+def scan_sequences(sequences, optimized_profiles, scan_profiles, search_space_size, pyhmmer_core=1, search_profile='default'):
+    """Search each sequence on all HMMs with hmmscan and gather the reported hits of each HMM, as they would be returned by hmmsearch.
+
+    Args:
+        sequences (pyhmmer DigitalSequenceBlock): input protein sequences stored in pyhmmer object DigitalSequenceBlock
+        optimized_profiles (dict): HMM basename as key and list of pyhmmer OptimizedProfile as value (from optimize_hmm_profiles)
+        scan_profiles (pyhmmer OptimizedProfileBlock): all optimized profiles (from optimize_hmm_profiles)
+        search_space_size (int): search space size (Z)
+        pyhmmer_core (int): number of core used by pyhmmer
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
+
+    Returns:
+        scanned_hits (dict): HMM basename as key and list of hits (list of SharedHit) for each HMM profile of the file as value
+    """
+    profile_indexes = {}
+    scanned_hits = {}
+    for hmm_filebasename in optimized_profiles:
+        scanned_hits[hmm_filebasename] = [[] for _ in optimized_profiles[hmm_filebasename]]
+        for profile_index, optimized_profile in enumerate(optimized_profiles[hmm_filebasename]):
+            profile_indexes[optimized_profile.name] = (hmm_filebasename, profile_index)
+
+    for sequence, scan_hits in zip(sequences, pyhmmer.hmmscan(sequences, scan_profiles, cpus=pyhmmer_core, Z=search_space_size,
+                                                                  **SEARCH_PROFILES[search_profile])):
+        for hit in scan_hits:
+            hmm_filebasename, profile_index = profile_indexes[hit.name]
+            scanned_hits[hmm_filebasename][profile_index].append(SharedHit(sequence.name, hit.score, hit.pvalue, len(sequence),
+                                                                           [SharedDomain(domain.score, domain.pvalue) for domain in hit.domains]))
+
+    # hmmsearch sorts hits by P-value (so by decreasing score for an HMM), then by sequence name.
+    for hmm_filebasename in scanned_hits:
+        for profile_hits in scanned_hits[hmm_filebasename]:
+            profile_hits.sort(key=lambda shared_hit: (-shared_hit.score, shared_hit.name))
+
+    return scanned_hits
+
+
+def query_sequences(input_filename, sequences, hmm_thresholds, hmm_profiles, check_hmms, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1,
+                    search_strategy='auto', scan_profiles=None, search_profile='default'):
+    """Run HMM search with pyhmmer on protein sequences using HMMs already loaded with load_hmm_profiles.
+    Use associated threshold either for full sequence or domain.
+    HMMs are searched with hmmsearch (one search per HMM) or hmmscan (one search per sequence), which give the same hits.
+
+    Args:
+        input_filename (str): name of protein fasta file (or of the set of sequences)
+        sequences (pyhmmer DigitalSequenceBlock): input protein sequences stored in pyhmmer object DigitalSequenceBlock
+        hmm_thresholds (dict): threshold for each HMM
+        hmm_profiles (dict): HMM basename as key and list of pyhmmer HMM (or OptimizedProfile from optimize_hmm_profiles) as value
+        check_hmms (dict): check HMM name as key and list of pyhmmer HMM as value
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        pyhmmer_core (int): number of core used by pyhmmer
+        search_strategy (str): 'search', 'scan' or 'auto' (choose according to the number of sequences and HMMs if scan_profiles are given, otherwise 'search')
+        scan_profiles (pyhmmer OptimizedProfileBlock): optimized profiles of hmm_profiles (from optimize_hmm_profiles), created if needed by hmmscan
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+    """
+    results = HitTable()
+    if search_profile not in SEARCH_PROFILES:
+        logger.critical('Unknown search profile {0}, it must be one of {1}.'.format(search_profile, ', '.join(SEARCH_PROFILES)))
+        sys.exit(1)
+    pipeline_options = SEARCH_PROFILES[search_profile]
+
+    # filtering_hit is called for each hit, so profiling is checked once for all the hits.
+    if is_profiling_enabled():
+        filter_hit = profile_stage('filtering')(filtering_hit)
+    else:
+        filter_hit = filtering_hit
+
+    # Optimizing the profiles for hmmscan costs about as much as searching a few sequences with hmmsearch,
+    # so 'auto' only uses hmmscan with profiles already optimized (and reused between searches, as in HMMDatabase).
+    if search_strategy == 'auto' and scan_profiles is None:
+        search_strategy = 'search'
+    if choose_search_strategy(len(sequences), len(hmm_profiles), search_strategy) == 'scan':
+        if scan_profiles is None:
+            hmm_profiles, scan_profiles = optimize_hmm_profiles(hmm_profiles)
+        scanned_hits = scan_sequences(sequences, hmm_profiles, scan_profiles, len(hmm_profiles), pyhmmer_core, search_profile)
+        # Hits are then selected as for hits of hmmsearch: inclusion, threshold and motif checks.
+        with profile_stage('filtering'):
+            for hmm_filebasename in hmm_profiles:
+                results.extend(select_shared_hits(input_filename, hmm_filebasename, scanned_hits[hmm_filebasename], hmm_thresholds[hmm_filebasename],
+                                                  len(hmm_profiles), sequences, check_hmms, motif_db, motif_pair_db))
+        return results
+
+    for hmm_filebasename, hmms in hmm_profiles.items():
+        # When searching an HMM file, the file is consumed by the search of the first threshold, so only this threshold is applied.
+        threshold, threshold_type = hmm_thresholds[hmm_filebasename].split(', ')[0].split('|')
+        threshold = float(threshold)
+        # Perform search of the HMM on all input protein sequences and filter them according to score (either hit or domain).
+        if threshold_type == 'full':
+            for hits in pyhmmer.hmmsearch(hmms, sequences, cpus=pyhmmer_core, Z=len(hmm_profiles), parallel="targets", **pipeline_options):
+                for hit in hits.included:
+                    if hit.score >= threshold:
+                        result_hmm = filter_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db)
+                        if result_hmm is not None:
+                            results.append(result_hmm)
+
+        if threshold_type == 'domain':
+            for hits in pyhmmer.hmmsearch(hmms, sequences, cpus=pyhmmer_core, Z=len(hmm_profiles), parallel="targets", **pipeline_options):
+                for hit in hits.included:
+                    for domain in hit.domains.included:
+                        if domain.score >= threshold:
+                            result_hmm = filter_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db, domain)
+                            if result_hmm is not None:
+                                results.append(result_hmm)
+
+    return results
+
+
+def query_fasta_file(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1,
+                     search_strategy='auto', search_profile='default'):
     """Run HMM search with pyhmmer on protein fasta file using HMM files from database.
     Use associated threshold either for full sequence or domain.
 
@@ -196,9 +597,25 @@ def query_fasta_file(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER,
         motif_db (dict): dictionary containing gene name as key and motif to search as values
         motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
         pyhmmer_core (int): number of core used by pyhmmer
+        search_strategy (str): 'search', 'scan' or 'auto' (choose according to the number of sequences and HMMs)
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
 
     Returns:
-        results (list): list of result for HMM search, which are sublist containing: evalue, score and length
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+    """
+    results, _ = _query_fasta_file_with_residues(input_protein_fasta, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core,
+                                                 search_strategy, search_profile)
+
+    return results
+
+
+def _query_fasta_file_with_residues(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1,
+                                    search_strategy='auto', search_profile='default'):
+    """Run query_fasta_file and also count the residues of the searched sequences (for the progress report), without reading the file again.
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+        nb_residues (int): number of residues searched
     """
     input_filename = os.path.splitext(os.path.basename(input_protein_fasta))[0]
 
@@ -206,36 +623,427 @@ def query_fasta_file(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER,
     with pyhmmer.easel.SequenceFile(input_protein_fasta, digital=True) as seq_file:
         sequences = pyhmmer.easel.DigitalSequenceBlock(pyhmmer.easel.Alphabet.amino(), seq_file)
 
-    check_hmms = {hmm_filename.replace('.check.hmm', ''): os.path.join(hmm_folder, hmm_filename)
-                      for hmm_filename in os.listdir(hmm_folder) if hmm_filename.endswith('.hmm') and 'check' in hmm_filename}
+    hmm_profiles, check_hmms = load_hmm_profiles(hmm_thresholds, hmm_folder)
+    results = query_sequences(input_filename, sequences, hmm_thresholds, hmm_profiles, check_hmms, motif_db, motif_pair_db, pyhmmer_core, search_strategy,
+                              search_profile=search_profile)
+    nb_residues = sum([len(sequence) for sequence in sequences])
+
+    return results, nb_residues
+
+
+def query_fasta_file_in_chunks(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1,
+                               search_profile='default', chunk_residues=CHUNK_RESIDUES):
+    """Run HMM search with pyhmmer on a protein fasta file read by chunks of sequences, to search inputs too large to be loaded in memory.
+    The reported hits of all chunks are gathered before their selection so results are the same as query_fasta_file.
+
+    Args:
+        input_protein_fasta (str): path of protein fasta file
+        hmm_thresholds (dict): threshold for each HMM
+        hmm_folder (str): path to HMM folder
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        pyhmmer_core (int): number of core used by pyhmmer
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
+        chunk_residues (int): number of residues of each chunk of sequences
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+    """
+    results, _ = _query_fasta_file_in_chunks_with_residues(input_protein_fasta, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core,
+                                                           search_profile, chunk_residues)
+
+    return results
+
+
+def _query_fasta_file_in_chunks_with_residues(input_protein_fasta, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR,
+                                              pyhmmer_core=1, search_profile='default', chunk_residues=CHUNK_RESIDUES):
+    """Run query_fasta_file_in_chunks and also count the residues of the searched chunks (for the progress report).
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+        nb_residues (int): number of residues searched
+    """
+    input_filename = os.path.splitext(os.path.basename(input_protein_fasta))[0]
+    amino_alphabet = pyhmmer.easel.Alphabet.amino()
+
+    hmm_profiles, check_hmms = load_hmm_profiles(hmm_thresholds, hmm_folder)
+    optimized_profiles, _ = optimize_hmm_profiles(hmm_profiles)
+    search_space_size = len(hmm_profiles)
+    shared_hmms = {hmm_filebasename: (optimized_profiles[hmm_filebasename], search_space_size) for hmm_filebasename in optimized_profiles}
+
+    chunked_hits = {hmm_filebasename: [[] for _ in optimized_profiles[hmm_filebasename]] for hmm_filebasename in optimized_profiles}
+    # Only the sequences with hits are kept, for the motif checks.
+    hit_sequences = []
+    nb_residues = 0
+    with pyhmmer.easel.SequenceFile(input_protein_fasta, digital=True, alphabet=amino_alphabet) as seq_file:
+        sequences = seq_file.read_block(residues=chunk_residues)
+        while len(sequences) > 0:
+            nb_residues += sum([len(sequence) for sequence in sequences])
+            hit_names = set()
+            shared_hits = search_shared_hmms(sequences, shared_hmms, pyhmmer_core, search_profile)
+            for hmm_filebasename in shared_hits:
+                for profile_index, profile_hits in enumerate(shared_hits[hmm_filebasename]):
+                    chunked_hits[hmm_filebasename][profile_index].extend(profile_hits)
+                    hit_names.update([shared_hit.name for shared_hit in profile_hits])
+            hit_sequences.extend([sequence.copy() for sequence in sequences if sequence.name in hit_names])
+            sequences = seq_file.read_block(residues=chunk_residues)
+    hit_sequences = pyhmmer.easel.DigitalSequenceBlock(amino_alphabet, hit_sequences)
+
+    results = HitTable()
+    with profile_stage('filtering'):
+        for hmm_filebasename in chunked_hits:
+            # Sort hits of all chunks as hmmsearch sorts them.
+            for profile_hits in chunked_hits[hmm_filebasename]:
+                profile_hits.sort(key=lambda shared_hit: (-shared_hit.score, shared_hit.name))
+            results.extend(select_shared_hits(input_filename, hmm_filebasename, chunked_hits[hmm_filebasename], hmm_thresholds[hmm_filebasename],
+                                              search_space_size, hit_sequences, check_hmms, motif_db, motif_pair_db))
+
+    return results, nb_residues
+
+
+def estimate_worker_memory(hmm_folder=HMM_FOLDER):
+    """Estimate the memory used by a search worker with the HMM database loaded.
+
+    Args:
+        hmm_folder (str): path to HMM folder
+
+    Returns:
+        worker_memory (int): estimated memory in bytes
+    """
+    hmm_files_size = 0
+    for dirpath, _, filenames in os.walk(hmm_folder):
+        hmm_files_size += sum([os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames if filename.endswith('.hmm')])
+
+    return WORKER_BASE_MEMORY + HMM_FILE_MEMORY_FACTOR * hmm_files_size
+
+
+def read_fasta_index(input_protein_fasta):
+    """Read the number of sequences and residues of a protein fasta file from its fasta index (.fai file created by samtools faidx), without reading the fasta file.
+
+    Args:
+        input_protein_fasta (str): path of protein fasta file
+
+    Returns:
+        nb_sequences (int): number of sequences (None if there is no fasta index)
+        nb_residues (int): number of residues (None if there is no fasta index)
+    """
+    fasta_index_file = input_protein_fasta + '.fai'
+    # An index older than the fasta file may not correspond to it.
+    if not os.path.exists(fasta_index_file) or os.path.getmtime(fasta_index_file) < os.path.getmtime(input_protein_fasta):
+        return None, None
+
+    nb_sequences = 0
+    nb_residues = 0
+    with open(fasta_index_file, 'r') as open_fasta_index_file:
+        csvreader = csv.reader(open_fasta_index_file, delimiter='\t')
+        for line in csvreader:
+            nb_sequences += 1
+            nb_residues += int(line[1])
+
+    return nb_sequences, nb_residues
+
+
+def estimate_sequences_memory(input_protein_fasta):
+    """Estimate the memory used by the digital sequences of a protein fasta file, without reading it.
+    The estimation uses the number of sequences and residues of the fasta index (.fai) if it exists, otherwise the size of the file.
+
+    Args:
+        input_protein_fasta (str): path of protein fasta file
+
+    Returns:
+        sequences_memory (int): estimated memory in bytes
+    """
+    fasta_file_size = os.path.getsize(input_protein_fasta)
+    nb_sequences, nb_residues = read_fasta_index(input_protein_fasta)
+    if nb_residues is None:
+        return FASTA_FILE_MEMORY_FACTOR * fasta_file_size
+
+    # Headers (names and descriptions) and line breaks are the part of the file which is not residues.
+    headers_size = fasta_file_size - nb_residues
+
+    return RESIDUE_MEMORY * nb_residues + SEQUENCE_MEMORY * nb_sequences + headers_size
+
+
+def schedule_hmm_searches(hmm_search_pool, multiprocess_input_hmm_searches, core_number, memory_budget, worker_memory):
+    """Run the search tasks on the pool while their estimated memory stays under the memory budget.
+    Inputs whose estimated memory does not fit in the budget are searched by chunks of sequences (query_fasta_file_in_chunks).
+
+    Args:
+        hmm_search_pool (multiprocessing Pool): pool of search workers
+        multiprocess_input_hmm_searches (list): arguments of hmm_search_write_results for each input file
+        core_number (int): number of workers of the pool
+        memory_budget (int): memory budget in bytes
+        worker_memory (int): estimated memory of a worker with the HMM database loaded (from estimate_worker_memory)
+
+    Returns:
+        peak_rss_workers (list): peak RSS (in bytes) of the worker after each task
+        chunked_inputs (list): paths of the input files searched by chunks
+    """
+    if worker_memory > memory_budget:
+        logger.warning('Memory budget ({0:.2f} GB) is lower than the estimated memory of a search worker ({1:.2f} GB), inputs will be searched one at a time.'.format(
+                       memory_budget / 1024 ** 3, worker_memory / 1024 ** 3))
+
+    # A chunk has CHUNK_RESIDUES residues, so about the same number of bytes in the fasta file.
+    chunk_memory = FASTA_FILE_MEMORY_FACTOR * CHUNK_RESIDUES
+    pending_tasks = []
+    chunked_inputs = []
+    for task_index, hmm_search_arguments in enumerate(multiprocess_input_hmm_searches):
+        input_file_path = hmm_search_arguments[0]
+        task_memory = worker_memory + estimate_sequences_memory(input_file_path)
+        if task_memory > memory_budget:
+            task_memory = worker_memory + chunk_memory
+            hmm_search_arguments = hmm_search_arguments + [CHUNK_RESIDUES]
+            chunked_inputs.append(input_file_path)
+            logger.info('{0} does not fit in memory budget, it will be searched by chunks of {1} residues.'.format(input_file_path, CHUNK_RESIDUES))
+        pending_tasks.append((task_index, task_memory, hmm_search_arguments))
+
+    peak_rss_workers = [None] * len(pending_tasks)
+    task_errors = []
+    running = {'tasks': 0, 'memory': 0}
+    task_condition = threading.Condition()
+    searches_completed = False
+
+    def finish_task(task_index, task_memory, peak_rss=None, error=None):
+        with task_condition:
+            running['tasks'] -= 1
+            running['memory'] -= task_memory
+            peak_rss_workers[task_index] = peak_rss
+            if error is not None:
+                task_errors.append(error)
+            task_condition.notify()
+
+    try:
+        with task_condition:
+            while len(pending_tasks) > 0 and len(task_errors) == 0:
+                # Start the first pending task fitting in the remaining budget, a task is always started if no other task is running.
+                admitted_task = None
+                if running['tasks'] < core_number:
+                    for pending_task in pending_tasks:
+                        if running['tasks'] == 0 or running['memory'] + pending_task[1] <= memory_budget:
+                            admitted_task = pending_task
+                            break
+                if admitted_task is None:
+                    task_condition.wait()
+                    continue
+                pending_tasks.remove(admitted_task)
+                task_index, task_memory, hmm_search_arguments = admitted_task
+                running['tasks'] += 1
+                running['memory'] += task_memory
+                hmm_search_pool.apply_async(hmm_search_write_results, hmm_search_arguments,
+                                            callback=lambda peak_rss, task_index=task_index, task_memory=task_memory: finish_task(task_index, task_memory, peak_rss),
+                                            error_callback=lambda error, task_index=task_index, task_memory=task_memory: finish_task(task_index, task_memory, error=error))
+            while running['tasks'] > 0 and len(task_errors) == 0:
+                task_condition.wait()
+
+            if len(task_errors) > 0:
+                raise task_errors[0]
+        searches_completed = True
+    finally:
+        if not searches_completed:
+            # Wake up the threads waiting for a task, then stop the searches still running.
+            # The pool is stopped without holding task_condition, as its result handler can be waiting for it in finish_task.
+            with task_condition:
+                task_condition.notify_all()
+            hmm_search_pool.terminate()
+            hmm_search_pool.join()
+
+    return peak_rss_workers, chunked_inputs
+
+
+def get_file_digest(file_path):
+    """Compute the digest of a file (HMM or protein fasta file) to identify the same file in different folders or runs.
+
+    Args:
+        file_path (str): path of file
+
+    Returns:
+        file_digest (str): SHA-256 hexadecimal digest of the file
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as open_file:
+        for file_chunk in iter(lambda: open_file.read(1024 * 1024), b''):
+            file_hash.update(file_chunk)
+
+    return file_hash.hexdigest()
+
+
+def get_hmm_digest(hmm_filename):
+    """Compute the digest of an HMM file to identify the same HMM in different folders.
+
+    Args:
+        hmm_filename (str): path of HMM file
+
+    Returns:
+        hmm_digest (str): SHA-256 hexadecimal digest of the HMM file
+    """
+    return get_file_digest(hmm_filename)
+
+
+def get_hmm_filter_settings(hmm_name, check_hmm_digests, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+    """Get the settings used by filtering_hit for an HMM, two searches with the same settings keep the same hits.
+
+    Args:
+        hmm_name (str): name of the HMM (basename of HMM file without .hmm)
+        check_hmm_digests (dict): dictionary containing check HMM name associated with the digest of their file
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+
+    Returns:
+        filter_settings (dict): motif, motif pair and digests of the check HMMs used for the HMM
+    """
+    motif_pair = motif_pair_db.get(hmm_name)
+    if isinstance(motif_pair, str):
+        check_hmm_names = [hmm_name, motif_pair]
+    elif isinstance(motif_pair, list):
+        check_hmm_names = [hmm_name, *motif_pair]
+    else:
+        check_hmm_names = []
+    filter_settings = {'motif': motif_db.get(hmm_name), 'motif_pair': motif_pair,
+                       'check_hmms': {check_hmm_name: check_hmm_digests.get(check_hmm_name) for check_hmm_name in check_hmm_names}}
+
+    return filter_settings
+
+
+def get_hmm_search_settings(hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+    """Get the settings of the search made by query_fasta_file for each HMM, so that its hits can be reused by another search (bigecyhmm_custom --previous-run).
+
+    Args:
+        hmm_thresholds (dict): threshold for each HMM
+        hmm_folder (str): path to HMM folder
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+
+    Returns:
+        hmm_search_settings (dict): search space size and for each HMM basename its digest, threshold and filter settings
+    """
+    check_hmm_digests = {hmm_filename.replace('.check.hmm', ''): get_hmm_digest(os.path.join(hmm_folder, hmm_filename))
+                         for hmm_filename in os.listdir(hmm_folder) if hmm_filename.endswith('.hmm') and 'check' in hmm_filename}
     list_of_hmms = [hmm_filename for hmm_filename in os.listdir(hmm_folder) if hmm_filename.endswith('.hmm') and 'check' not in hmm_filename and hmm_filename in hmm_thresholds]
 
-    # Iterate on the HMM of the internal database to query them.
-    results = []
+    hmm_search_settings = {'search_space_size': len(list_of_hmms), 'hmms': {}}
     for hmm_filebasename in list_of_hmms:
-        hmm_filename = os.path.join(hmm_folder, hmm_filebasename)
-        if hmm_filename.endswith('.hmm') and 'check' not in hmm_filename and os.path.basename(hmm_filename) in hmm_thresholds:
-            with pyhmmer.plan7.HMMFile(hmm_filename) as hmm_file:
-                for threshold_data in hmm_thresholds[hmm_filebasename].split(', '):
-                    threshold, threshold_type = threshold_data.split('|')
-                    threshold = float(threshold)
-                    # Perform search of the HMM on all input protein sequences and filter them according to score (either hit or domain).
-                    if threshold_type == 'full':
-                        for hits in pyhmmer.hmmsearch(hmm_file, sequences, cpus=pyhmmer_core, Z=len(list_of_hmms), parallel="targets"):
-                            for hit in hits.included:
-                                if hit.score >= threshold:
-                                    result_hmm = filtering_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db)
-                                    if result_hmm is not None:
-                                        results.append(result_hmm)
-
-                    if threshold_type == 'domain':
-                        for hits in pyhmmer.hmmsearch(hmm_file, sequences, cpus=pyhmmer_core, Z=len(list_of_hmms), parallel="targets"):
-                            for hit in hits.included:
-                                for domain in hit.domains.included:
-                                    if domain.score >= threshold:
-                                        result_hmm = filtering_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db, domain)
-                                        if result_hmm is not None:
-                                            results.append(result_hmm)
+        hmm_search_settings['hmms'][hmm_filebasename] = {'digest': get_hmm_digest(os.path.join(hmm_folder, hmm_filebasename)),
+                                                          'threshold': hmm_thresholds[hmm_filebasename],
+                                                          **get_hmm_filter_settings(hmm_filebasename.replace('.hmm', ''), check_hmm_digests, motif_db, motif_pair_db)}
+
+    return hmm_search_settings
+
+
+def search_shared_hmms(sequences, shared_hmms, pyhmmer_core=1, search_profile='default'):
+    """Search each HMM once on protein sequences and keep all reported hits with their P-values.
+    As hits are reported if their e-value (P-value x Z) is lower than REPORTING_EVALUE, the smallest search space size Z
+    of the databases sharing an HMM is used so that the hits of all these databases are kept.
+
+    Args:
+        sequences (pyhmmer DigitalSequenceBlock): input protein sequences stored in pyhmmer object DigitalSequenceBlock
+        shared_hmms (dict): HMM digest as key and tuple (path of HMM file or list of pyhmmer HMM, search space size Z) as value
+        pyhmmer_core (int): number of core used by pyhmmer
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
+
+    Returns:
+        shared_hits (dict): HMM digest as key and list of hits (list of SharedHit) for each HMM profile of the file as value
+    """
+    shared_hits = {}
+    for hmm_digest, (hmm_source, search_space_size) in shared_hmms.items():
+        if isinstance(hmm_source, str):
+            with pyhmmer.plan7.HMMFile(hmm_source) as hmm_file:
+                hmms = list(hmm_file)
+        else:
+            hmms = hmm_source
+        shared_hits[hmm_digest] = [[SharedHit(hit.name, hit.score, hit.pvalue, hit.length,
+                                              [SharedDomain(domain.score, domain.pvalue) for domain in hit.domains])
+                                    for hit in hits]
+                                   for hits in pyhmmer.hmmsearch(hmms, sequences, cpus=pyhmmer_core, Z=search_space_size, parallel="targets",
+                                                                 **SEARCH_PROFILES[search_profile])]
+
+    return shared_hits
+
+
+def select_shared_hits(input_filename, hmm_filebasename, hmm_hits, hmm_threshold, search_space_size, sequences, check_hmms,
+                       motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+    """Select the shared hits of an HMM for a database, as if the HMM was searched with the search space size of this database (like in query_fasta_file).
+
+    Args:
+        input_filename (str): name of protein fasta file
+        hmm_filebasename (str): basename of HMM file in the database
+        hmm_hits (list): list of hits (list of SharedHit) for each HMM profile of the file, from search_shared_hmms
+        hmm_threshold (str): threshold string of the HMM in the database
+        search_space_size (int): number of HMMs searched for the database (Z)
+        sequences (pyhmmer DigitalSequenceBlock): input protein sequences stored in pyhmmer object DigitalSequenceBlock
+        check_hmms (dict): dictionary containing check HMM name associated with their paths
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+    """
+    results = HitTable()
+    # In query_fasta_file, the HMM file is consumed by the search of the first threshold, so only this threshold is applied.
+    threshold, threshold_type = hmm_threshold.split(', ')[0].split('|')
+    threshold = float(threshold)
+    for hits in hmm_hits:
+        # Domain e-values use the number of reported hits as search space size (domZ).
+        nb_reported_hits = sum(hit.pvalue * search_space_size <= REPORTING_EVALUE for hit in hits)
+        for shared_hit in hits:
+            if shared_hit.pvalue * search_space_size > INCLUSION_EVALUE:
+                continue
+            hit = replace(shared_hit, evalue=shared_hit.pvalue * search_space_size)
+            if threshold_type == 'full':
+                if hit.score >= threshold:
+                    result_hmm = filtering_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db)
+                    if result_hmm is not None:
+                        results.append(result_hmm)
+
+            if threshold_type == 'domain':
+                for domain in hit.domains:
+                    if domain.pvalue * nb_reported_hits <= INCLUSION_EVALUE and domain.score >= threshold:
+                        result_hmm = filtering_hit(input_filename, hmm_filebasename, hit, sequences, check_hmms, motif_db, motif_pair_db, domain)
+                        if result_hmm is not None:
+                            results.append(result_hmm)
+
+    return results
+
+
+def get_inclusion_score(hmms, search_space_size):
+    """Compute the score from which the hits of HMMs are included with a search space size.
+    The P-value of a hit is computed from its score with the exponential tail (tau, lambda) of the HMM, so a hit is included
+    (P-value x Z lower than INCLUSION_EVALUE) if its score is above this value.
+
+    Args:
+        hmms (list): list of pyhmmer HMM
+        search_space_size (int): search space size (Z)
+
+    Returns:
+        inclusion_score (float): highest score needed to be included for the HMMs
+    """
+    inclusion_score = max([hmm.evalue_parameters.f_tau + math.log(search_space_size / INCLUSION_EVALUE) / hmm.evalue_parameters.f_lambda
+                           for hmm in hmms])
+
+    return inclusion_score
+
+
+def select_previous_hits(input_filename, hmm_filebasename, previous_results, previous_search_space_size, search_space_size):
+    """Select the hits of an HMM found by a previous search (rows of its hmm_results file), as if the HMM was searched with the search space size of this database.
+
+    Args:
+        input_filename (str): name of protein fasta file
+        hmm_filebasename (str): basename of HMM file in the database
+        previous_results (HitTable): hits of the previous hmm_results file for the HMM
+        previous_search_space_size (int): number of HMMs searched by the previous search (Z)
+        search_space_size (int): number of HMMs searched for the database (Z)
+
+    Returns:
+        results (HitTable): hits kept by the HMM search, as rows containing: input file name, hit name, hmm name, evalue, score and length
+    """
+    if search_space_size != previous_search_space_size:
+        # E-values of all hits are rescaled to the search space size of the database, then hits still included are selected.
+        evalues = array('d', [evalue / previous_search_space_size * search_space_size for evalue in previous_results.evalues])
+        selected_hits = [evalue <= INCLUSION_EVALUE for evalue in evalues]
+        results = previous_results.select(selected_hits)
+        results.evalues = array('d', compress(evalues, selected_hits))
+    else:
+        results = HitTable(previous_results)
+    results.set_organism_and_hmm(input_filename, hmm_filebasename)
 
     return results
 
@@ -244,48 +1052,120 @@ def write_results(hmm_results, output_file):
     """Write HMM results in a tsv file 
 
     Args:
-        hmm_results (list): list of result for HMM search, which are sublist containing: evalue, score and length
+        hmm_results (HitTable or list): hits kept by the HMM search, as a HitTable or as rows containing: input file name, hit name, hmm name, evalue, score and length
         output_file (str): path to ouput tsv file
     """
+    if not isinstance(hmm_results, HitTable):
+        hmm_results = HitTable(hmm_results)
     with open(output_file, 'w') as open_output_file:
-        csvwriter = csv.writer(open_output_file, delimiter='\t')
-        csvwriter.writerow(['organism', 'protein', 'HMM', 'evalue', 'score', 'length'])
-        for result in hmm_results:
-            csvwriter.writerow(result)
+        open_output_file.write('\t'.join(HMM_RESULTS_HEADER) + '\r\n')
+        hmm_results.write_rows(open_output_file)
 
 
-def create_major_functions(hmm_output_folder, output_file, hmm_template_file=HMM_TEMPLATE_FILE):
-    """Map hit HMMs with list of major functions to create a tsv file showing these results.
+def get_hmm_functions(hmm_template_file=HMM_TEMPLATE_FILE):
+    """Extract the HMMs associated with each major function from HMM template file.
 
     Args:
-        hmm_output_folder (str): path to HMM search results folder (one tsv file per organism)
-        output_file (str): path to the output tsv file
         hmm_template_file (str): path of HMM template file
+
+    Returns:
+        hmm_functions (dict): function name as key and set of HMMs as value
+        hmm_to_functions (dict): HMM as key and list of function names as value
     """
+    hmm_functions = {}
     with open(hmm_template_file, 'r') as open_hmm_template:
         csvreader = csv.DictReader(open_hmm_template, delimiter='\t')
-
-        hmm_functions = {}
         for line in csvreader:
-            for hmm_file in line['Hmm file'].split(', '):
-                function_name = line['Function'] + ' ' + line['Gene abbreviation']
-                if function_name not in hmm_functions:
-                    hmm_functions[function_name] = [hmm_file]
-                else:
-                    hmm_functions[function_name].append(hmm_file)
+            function_name = line['Function'] + ' ' + line['Gene abbreviation']
+            if function_name not in hmm_functions:
+                hmm_functions[function_name] = set()
+            hmm_functions[function_name].update(line['Hmm file'].split(', '))
+
+    hmm_to_functions = {}
+    for function_name in hmm_functions:
+        for hmm_file in hmm_functions[function_name]:
+            if hmm_file not in hmm_to_functions:
+                hmm_to_functions[hmm_file] = [function_name]
+            else:
+                hmm_to_functions[hmm_file].append(function_name)
+
+    return hmm_functions, hmm_to_functions
+
+
+def compute_function_presences(hmm_hits, hmm_functions, hmm_to_functions):
+    """Compute the ratio of HMMs of each function found in each organism.
+    Only the functions having at least one HMM hit are stored.
+
+    Args:
+        hmm_hits (dict): dictionary with organism as key and list of hit HMMs as value
+        hmm_functions (dict): function name as key and set of HMMs as value
+        hmm_to_functions (dict): HMM as key and list of function names as value
+
+    Returns:
+        function_presences (dict): organism as key and subdict with function as key and ratio of its HMMs found in organism as value
+    """
+    function_presences = {}
+    for org in hmm_hits:
+        function_hmm_counts = {}
+        for hmm_file in set(hmm_hits[org]):
+            if hmm_file in hmm_to_functions:
+                for function_name in hmm_to_functions[hmm_file]:
+                    if function_name not in function_hmm_counts:
+                        function_hmm_counts[function_name] = 1
+                    else:
+                        function_hmm_counts[function_name] += 1
+        function_presences[org] = {function_name: function_hmm_counts[function_name] / len(hmm_functions[function_name]) for function_name in function_hmm_counts}
+
+    return function_presences
+
+
+def create_major_functions(hmm_output_folder, output_file, hmm_template_file=HMM_TEMPLATE_FILE, sparse_output_folder=None):
+    """Map hit HMMs with list of major functions to create a tsv file showing these results.
+
+    Args:
+        hmm_output_folder (str): path to HMM search results folder (one tsv file per organism)
+        output_file (str): path to the output tsv file
+        hmm_template_file (str): path of HMM template file
+        sparse_output_folder (str): if not None, path to a folder where the function presences are also written in sparse format
+
+    Returns:
+        function_presences (dict): organism as key and subdict with function as key and ratio of its HMMs found in organism as value
+    """
+    hmm_functions, hmm_to_functions = get_hmm_functions(hmm_template_file)
 
     hmm_list_functions = [function for function in hmm_functions]
     hmm_hits = parse_result_files(hmm_output_folder)
     org_list = [org for org in hmm_hits]
+    function_presences = compute_function_presences(hmm_hits, hmm_functions, hmm_to_functions)
+
+    write_function_presence_file(function_presences, hmm_list_functions, org_list, output_file)
+
+    if sparse_output_folder is not None:
+        write_sparse_presence(function_presences, hmm_list_functions, org_list, sparse_output_folder)
+
+    return function_presences
+
+
+def write_function_presence_file(function_presences, hmm_list_functions, org_list, output_file):
+    """Write the function presences in a tsv file (functions as rows, organisms as columns and NA for absent functions).
+
+    Args:
+        function_presences (dict): organism as key and subdict with function as key and ratio of its HMMs found in organism as value
+        hmm_list_functions (list): list of functions (rows of the file)
+        org_list (list): list of organisms (columns of the file)
+        output_file (str): path to the output tsv file
+    """
     with open(output_file, 'w') as open_output_file:
         csvwriter = csv.writer(open_output_file, delimiter='\t')
         csvwriter.writerow(['function', *org_list])
         for function in hmm_list_functions:
-            present_functions = [len(set(hmm_functions[function]).intersection(set(hmm_hits[org])))/len(set(hmm_functions[function])) if len(set(hmm_functions[function]).intersection(set(hmm_hits[org]))) > 0 else 'NA' for org in org_list]
+            present_functions = [function_presences[org][function] if function in function_presences[org] else 'NA' for org in org_list]
             csvwriter.writerow([function, *present_functions])
 
 
-def hmm_search_write_results(input_file_path, output_file, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1):
+@profile_stage('search')
+def hmm_search_write_results(input_file_path, output_file, hmm_thresholds, hmm_folder=HMM_FOLDER, motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, pyhmmer_core=1,
+                             search_profile='default', chunk_residues=None):
     """Little functions for the starmap multiprocessing to launch HMM search and result writing
 
     Args:
@@ -296,14 +1176,29 @@ def hmm_search_write_results(input_file_path, output_file, hmm_thresholds, hmm_f
         motif_db (dict): dictionary containing gene name as key and motif to search as values
         motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
         pyhmmer_core (int): number of core used by pyhmmer
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES)
+        chunk_residues (int): if given, read the sequences by chunks of this number of residues (for inputs too large for the memory budget)
+
+    Returns:
+        peak_rss (int): peak RSS (in bytes) of the worker
     """
     logger.info('Search for HMMs on ' + input_file_path)
-    hmm_results = query_fasta_file(input_file_path, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core)
+    report_task_start(input_file_path)
+    if chunk_residues is None:
+        hmm_results, nb_residues = _query_fasta_file_with_residues(input_file_path, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core,
+                                                                   search_profile=search_profile)
+    else:
+        hmm_results, nb_residues = _query_fasta_file_in_chunks_with_residues(input_file_path, hmm_thresholds, hmm_folder, motif_db, motif_pair_db,
+                                                                             pyhmmer_core, search_profile, chunk_residues)
     write_results(hmm_results, output_file)
+    report_task_end(input_file_path, nb_residues, len(hmm_results))
+
+    return get_peak_rss()
 
 
 def search_hmm(input_variable, output_folder, hmm_folder=HMM_FOLDER, hmm_template_file=HMM_TEMPLATE_FILE, pathway_template_file=PATHWAY_TEMPLATE_FILE,
-               motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, core_number=1):
+               motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, core_number=1, sparse_output=False, search_profile='default',
+               memory_budget=None):
     """Main function to use HMM search on protein sequences and write results
 
     Args:
@@ -315,9 +1210,15 @@ def search_hmm(input_variable, output_folder, hmm_folder=HMM_FOLDER, hmm_templat
         motif_db (dict): dictionary containing gene name as key and motif to search as values
         motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
         core_number (int): number of core to use for the multiprocessing
+        sparse_output (bool): also write function and pathway presences in sparse format (function_presence_sparse and pathway_presence_sparse folders)
+        search_profile (str): search profile giving the options of HMMER pipeline (key of SEARCH_PROFILES), 'fast' to screen inputs with tightened filters
+        memory_budget (float): memory budget in GB for the search workers, inputs are searched while their estimated memory fits in it
     """
     start_time = time.time()
     input_dicts = file_or_folder(input_variable)
+    if search_profile not in SEARCH_PROFILES:
+        logger.critical('Unknown search profile {0}, it must be one of {1}.'.format(search_profile, ', '.join(SEARCH_PROFILES)))
+        sys.exit(1)
 
     logger.info('HMM folder: ' + hmm_folder)
     logger.info('HMM template file : ' + hmm_template_file)
@@ -336,32 +1237,54 @@ def search_hmm(input_variable, output_folder, hmm_folder=HMM_FOLDER, hmm_templat
     hmm_thresholds = get_hmm_thresholds(hmm_template_file)
 
     # Map pathway to function name.
-    pathway_template_df = get_link_pathway_function_name(pathway_template_file, hmm_template_file)
     mapping_pathway_function_file = os.path.join(output_folder, 'mapping_pathway_to_function_name.tsv')
-    pathway_template_df.to_csv(mapping_pathway_function_file, sep='\t', index=False)
+    write_pathway_function_names(pathway_template_file, hmm_template_file, mapping_pathway_function_file)
 
-    hmm_search_pool = Pool(processes=core_number)
+    # Workers send their progress to the main process, which renders it and writes it in bigecyhmm_status.json.
+    search_progress = SearchProgress(len(input_dicts), output_folder)
+    hmm_search_pool = Pool(processes=core_number, initializer=init_progress_worker, initargs=(search_progress.progress_queue,))
+    search_progress.start()
 
     multiprocess_input_hmm_searches = []
     for input_filename in input_dicts:
         output_file = os.path.join(hmm_output_folder, input_filename + '.tsv')
         input_file_path = input_dicts[input_filename]
-        multiprocess_input_hmm_searches.append([input_file_path, output_file, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core])
+        multiprocess_input_hmm_searches.append([input_file_path, output_file, hmm_thresholds, hmm_folder, motif_db, motif_pair_db, pyhmmer_core, search_profile])
 
-    hmm_search_pool.starmap(hmm_search_write_results, multiprocess_input_hmm_searches)
+    try:
+        if memory_budget is None:
+            peak_rss_workers = hmm_search_pool.starmap(hmm_search_write_results, multiprocess_input_hmm_searches)
+            chunked_inputs = []
+        else:
+            worker_memory = estimate_worker_memory(hmm_folder)
+            peak_rss_workers, chunked_inputs = schedule_hmm_searches(hmm_search_pool, multiprocess_input_hmm_searches, core_number,
+                                                                     int(memory_budget * 1024 ** 3), worker_memory)
+    except BaseException:
+        search_progress.stop('failed')
+        raise
 
     hmm_search_pool.close()
     hmm_search_pool.join()
+    search_progress.stop()
+
+    if sparse_output is True:
+        function_sparse_folder = os.path.join(output_folder, 'function_presence_sparse')
+        pathway_sparse_folder = os.path.join(output_folder, 'pathway_presence_sparse')
+    else:
+        function_sparse_folder = None
+        pathway_sparse_folder = None
 
-    function_matrix_file = os.path.join(output_folder, 'function_presence.tsv')
-    create_major_functions(hmm_output_folder, function_matrix_file)
+    with profile_stage('aggregation'):
+        function_matrix_file = os.path.join(output_folder, 'function_presence.tsv')
+        create_major_functions(hmm_output_folder, function_matrix_file, sparse_output_folder=function_sparse_folder)
 
-    input_diagram_folder = os.path.join(output_folder, 'diagram_input')
-    create_input_diagram(hmm_output_folder, input_diagram_folder, output_folder, pathway_template_file)
-    create_pathway_presence_files(hmm_output_folder, output_folder, pathway_template_file)
+        input_diagram_folder = os.path.join(output_folder, 'diagram_input')
+        create_input_diagram(hmm_output_folder, input_diagram_folder, output_folder, pathway_template_file)
+        create_pathway_presence_files(hmm_output_folder, output_folder, pathway_template_file, sparse_output_folder=pathway_sparse_folder)
 
-    input_diagram_file = os.path.join(output_folder, 'Total.R_input.txt')
-    create_diagram_figures(input_diagram_file, output_folder)
+    with profile_stage('plotting'):
+        input_diagram_file = os.path.join(output_folder, 'Total.R_input.txt')
+        create_diagram_figures(input_diagram_file, output_folder)
 
     duration = time.time() - start_time
     metadata_json = {}
@@ -372,7 +1295,15 @@ def search_hmm(input_variable, output_folder, hmm_folder=HMM_FOLDER, hmm_templat
     metadata_json['tool_dependencies']['python_package']['pyhmmer'] = pyhmmer.__version__
     metadata_json['tool_dependencies']['python_package']['pillow'] = pillow_version
 
-    metadata_json['input_parameters'] = {'input_variable': input_variable, 'output_folder': output_folder, 'core_number': core_number}
+    metadata_json['input_parameters'] = {'input_variable': input_variable, 'output_folder': output_folder, 'core_number': core_number,
+                                         'sparse_output': sparse_output, 'search_profile': search_profile, 'memory_budget': memory_budget}
+    # Settings of the search of each HMM and digests of input files, used by bigecyhmm_custom --previous-run to reuse the hits.
+    metadata_json['hmm_search'] = get_hmm_search_settings(hmm_thresholds, hmm_folder, motif_db, motif_pair_db)
+    metadata_json['hmm_search']['search_profile'] = search_profile
+    metadata_json['hmm_search']['input_digests'] = {input_filename: get_file_digest(input_dicts[input_filename]) for input_filename in input_dicts}
+    metadata_json['memory'] = {'peak_rss_main_process_mb': round(get_peak_rss() / 1024 ** 2, 1),
+                               'peak_rss_search_workers_mb': round(max(peak_rss_workers, default=0) / 1024 ** 2, 1),
+                               'chunked_inputs': chunked_inputs}
     metadata_json['duration'] = duration
 
     metadata_file = os.path.join(output_folder, 'bigecyhmm_metadata.json')
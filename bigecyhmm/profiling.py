@@ -0,0 +1,156 @@
+# Copyright (C) 2024-2026 Arnaud Belcour - Univ. Grenoble Alpes, Inria, Grenoble, France Microcosme
+# Univ. Grenoble Alpes, Inria, Microcosme
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import shutil
+import tempfile
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Stages of the pipelines profiled separately, in the order of the summary.
+PROFILE_STAGES = ['search', 'filtering', 'aggregation', 'plotting']
+# Number of functions (sorted by cumulative time) shown for each stage in the summary.
+PROFILE_TOP_N = 30
+# Environment variable giving the folder of the profiles of each process, it is inherited by the processes of multiprocessing pools.
+PROFILE_FOLDER_VARIABLE = 'BIGECYHMM_PROFILE_FOLDER'
+
+# Profiler of each stage in the current process, the stack of active stages and the process to which they belong
+# (forked processes inherit them from their parent and start new ones).
+STAGE_PROFILERS = {}
+ACTIVE_STAGES = []
+PROFILED_PID = None
+
+
+def reset_forked_profilers():
+    """Discard the profilers inherited from the parent process by a forked process."""
+    global PROFILED_PID
+    if PROFILED_PID != os.getpid():
+        for stage in ACTIVE_STAGES:
+            STAGE_PROFILERS[stage].disable()
+        STAGE_PROFILERS.clear()
+        ACTIVE_STAGES.clear()
+        PROFILED_PID = os.getpid()
+
+
+def is_profiling_enabled():
+    """Check if profiling is enabled (by enable_profiling), to profile functions called for each hit only when it is.
+
+    Returns:
+        bool: True if profiling is enabled
+    """
+    return PROFILE_FOLDER_VARIABLE in os.environ
+
+
+@contextmanager
+def profile_stage(stage):
+    """Profile a stage of a pipeline with cProfile if profiling is enabled (by enable_profiling), in the main process or in a pool worker.
+    A stage started inside another one pauses it, so the time of each function is only counted in the innermost stage.
+    Profiles of the process are written when its outermost stage ends. It can be used as a context manager or as a decorator.
+
+    Args:
+        stage (str): name of the stage (one of PROFILE_STAGES)
+    """
+    profile_folder = os.environ.get(PROFILE_FOLDER_VARIABLE)
+    if profile_folder is None:
+        yield
+        return
+
+    reset_forked_profilers()
+    # Stage already profiled (such as a function of a stage called by another function of the same stage).
+    if stage in ACTIVE_STAGES:
+        yield
+        return
+
+    if len(ACTIVE_STAGES) > 0:
+        STAGE_PROFILERS[ACTIVE_STAGES[-1]].disable()
+    if stage not in STAGE_PROFILERS:
+        STAGE_PROFILERS[stage] = cProfile.Profile()
+    ACTIVE_STAGES.append(stage)
+    STAGE_PROFILERS[stage].enable()
+    try:
+        yield
+    finally:
+        STAGE_PROFILERS[stage].disable()
+        ACTIVE_STAGES.pop()
+        if len(ACTIVE_STAGES) > 0:
+            STAGE_PROFILERS[ACTIVE_STAGES[-1]].enable()
+        else:
+            # Profiles are accumulated by the process, so each file is replaced by the profile of all the tasks of the process.
+            for profiled_stage, stage_profiler in STAGE_PROFILERS.items():
+                stage_profiler.dump_stats(os.path.join(profile_folder, '{0}.{1}.pstats'.format(profiled_stage, os.getpid())))
+
+
+def enable_profiling(output_folder):
+    """Enable the profiling of the stages of the pipeline in this process and in the processes it starts.
+
+    Args:
+        output_folder (str): path to output folder, in which a temporary folder stores the profiles of each process
+
+    Returns:
+        profile_folder (str): path to the temporary folder of the profiles of each process
+    """
+    profile_folder = tempfile.mkdtemp(prefix='profiles_', dir=output_folder)
+    os.environ[PROFILE_FOLDER_VARIABLE] = profile_folder
+
+    return profile_folder
+
+
+def write_profiles(output_folder, prefix, top_n=PROFILE_TOP_N):
+    """Merge the profiles of all processes for each stage, write them as pstats files ({prefix}_profile_{stage}.pstats)
+    and write a summary with the top_n functions of each stage ({prefix}_profile.txt). Then disable profiling.
+
+    Args:
+        output_folder (str): path to output folder
+        prefix (str): prefix of the profile files (name of the command)
+        top_n (int): number of functions (sorted by cumulative time) shown for each stage in the summary
+
+    Returns:
+        summary_file (str): path to the summary file
+    """
+    profile_folder = os.environ.pop(PROFILE_FOLDER_VARIABLE)
+
+    stage_files = {}
+    for profile_filename in sorted(os.listdir(profile_folder)):
+        stage = profile_filename.split('.')[0]
+        if stage not in stage_files:
+            stage_files[stage] = []
+        stage_files[stage].append(os.path.join(profile_folder, profile_filename))
+
+    summary_file = os.path.join(output_folder, '{0}_profile.txt'.format(prefix))
+    with open(summary_file, 'w') as open_summary_file:
+        for stage in PROFILE_STAGES:
+            if stage not in stage_files:
+                continue
+            summary_stream = io.StringIO()
+            stage_stats = pstats.Stats(*stage_files[stage], stream=summary_stream)
+            stage_stats.dump_stats(os.path.join(output_folder, '{0}_profile_{1}.pstats'.format(prefix, stage)))
+
+            open_summary_file.write('## Stage {0}: {1} process(es)\n'.format(stage, len(stage_files[stage])))
+            # Do not list the temporary profile files of each process in the summary.
+            stage_stats.files = []
+            stage_stats.sort_stats('cumulative').print_stats(top_n)
+            open_summary_file.write(summary_stream.getvalue())
+            open_summary_file.write('\n')
+
+    shutil.rmtree(profile_folder)
+    logger.info('Profiles of {0} stage(s) written in {1}.'.format(len(stage_files), summary_file))
+
+    return summary_file
@@ -0,0 +1,227 @@
+# Copyright (C) 2024-2026 Arnaud Belcour - Univ. Grenoble Alpes, Inria, Grenoble, France Microcosme
+# Univ. Grenoble Alpes, Inria, Microcosme
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from multiprocessing import Queue
+
+logger = logging.getLogger(__name__)
+
+# Minimal number of seconds between two renderings of the progress line and between two writings of the status file.
+PROGRESS_INTERVAL = 1
+STATUS_INTERVAL = 10
+STATUS_FILENAME = 'bigecyhmm_status.json'
+
+# Queue used by the workers of the search pool to send their progress (set by init_progress_worker).
+PROGRESS_QUEUE = None
+
+
+def init_progress_worker(progress_queue):
+    """Give the progress queue to a worker of the search pool.
+
+    Args:
+        progress_queue (multiprocessing Queue): queue read by SearchProgress in the main process
+    """
+    global PROGRESS_QUEUE
+    PROGRESS_QUEUE = progress_queue
+
+
+def report_task_start(input_file_path):
+    """Report the start of the search of an input file, if the worker has a progress queue.
+
+    Args:
+        input_file_path (str): path of protein fasta file
+    """
+    if PROGRESS_QUEUE is not None:
+        PROGRESS_QUEUE.put(('start', os.getpid(), input_file_path, time.time()))
+
+
+def report_task_end(input_file_path, nb_residues, nb_hits):
+    """Report the end of the search of an input file, if the worker has a progress queue.
+
+    Args:
+        input_file_path (str): path of protein fasta file
+        nb_residues (int): number of residues searched
+        nb_hits (int): number of hits found
+    """
+    if PROGRESS_QUEUE is not None:
+        PROGRESS_QUEUE.put(('end', os.getpid(), input_file_path, time.time(), nb_residues, nb_hits))
+
+
+def format_duration(duration):
+    """Format a duration in seconds as hours, minutes and seconds.
+
+    Args:
+        duration (float): duration in seconds
+
+    Returns:
+        formatted_duration (str): duration such as 1h02m03s
+    """
+    minutes, seconds = divmod(int(duration), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return '{0}h{1:02d}m{2:02d}s'.format(hours, minutes, seconds)
+    if minutes > 0:
+        return '{0}m{1:02d}s'.format(minutes, seconds)
+    return '{0}s'.format(seconds)
+
+
+def format_throughput(residues_per_second):
+    """Format a number of residues searched per second.
+
+    Args:
+        residues_per_second (float): number of residues searched per second
+
+    Returns:
+        formatted_throughput (str): throughput such as 1.25 Mres/s
+    """
+    if residues_per_second >= 1e6:
+        return '{0:.2f} Mres/s'.format(residues_per_second / 1e6)
+    if residues_per_second >= 1e3:
+        return '{0:.2f} kres/s'.format(residues_per_second / 1e3)
+    return '{0:.0f} res/s'.format(residues_per_second)
+
+
+class SearchProgress:
+    """Follow the progress of the search workers from the main process: a thread reads the messages of the workers,
+    renders a progress line and writes periodically the status file in the output folder.
+    """
+    def __init__(self, nb_inputs, output_folder, progress_interval=PROGRESS_INTERVAL, status_interval=STATUS_INTERVAL):
+        self.lock = threading.Lock()
+        self.progress_queue = Queue()
+        self.status_file = os.path.join(output_folder, STATUS_FILENAME)
+        self.progress_interval = progress_interval
+        self.status_interval = status_interval
+        self.start_time = time.time()
+        self.nb_inputs = nb_inputs
+        self.completed = 0
+        self.residues = 0
+        self.hits = 0
+        # Worker PID as key and (input file path, start time of its search) as value.
+        self.running = {}
+        self.state = 'running'
+        self.progress_line_length = 0
+        self.progress_thread = threading.Thread(target=self.follow_progress, daemon=True)
+
+    def start(self):
+        self.write_status_file()
+        self.progress_thread.start()
+
+    def stop(self, state='completed'):
+        """Read the last messages of the workers, then write the final progress line and status file.
+
+        Args:
+            state (str): final state of the search written in the status file (completed or failed)
+        """
+        self.progress_queue.put(None)
+        self.progress_thread.join()
+        with self.lock:
+            self.state = state
+        self.render_progress_line(final=True)
+        self.write_status_file()
+
+    def follow_progress(self):
+        last_render_time = 0
+        last_status_time = time.time()
+        while True:
+            try:
+                message = self.progress_queue.get(timeout=self.progress_interval)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                break
+            self.update(message)
+
+            current_time = time.time()
+            if sys.stderr.isatty() and current_time - last_render_time >= self.progress_interval:
+                self.render_progress_line()
+                last_render_time = current_time
+            if current_time - last_status_time >= self.status_interval:
+                self.write_status_file()
+                # Outside of a terminal (such as a log file of a cluster job), the progress line is written with the status file.
+                if not sys.stderr.isatty():
+                    self.render_progress_line()
+                last_status_time = current_time
+
+    def update(self, message):
+        with self.lock:
+            if len(message) == 0:
+                return
+            if message[0] == 'start':
+                _, worker_pid, input_file_path, start_time = message
+                self.running[worker_pid] = (input_file_path, start_time)
+            elif message[0] == 'end':
+                _, worker_pid, input_file_path, end_time, nb_residues, nb_hits = message
+                self.running.pop(worker_pid, None)
+                self.completed += 1
+                self.residues += nb_residues
+                self.hits += nb_hits
+
+    def get_status(self):
+        """Get the progress of the search.
+
+        Returns:
+            status (dict): state, numbers of inputs completed and remaining, throughput, hits, ETA (in seconds) and inputs searched by each worker
+        """
+        current_time = time.time()
+        with self.lock:
+            elapsed = current_time - self.start_time
+            status = {'state': self.state, 'updated': current_time, 'elapsed': elapsed, 'inputs': self.nb_inputs, 'completed': self.completed,
+                      'remaining': self.nb_inputs - self.completed, 'residues': self.residues,
+                      'residues_per_second': self.residues / elapsed if elapsed > 0 else 0, 'hits': self.hits,
+                      'running': [{'worker': worker_pid, 'input': input_file_path, 'elapsed': current_time - start_time}
+                                  for worker_pid, (input_file_path, start_time) in self.running.items()]}
+        if status['completed'] > 0 and status['remaining'] > 0:
+            status['eta'] = elapsed / status['completed'] * status['remaining']
+        else:
+            status['eta'] = None
+
+        return status
+
+    def render_progress_line(self, final=False):
+        """Write the progress line on stderr (rewritten in place on a terminal, as a new line otherwise).
+
+        Args:
+            final (bool): last rendering of the progress line
+        """
+        status = self.get_status()
+        progress_line = '[{0}/{1}] {2:.1f}% | {3} | {4} hits | {5} running | elapsed {6}'.format(
+                        status['completed'], status['inputs'], 100 * status['completed'] / max(status['inputs'], 1),
+                        format_throughput(status['residues_per_second']), status['hits'], len(status['running']), format_duration(status['elapsed']))
+        if status['eta'] is not None:
+            progress_line += ' | ETA {0}'.format(format_duration(status['eta']))
+
+        if sys.stderr.isatty():
+            sys.stderr.write('\r' + progress_line.ljust(self.progress_line_length))
+            if final:
+                sys.stderr.write('\n')
+            self.progress_line_length = len(progress_line)
+        else:
+            sys.stderr.write(progress_line + '\n')
+        sys.stderr.flush()
+
+    def write_status_file(self):
+        status = self.get_status()
+        # The status file is replaced at once, so it is never read partially written.
+        tmp_status_file = self.status_file + '.tmp'
+        with open(tmp_status_file, 'w') as open_status_file:
+            json.dump(status, open_status_file, indent=4)
+        os.replace(tmp_status_file, self.status_file)
@@ -0,0 +1,413 @@
+# Copyright (C) 2024-2026 Arnaud Belcour - Univ. Grenoble Alpes, Inria, Grenoble, France Microcosme
+# Univ. Grenoble Alpes, Inria, Microcosme
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import argparse
+import collections
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+
+from bigecyhmm import __version__ as bigecyhmm_version
+from bigecyhmm.api import HMMDatabase, read_input_sequences
+from bigecyhmm import HMM_FOLDER, HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE, MOTIF, MOTIF_PAIR
+
+MESSAGE = '''
+Run bigecyhmm as a local service: the HMM database is loaded once and protein fasta files sent to the service are searched by a pool of workers.
+'''
+REQUIRES = '''
+Requires: pyhmmer.
+'''
+
+logger = logging.getLogger('bigecyhmm')
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Maximal size (in bytes) of the body of a request, larger requests are rejected (HTTP 413).
+DEFAULT_MAX_BODY_SIZE = 100 * 1024 ** 2
+# Number of latencies kept to compute latency metrics.
+LATENCY_WINDOW = 1000
+
+# Database loaded by each worker of the search pool (by init_search_worker).
+SEARCH_DATABASE = None
+
+
+def init_search_worker(hmm_folder=HMM_FOLDER, hmm_template_file=HMM_TEMPLATE_FILE, pathway_template_file=PATHWAY_TEMPLATE_FILE,
+                       motif_db=MOTIF, motif_pair_db=MOTIF_PAIR):
+    """Load the HMM database in a worker of the search pool, it is then used for all the searches of this worker.
+
+    Args:
+        hmm_folder (str): path to HMM folder
+        hmm_template_file (str): path of HMM template file
+        pathway_template_file (str): path to pathway template file
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+    """
+    global SEARCH_DATABASE
+    SEARCH_DATABASE = HMMDatabase(hmm_folder, hmm_template_file, pathway_template_file, motif_db, motif_pair_db)
+
+
+def search_proteome(input_name, input_protein_fasta=None, fasta_content=None):
+    """Search the HMMs of the database loaded by the worker on a proteome and compute its function and pathway presences.
+
+    Args:
+        input_name (str): name of the proteome
+        input_protein_fasta (str): path of protein fasta file
+        fasta_content (str): protein sequences in fasta format
+
+    Returns:
+        search_result (dict): name of proteome, number of sequences, hits, function presences, pathway presences and search duration
+    """
+    start_time = time.time()
+    if input_protein_fasta is not None:
+        sequences = read_input_sequences(input_protein_fasta)
+    else:
+        sequences = read_input_sequences(fasta_content)
+
+    search_result = asdict(SEARCH_DATABASE.search(sequences, input_name, pyhmmer_core=1))
+    search_result['nb_sequences'] = len(sequences)
+    search_result['search_duration'] = time.time() - start_time
+
+    return search_result
+
+
+class ServiceMetrics:
+    """Count the requests of the service and keep their latencies (thread-safe, as requests are handled by several threads).
+    """
+    def __init__(self, max_requests, core_number):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.max_requests = max_requests
+        self.core_number = core_number
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def start_request(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end_request(self, latency, success=True):
+        with self.lock:
+            self.in_flight -= 1
+            if success:
+                self.completed += 1
+                self.latencies.append(latency)
+            else:
+                self.failed += 1
+
+    def reject_request(self):
+        with self.lock:
+            self.rejected += 1
+
+    def get_metrics(self):
+        """Get the metrics of the service.
+
+        Returns:
+            metrics (dict): limits of the service, request counts and latencies (in seconds) of the last LATENCY_WINDOW completed requests
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = {'uptime': time.time() - self.start_time, 'workers': self.core_number, 'max_requests': self.max_requests,
+                       'in_flight': self.in_flight, 'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected}
+        if len(latencies) > 0:
+            metrics['latency'] = {'mean': sum(latencies) / len(latencies), 'p50': latencies[int(0.5 * (len(latencies) - 1))],
+                                  'p95': latencies[int(0.95 * (len(latencies) - 1))], 'max': latencies[-1]}
+        else:
+            metrics['latency'] = None
+
+        return metrics
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests of the service:
+    - GET /health: status of the service.
+    - GET /metrics: limits, request counts and latencies of the service.
+    - POST /search: search a proteome, given as JSON with "path" (path to a protein fasta file in the allowed root) or "fasta" (content of a fasta file)
+      and an optional "name".
+    """
+    server_version = 'bigecyhmm/' + bigecyhmm_version
+
+    def send_json(self, status_code, response_data):
+        response_bytes = json.dumps(response_data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
+    def log_message(self, format, *args):
+        logger.debug('|bigecyhmm|service| ' + format % args)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'bigecyhmm': bigecyhmm_version})
+        elif self.path == '/metrics':
+            self.send_json(200, self.server.metrics.get_metrics())
+        else:
+            self.send_json(404, {'error': 'Unknown path {0}.'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self.send_json(404, {'error': 'Unknown path {0}.'.format(self.path)})
+            return
+
+        # An invalid Content-Length gives an empty body, rejected as it is not a JSON object.
+        try:
+            content_length = max(int(self.headers.get('Content-Length', 0)), 0)
+        except ValueError:
+            content_length = 0
+        if content_length > self.server.max_body_size:
+            # The body is not read, so the connection can not be reused.
+            self.close_connection = True
+            self.send_json(413, {'error': 'Request body is larger than {0} bytes.'.format(self.server.max_body_size)})
+            return
+        try:
+            search_request = json.loads(self.rfile.read(content_length))
+        except ValueError:
+            search_request = None
+        if not isinstance(search_request, dict):
+            self.send_json(400, {'error': 'Request body must be a JSON object.'})
+            return
+
+        input_protein_fasta = search_request.get('path')
+        fasta_content = search_request.get('fasta')
+        if (input_protein_fasta is None) == (fasta_content is None):
+            self.send_json(400, {'error': 'Request must contain either "path" or "fasta".'})
+            return
+        if any(not isinstance(search_request[key], str) for key in ['path', 'fasta', 'name'] if search_request.get(key) is not None):
+            self.send_json(400, {'error': '"path", "fasta" and "name" must be strings.'})
+            return
+        if fasta_content is not None and not fasta_content.lstrip().startswith('>'):
+            self.send_json(400, {'error': '"fasta" must contain protein sequences in fasta format.'})
+            return
+        if input_protein_fasta is not None:
+            # Files are only read in the allowed root, relative paths being relative to it.
+            if self.server.allowed_root is None:
+                self.send_json(403, {'error': '"path" is not allowed by the service, start it with --allowed-root to search files.'})
+                return
+            input_protein_fasta = os.path.realpath(os.path.join(self.server.allowed_root, input_protein_fasta))
+            if os.path.commonpath([self.server.allowed_root, input_protein_fasta]) != self.server.allowed_root:
+                self.send_json(403, {'error': 'Protein fasta file {0} is not in the allowed root of the service.'.format(search_request['path'])})
+                return
+            if not os.path.isfile(input_protein_fasta):
+                self.send_json(404, {'error': 'Protein fasta file {0} not found.'.format(search_request['path'])})
+                return
+        if search_request.get('name') is not None:
+            input_name = search_request['name']
+        elif input_protein_fasta is not None:
+            input_name = os.path.splitext(os.path.basename(input_protein_fasta))[0]
+        else:
+            input_name = 'input'
+
+        # Reject the request if the service already handles its maximal number of requests (searched or waiting for a worker).
+        if not self.server.request_slots.acquire(blocking=False):
+            self.server.metrics.reject_request()
+            self.send_json(503, {'error': 'Service busy, {0} requests are already handled.'.format(self.server.metrics.max_requests)})
+            return
+
+        start_time = time.time()
+        self.server.metrics.start_request()
+        try:
+            search_result = self.server.search_pool.apply(search_proteome, (input_name, input_protein_fasta, fasta_content))
+        except Exception as error:
+            self.server.metrics.end_request(time.time() - start_time, success=False)
+            logger.critical('|bigecyhmm|service| Search of {0} failed: {1}'.format(input_name, error))
+            self.send_json(500, {'error': 'Search of {0} failed: {1}'.format(input_name, error)})
+            return
+        finally:
+            self.server.request_slots.release()
+        self.server.metrics.end_request(time.time() - start_time)
+
+        self.send_json(200, search_result)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket, each request being handled in a thread.
+    """
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address.
+        return request, ('local', 0)
+
+
+def create_search_server(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, core_number=1, max_requests=None,
+                         hmm_folder=HMM_FOLDER, hmm_template_file=HMM_TEMPLATE_FILE, pathway_template_file=PATHWAY_TEMPLATE_FILE,
+                         motif_db=MOTIF, motif_pair_db=MOTIF_PAIR, max_body_size=DEFAULT_MAX_BODY_SIZE, allowed_root=None):
+    """Create the server of the service and its pool of search workers (each worker loading the HMM database once).
+
+    Args:
+        host (str): host of the HTTP server
+        port (int): port of the HTTP server (0 to use a free port)
+        socket_path (str): path to a Unix socket, used instead of host and port if given
+        core_number (int): number of search workers
+        max_requests (int): maximal number of requests handled at the same time (searched or waiting for a worker), 2 x core_number by default
+        hmm_folder (str): path to HMM folder
+        hmm_template_file (str): path of HMM template file
+        pathway_template_file (str): path to pathway template file
+        motif_db (dict): dictionary containing gene name as key and motif to search as values
+        motif_pair_db (dict): dictionary containing gene name as key and a second gene name as values
+        max_body_size (int): maximal size (in bytes) of the body of a request, larger requests are rejected (HTTP 413)
+        allowed_root (str): folder containing the protein fasta files that can be searched with "path", other paths are rejected (HTTP 403).
+                            If None, requests with "path" are rejected.
+
+    Returns:
+        search_server (ThreadingHTTPServer or ThreadingUnixHTTPServer): server of the service
+    """
+    if max_requests is None:
+        max_requests = 2 * core_number
+
+    search_pool = Pool(processes=core_number, initializer=init_search_worker,
+                       initargs=(hmm_folder, hmm_template_file, pathway_template_file, motif_db, motif_pair_db))
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        search_server = ThreadingUnixHTTPServer(socket_path, SearchRequestHandler)
+    else:
+        search_server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+
+    search_server.search_pool = search_pool
+    search_server.request_slots = threading.BoundedSemaphore(max_requests)
+    search_server.max_body_size = max_body_size
+    search_server.allowed_root = os.path.realpath(allowed_root) if allowed_root is not None else None
+    search_server.metrics = ServiceMetrics(max_requests, core_number)
+
+    return search_server
+
+
+def close_search_server(search_server):
+    """Close the server of the service and its pool of search workers.
+
+    Args:
+        search_server (ThreadingHTTPServer or ThreadingUnixHTTPServer): server of the service
+    """
+    search_server.server_close()
+    # Searches still running are stopped with the service.
+    search_server.search_pool.terminate()
+    search_server.search_pool.join()
+    if isinstance(search_server, ThreadingUnixHTTPServer) and os.path.exists(search_server.server_address):
+        os.remove(search_server.server_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        'bigecyhmm_service',
+        description=MESSAGE,
+        epilog=REQUIRES
+    )
+    parser.add_argument(
+        '--version',
+        action='version',
+        version='%(prog)s ' + bigecyhmm_version)
+
+    parser.add_argument(
+        '--host',
+        dest='host',
+        help='Host of the HTTP server (default: {0}).'.format(DEFAULT_HOST),
+        required=False,
+        default=DEFAULT_HOST)
+
+    parser.add_argument(
+        '--port',
+        dest='port',
+        help='Port of the HTTP server (default: {0}).'.format(DEFAULT_PORT),
+        required=False,
+        type=int,
+        default=DEFAULT_PORT)
+
+    parser.add_argument(
+        '--socket',
+        dest='socket',
+        help='Path to a Unix socket to listen to instead of host and port.',
+        required=False,
+        default=None)
+
+    parser.add_argument(
+        "-c",
+        "--core",
+        help="Number of search workers.",
+        required=False,
+        type=int,
+        default=1)
+
+    parser.add_argument(
+        '--max-requests',
+        dest='max_requests',
+        help='Maximal number of requests handled at the same time (searched or waiting for a worker), other requests are rejected (HTTP 503). Default: 2 x number of workers.',
+        required=False,
+        type=int,
+        default=None)
+
+    parser.add_argument(
+        '--max-body-size',
+        dest='max_body_size',
+        help='Maximal size (in MB) of the body of a request, larger requests are rejected (HTTP 413). Default: {0} MB.'.format(DEFAULT_MAX_BODY_SIZE // 1024 ** 2),
+        required=False,
+        type=float,
+        default=DEFAULT_MAX_BODY_SIZE / 1024 ** 2)
+
+    parser.add_argument(
+        '--allowed-root',
+        dest='allowed_root',
+        help='Folder containing the protein fasta files that can be searched with "path" (relative paths being relative to it), other paths are rejected (HTTP 403). Without it, only "fasta" can be used.',
+        required=False,
+        default=None)
+
+    args = parser.parse_args()
+
+    # set up the default console logger
+    formatter = logging.Formatter('%(message)s')
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+    logger.info("--- Load HMM database in {0} worker(s) ---".format(args.core))
+    search_server = create_search_server(args.host, args.port, args.socket, args.core, args.max_requests,
+                                         max_body_size=int(args.max_body_size * 1024 ** 2), allowed_root=args.allowed_root)
+    if args.socket is not None:
+        logger.info("--- bigecyhmm service listening on {0} ---".format(args.socket))
+    else:
+        logger.info("--- bigecyhmm service listening on http://{0}:{1} ---".format(*search_server.server_address[:2]))
+
+    # Stop the service (and remove its socket) when it is terminated.
+    def stop_service(signal_number, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop_service)
+
+    try:
+        search_server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("--- Stop bigecyhmm service ---")
+    finally:
+        close_search_server(search_server)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,8 +16,11 @@
 import logging
 import os
 import csv
+import resource
 import sys
-import pandas as pd
+
+from dataclasses import dataclass
+from typing import List
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +44,23 @@ def is_valid_dir(dirpath):
         return True
 
 
+def get_peak_rss(rusage_who=resource.RUSAGE_SELF):
+    """Get the peak resident set size (RSS) of the process (or of its terminated children).
+
+    Args:
+        rusage_who (int): resource.RUSAGE_SELF for the process or resource.RUSAGE_CHILDREN for its terminated children
+
+    Returns:
+        peak_rss (int): peak RSS in bytes
+    """
+    peak_rss = resource.getrusage(rusage_who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    if sys.platform != 'darwin':
+        peak_rss = peak_rss * 1024
+
+    return peak_rss
+
+
 def file_or_folder(variable_folder_file, extension_checks=['.faa'], second_extension_to_checks=None):
     """Check if the variable is file or a folder
 
@@ -117,6 +137,8 @@ def read_measures_file(measures_file_path):
         column_measure (dict): for each column, subdict with the measure of the different rows.
         total_measure_per_column (dict): for each column, the total measure of all rows.
     """
+    import pandas as pd
+
     if measures_file_path.endswith('.tsv'):
         delimiter = '\t'
     elif measures_file_path.endswith('.csv'):
@@ -136,6 +158,131 @@ def read_measures_file(measures_file_path):
     return column_measure, total_measure_per_column
 
 
+@dataclass
+class MeasureMatrix:
+    """Measures of a measure file stored as a matrix (rows such as organisms, columns such as samples).
+    It replaces the column_measure dictionary of read_measures_file for very large files.
+    """
+    matrix: 'np.ndarray'
+    row_names: List[str]
+    column_names: List[str]
+
+    def keys(self):
+        """Return the column names (like the keys of the column_measure dictionary)."""
+        return self.column_names
+
+
+def count_measures_rows(measures_file_path):
+    """Count the number of data rows (without the header) of a measure file.
+
+    Args:
+        measurement_file_path (str): path to measure file
+
+    Returns:
+        nb_rows (int): number of non-empty rows after the header.
+    """
+    nb_rows = 0
+    with open(measures_file_path, 'rb') as open_measures_file:
+        next(open_measures_file, None)
+        for line in open_measures_file:
+            if line.strip():
+                nb_rows += 1
+    return nb_rows
+
+
+def convert_measures_chunk(chunk_values, column_names, measures_file_path, dtype):
+    """Convert the values of a chunk of rows into a numeric matrix, checking that each column contains numbers.
+    Empty values are considered as missing values (NaN).
+
+    Args:
+        chunk_values (list): list of rows, each row being the list of the values (str) of each column.
+        column_names (list): names of the columns.
+        measurement_file_path (str): path to measure file (for error messages).
+        dtype (str): numpy dtype of the matrix.
+
+    Returns:
+        chunk_matrix (np.ndarray): matrix with the rows of the chunk and the columns.
+    """
+    import numpy as np
+    try:
+        return np.array(chunk_values, dtype=dtype)
+    except ValueError:
+        chunk_matrix = np.empty((len(chunk_values), len(column_names)), dtype=dtype)
+        for column_index, column_name in enumerate(column_names):
+            try:
+                chunk_matrix[:, column_index] = [float(row_values[column_index]) if row_values[column_index] != '' else np.nan
+                                                 for row_values in chunk_values]
+            except ValueError:
+                logger.critical('ERROR: Column {0} appears to not contain float or int in file {1}.'.format(column_name, measures_file_path))
+                sys.exit(1)
+        return chunk_matrix
+
+
+def read_measures_matrix(measures_file_path, dtype='float32', chunk_size=100, memmap_file=None):
+    """Read measurement file (such as abundance file for samples) as a matrix, without creating dictionaries.
+    Expect a tsv or csv files with organisms as rows, samples as columns and abundance as values.
+    The file is streamed by chunks of rows, each chunk being converted to dtype, checked and summed before being stored in the matrix.
+    With memmap_file, the matrix is stored in a memory-mapped numpy file (.npy) instead of memory.
+
+    Args:
+        measurement_file_path (str): path to measure file
+        dtype (str): numpy dtype of the matrix (float32 by default to halve memory compared to float64).
+        chunk_size (int): number of rows converted at once.
+        memmap_file (str): if not None, path to the .npy file used as backing store of the matrix.
+
+    Returns:
+        measure_matrix (MeasureMatrix): matrix with rows and columns of the measure file.
+        total_measure_per_column (dict): for each column, the total measure of all rows.
+    """
+    import numpy as np
+
+    if measures_file_path.endswith('.tsv'):
+        delimiter = '\t'
+    elif measures_file_path.endswith('.csv'):
+        delimiter = ','
+
+    nb_rows = count_measures_rows(measures_file_path)
+    with open(measures_file_path, 'r') as open_measures_file:
+        csvreader = csv.reader(open_measures_file, delimiter=delimiter)
+        column_names = next(csvreader)[1:]
+        if memmap_file is not None:
+            matrix = np.lib.format.open_memmap(memmap_file, mode='w+', dtype=dtype, shape=(nb_rows, len(column_names)))
+        else:
+            matrix = np.empty((nb_rows, len(column_names)), dtype=dtype)
+
+        row_names = []
+        chunk_values = []
+        # Totals are summed in float64 to avoid losing precision with float32 values.
+        column_totals = np.zeros(len(column_names), dtype='float64')
+        for line in csvreader:
+            if line == []:
+                continue
+            if len(line) != len(column_names) + 1:
+                logger.critical('ERROR: Row {0} does not have a value for each of the {1} columns in file {2}.'.format(line[0], len(column_names), measures_file_path))
+                sys.exit(1)
+            row_names.append(line[0])
+            chunk_values.append(line[1:])
+            if len(chunk_values) == chunk_size:
+                chunk_matrix = convert_measures_chunk(chunk_values, column_names, measures_file_path, dtype)
+                matrix[len(row_names)-len(chunk_values):len(row_names)] = chunk_matrix
+                column_totals += np.nansum(chunk_matrix, axis=0, dtype='float64')
+                chunk_values = []
+        # Convert the rows of the last chunk.
+        if len(chunk_values) > 0:
+            chunk_matrix = convert_measures_chunk(chunk_values, column_names, measures_file_path, dtype)
+            matrix[len(row_names)-len(chunk_values):len(row_names)] = chunk_matrix
+            column_totals += np.nansum(chunk_matrix, axis=0, dtype='float64')
+
+    # Rows with quoted multi-line fields are counted once per line by count_measures_rows, so the matrix can have extra rows.
+    if len(row_names) < nb_rows:
+        matrix = matrix[:len(row_names)]
+    if memmap_file is not None:
+        matrix.flush()
+    total_measure_per_column = {column_name: column_total for column_name, column_total in zip(column_names, column_totals.tolist())}
+
+    return MeasureMatrix(matrix, row_names, column_names), total_measure_per_column
+
+
 def read_esmecata_proteome_file(proteome_tax_id_file):
     """Read esmecata proteome file to extract associated betwenn organism name and tax_id_name.
 
@@ -158,6 +305,55 @@ def read_esmecata_proteome_file(proteome_tax_id_file):
     return observation_names_tax_id_names, observation_names_tax_ranks
 
 
+def get_pathway_function_names(pathway_template_file, hmm_template_file):
+    """ Map pathway and function name without requiring pandas.
+
+    Args:
+        hmm_template_file (str): path of HMM template file
+        pathway_template_file (str): path to pathway template file
+
+    Returns:
+        pathway_function_name_data (list): list of [pathway, function name] rows
+    """
+    hmm_functions = {}
+    with open(hmm_template_file, 'r') as open_hmm_template:
+        csvreader = csv.DictReader(open_hmm_template, delimiter='\t')
+        for row in csvreader:
+            for hmm in row['Hmm file'].split(', '):
+                hmm_functions[hmm] = row['Function']
+
+    pathway_function_name_data = []
+    with open(pathway_template_file, 'r') as open_pathway_template:
+        csvreader = csv.DictReader(open_pathway_template, delimiter='\t')
+        for row in csvreader:
+            pathway = row['Pathways']
+            pathway_hmms = row['HMMs']
+            if pathway_hmms:
+                pathway_hmms = pathway_hmms.replace('(', '').replace(')', '').replace(' and ', ' or ').split(' or ')
+                for pathway_hmm in pathway_hmms:
+                    if 'not' not in pathway_hmm:
+                        pathway_function_name_data.append([pathway, hmm_functions[pathway_hmm]])
+            else:
+                pathway_function_name_data.append([pathway, ''])
+
+    return pathway_function_name_data
+
+
+def write_pathway_function_names(pathway_template_file, hmm_template_file, output_file):
+    """ Write the mapping between pathway and function name in a tsv file.
+
+    Args:
+        hmm_template_file (str): path of HMM template file
+        pathway_template_file (str): path to pathway template file
+        output_file (str): path to output tsv file
+    """
+    pathway_function_name_data = get_pathway_function_names(pathway_template_file, hmm_template_file)
+    with open(output_file, 'w') as open_output_file:
+        csvwriter = csv.writer(open_output_file, delimiter='\t', lineterminator='\n')
+        csvwriter.writerow(['Pathway', 'Function_name'])
+        csvwriter.writerows(pathway_function_name_data)
+
+
 def get_link_pathway_function_name(pathway_template_file, hmm_template_file):
     """ Map pathway and function name.
 
@@ -168,25 +364,86 @@ def get_link_pathway_function_name(pathway_template_file, hmm_template_file):
     Returns:
         pathway_template_df (pd.DataFrame): pandas DataFrame ocntaining mapping between pathway and function name
     """
-    pathway_template_df = pd.read_csv(pathway_template_file, sep='\t')
+    import pandas as pd
 
-    hmm_template_df = pd.read_csv(hmm_template_file, sep='\t')
-    pathway_template_df['HMMs'] = pathway_template_df['HMMs'].str.replace('(', '').str.replace(')', '')
-    pathway_template_df['HMMs'] = pathway_template_df['HMMs'].str.replace(' and ', ' or ').str.split(' or ')
+    pathway_function_name_data = get_pathway_function_names(pathway_template_file, hmm_template_file)
+    pathway_template_df = pd.DataFrame(pathway_function_name_data, columns=['Pathway', 'Function_name'])
 
-    hmm_functions = {hmm: row['Function'] for index, row in hmm_template_df.iterrows() for hmm in row['Hmm file'].split(', ')}
+    return pathway_template_df
 
-    pathway_function_name_data = []
-    for index, row in pathway_template_df.iterrows():
-        pathway = row['Pathways']
-        pathway_hmms = row['HMMs']
-        if isinstance(pathway_hmms, list):
-            for pathway_hmm in pathway_hmms:
-                if 'not' not in pathway_hmm:
-                    pathway_function_name_data.append([pathway, hmm_functions[pathway_hmm]])
-        else:
-            pathway_function_name_data.append([pathway, ''])
 
-    pathway_template_df = pd.DataFrame(pathway_function_name_data, columns=['Pathway', 'Function_name'])
+def write_sparse_presence(presences, row_names, column_names, output_folder):
+    """Write a presence matrix (functions/pathways as rows, organisms as columns) in a sparse format.
+    The folder contains a coordinate Matrix Market file (matrix.mtx, 1-based indexes, only non-zero values)
+    and the names of the rows (functions.tsv) and of the columns (organisms.tsv), one per line.
 
-    return pathway_template_df
+    Args:
+        presences (dict): organism as key and subdict with function as key and its (non-zero) value as value
+        row_names (list): ordered list of functions
+        column_names (list): ordered list of organisms
+        output_folder (str): path to output folder
+    """
+    is_valid_dir(output_folder)
+
+    row_indexes = {row_name: index for index, row_name in enumerate(row_names, start=1)}
+    coordinates = []
+    for column_index, column_name in enumerate(column_names, start=1):
+        if column_name in presences:
+            for row_name, value in presences[column_name].items():
+                if value != 0:
+                    coordinates.append((row_indexes[row_name], column_index, value))
+    coordinates.sort()
+
+    with open(os.path.join(output_folder, 'matrix.mtx'), 'w') as open_matrix_file:
+        open_matrix_file.write('%%MatrixMarket matrix coordinate real general\n')
+        open_matrix_file.write('% rows: functions.tsv, columns: organisms.tsv\n')
+        open_matrix_file.write('{0} {1} {2}\n'.format(len(row_names), len(column_names), len(coordinates)))
+        for row_index, column_index, value in coordinates:
+            open_matrix_file.write('{0} {1} {2}\n'.format(row_index, column_index, value))
+
+    for names_filename, names in [('functions.tsv', row_names), ('organisms.tsv', column_names)]:
+        with open(os.path.join(output_folder, names_filename), 'w') as open_names_file:
+            for name in names:
+                open_names_file.write(name + '\n')
+
+
+def read_sparse_presence(input_folder):
+    """Read a presence matrix written by write_sparse_presence.
+
+    Args:
+        input_folder (str): path to sparse presence folder
+
+    Returns:
+        presences (dict): function as key and subdict with organism as key and its (non-zero) value as value
+        row_names (list): ordered list of functions
+        column_names (list): ordered list of organisms
+    """
+    names = {}
+    for names_filename in ['functions.tsv', 'organisms.tsv']:
+        with open(os.path.join(input_folder, names_filename), 'r') as open_names_file:
+            names[names_filename] = [line.rstrip('\n') for line in open_names_file]
+    row_names = names['functions.tsv']
+    column_names = names['organisms.tsv']
+
+    presences = {row_name: {} for row_name in row_names}
+    with open(os.path.join(input_folder, 'matrix.mtx'), 'r') as open_matrix_file:
+        header_read = False
+        for line in open_matrix_file:
+            if line.startswith('%'):
+                continue
+            if header_read is False:
+                nb_rows, nb_columns, nb_values = [int(element) for element in line.split()]
+                if nb_rows != len(row_names) or nb_columns != len(column_names):
+                    logger.critical('ERROR: Sparse matrix {0} does not have the same size as its row and column names.'.format(input_folder))
+                    sys.exit(1)
+                header_read = True
+                continue
+            row_index, column_index, value = line.split()
+            # Keep integer values (such as pathway presences) as int.
+            if value.lstrip('-').isdigit():
+                value = int(value)
+            else:
+                value = float(value)
+            presences[row_names[int(row_index)-1]][column_names[int(column_index)-1]] = value
+
+    return presences, row_names, column_names
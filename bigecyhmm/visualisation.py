@@ -13,14 +13,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import pandas as pd
-import numpy as np
-from pandas import __version__ as pandas_version
-import seaborn as sns
-from seaborn import __version__ as seaborn_version
-import matplotlib.pyplot as plt
-from matplotlib import __version__ as matplotlib_version
-
 import argparse
 import logging
 import csv
@@ -30,13 +22,21 @@ import os
 import sys
 import time
 
+from importlib.metadata import version as package_version
+from multiprocessing import Pool
+
 from bigecyhmm import __version__ as bigecyhmm_version
 from bigecyhmm import PATHWAY_TEMPLATE_FILE, HMM_TEMPLATE_FILE, CUSTOM_HYDROGEN_TABLE, TEMPLATE_CUSTOM_CENTRAL_HYDROGEN, TEMPLATE_BACKGROUND_BIGECYHMM
-from bigecyhmm.utils import is_valid_dir, read_measures_file, read_esmecata_proteome_file
-from bigecyhmm.diagram_cycles import create_carbon_cycle, create_nitrogen_cycle, create_sulfur_cycle, create_other_cycle, create_phosphorus_cycle, get_diagram_pathways_hmms
-from bigecyhmm.group_analysis import statNut_run
+from bigecyhmm.profiling import profile_stage, enable_profiling, write_profiles
+from bigecyhmm.utils import is_valid_dir, read_measures_file, read_measures_matrix, read_esmecata_proteome_file, read_sparse_presence, MeasureMatrix
+from bigecyhmm.diagram_cycles import create_cycle_diagrams, get_diagram_pathways_hmms, compile_pathway_expression, evaluate_pathway_expression, \
+                                     DIAGRAM_CYCLES, DIAGRAM_FORMATS
 
-from esmecata.utils import get_domain_or_superkingdom_from_ncbi_tax_database
+PARTICIPATION_FORMATS = ['per_sample', 'long']
+LONG_PARTICIPATION_COLUMNS = ['sample', 'organism', 'function', 'abundance']
+ABUNDANCE_STORAGES = ['dict', 'float32', 'memmap']
+# Statistical tests of group_analysis (kept here to not import it when parsing arguments).
+GROUP_TESTS = ['kruskal', 'permutation']
 
 RANK_SORTED = ['isolate', 'strain', 'serotype', 'serogroup', 'forma', 'subvariety', 'varietas',
                'subspecies', 'forma specialis', 'species', 'species subgroup', 'species group',
@@ -49,7 +49,7 @@ RANK_SORTED = ['isolate', 'strain', 'serotype', 'serogroup', 'forma', 'subvariet
                'subcohort', 'cohort',
                'infraclass', 'subclass', 'class', 'superclass',
                'infraphylum', 'subphylum', 'phylum', 'superphylum',
-               'subkingdom', 'kingdom', get_domain_or_superkingdom_from_ncbi_tax_database(),
+               'subkingdom', 'kingdom', 'domain/superkingdom',
                'clade', 'environmental samples', 'incertae sedis', 'unclassified', 'no rank', 'Not found']
 
 FUNCTION_GROUP_TEMPLATE = {'Carbon cycle': ['C-S-01:Organic carbon oxidation', 'C-S-02:Carbon fixation', 'C-S-03:Ethanol oxidation', 'C-S-04:Acetate oxidation',
@@ -81,6 +81,21 @@ Requires seaborn, pandas and matplotlib.
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+def get_rank_sorted():
+    """Get the taxonomic ranks sorted from the lowest to the highest.
+    The name of the domain rank depends on the NCBI Taxonomy database used by EsMeCaTa, so esmecata is only imported when this function is called.
+
+    Returns:
+        rank_sorted (list): sorted taxonomic ranks
+    """
+    from esmecata.utils import get_domain_or_superkingdom_from_ncbi_tax_database
+
+    domain_rank = get_domain_or_superkingdom_from_ncbi_tax_database()
+    rank_sorted = [domain_rank if rank == 'domain/superkingdom' else rank for rank in RANK_SORTED]
+
+    return rank_sorted
+
+
 def get_function_categories():
     """Extract function categories from HMM template file.
 
@@ -101,12 +116,30 @@ def get_function_categories():
     return function_categories
 
 
+def iterate_sample_abundance(sample_abundance):
+    """Iterate over the samples and the abundance of the organisms in each of them.
+
+    Args:
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms (or matrix from read_measures_matrix).
+
+    Yields:
+        sample (str): name of the sample.
+        organism_abundances (iterable): pairs of organism and its abundance in the sample.
+    """
+    if isinstance(sample_abundance, MeasureMatrix):
+        for sample_index, sample in enumerate(sample_abundance.column_names):
+            yield sample, zip(sample_abundance.row_names, sample_abundance.matrix[:, sample_index].tolist())
+    else:
+        for sample in sample_abundance:
+            yield sample, sample_abundance[sample].items()
+
+
 def compute_relative_abundance_per_tax_id(sample_abundance, sample_tot_abundance, observation_names_tax_id_names):
     """For each tax_id_name selected by esmecata (from observation_names_tax_id_names) compute the relative abundace of this taxon.
     It is done by summing the abundance of all organisms in this tax_id_name and then dividing it by the total abundance in the sample.
 
     Args:
-        sample_abundance (dict): for each sample, subdict with the abundance of the different organisms.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms.
         sample_tot_abundance (dict): for each sample, the total abundance of all organisms in the sample.
         observation_names_tax_id_names (dict): dictionary associating organism name with tax_id_name
 
@@ -115,16 +148,16 @@ def compute_relative_abundance_per_tax_id(sample_abundance, sample_tot_abundance
     """
     abundance_data = {}
 
-    for sample_name in sample_abundance:
-        for observation_name in sample_abundance[sample_name]:
+    for sample_name, observation_abundances in iterate_sample_abundance(sample_abundance):
+        for observation_name, observation_abundance in observation_abundances:
             if observation_name in observation_names_tax_id_names:
                 tax_id_name = observation_names_tax_id_names[observation_name]
                 if sample_name not in abundance_data:
                     abundance_data[sample_name] = {}
                 if tax_id_name not in abundance_data[sample_name]:
-                    abundance_data[sample_name][tax_id_name] = float(sample_abundance[sample_name][observation_name])
+                    abundance_data[sample_name][tax_id_name] = float(observation_abundance)
                 else:
-                    abundance_data[sample_name][tax_id_name] = float(sample_abundance[sample_name][observation_name]) + float(abundance_data[sample_name][tax_id_name])
+                    abundance_data[sample_name][tax_id_name] = float(observation_abundance) + float(abundance_data[sample_name][tax_id_name])
 
         for tax_id_name in abundance_data[sample_name]:
             abundance_data[sample_name][tax_id_name] = abundance_data[sample_name][tax_id_name] / sample_tot_abundance[sample_name]
@@ -137,7 +170,7 @@ def compute_abundance_per_tax_rank(sample_abundance, observation_names_tax_ranks
     It is done by summing the abundance of all organisms in this tax_id_name and then dividing it by the total abundance in the sample.
 
     Args:
-        sample_abundance (dict): for each sample, subdict with the abundance of the different organisms.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms.
         observation_names_tax_ranks (dict): dictionary associating organism name with tax_id_name
         sample_tot_abundance (dict): for each sample, the total abundance of all organisms in the sample.
 
@@ -148,13 +181,12 @@ def compute_abundance_per_tax_rank(sample_abundance, observation_names_tax_ranks
     """
     sample_abundance_tax_rank = {}
     organism_abundance_tax_rank = {}
-    for sample in sample_abundance:
+    for sample, organism_abundances in iterate_sample_abundance(sample_abundance):
         if sample not in sample_abundance_tax_rank:
             sample_abundance_tax_rank[sample] = {}
         if sample not in organism_abundance_tax_rank:
             organism_abundance_tax_rank[sample] = {}
-        for organism in sample_abundance[sample]:
-            abundance_organism = sample_abundance[sample][organism]
+        for organism, abundance_organism in organism_abundances:
             if organism in observation_names_tax_ranks:
                 tax_rank = observation_names_tax_ranks[organism]
             else:
@@ -166,7 +198,7 @@ def compute_abundance_per_tax_rank(sample_abundance, observation_names_tax_ranks
             if organism not in organism_abundance_tax_rank[sample]:
                 organism_abundance_tax_rank[sample][organism] = (tax_rank, abundance_organism)
             else:
-                organism_abundance_tax_rank[sample][organism][1] = organism_abundance_tax_rank[sample][organism][1] + abundance_organism
+                organism_abundance_tax_rank[sample][organism] = (tax_rank, organism_abundance_tax_rank[sample][organism][1] + abundance_organism)
 
     data_abundance_taxon_sample = []
     for sample in sample_abundance_tax_rank:
@@ -182,17 +214,58 @@ def compute_abundance_per_tax_rank(sample_abundance, observation_names_tax_ranks
     return data_abundance_taxon_sample, sample_abundance_tax_rank, data_abundance_organism_sample
 
 
+def get_bigecyhmm_presence_input(bigecyhmm_output, presence_name):
+    """Select the presence file of bigecyhmm to read: the sparse folder (created with bigecyhmm --sparse) if it exists, otherwise the tsv file.
+
+    Args:
+        bigecyhmm_output (str): path to bigecyhmm output folder.
+        presence_name (str): either pathway_presence or function_presence.
+
+    Returns:
+        bigecyhmm_presence_input (str): path to the sparse presence folder or to the presence tsv file.
+    """
+    bigecyhmm_sparse_folder = os.path.join(bigecyhmm_output, presence_name + '_sparse')
+    if os.path.isdir(bigecyhmm_sparse_folder):
+        return bigecyhmm_sparse_folder
+    else:
+        return os.path.join(bigecyhmm_output, presence_name + '.tsv')
+
+
+def get_bigecyhmm_presence_functions(bigecyhmm_output_file):
+    """Get the ordered list of functions/pathways of pathway_presence or function_presence (tsv file or sparse folder).
+
+    Args:
+        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv) or to its sparse folder.
+
+    Returns:
+        all_functions (list): ordered list of functions/pathways.
+    """
+    import pandas as pd
+    if os.path.isdir(bigecyhmm_output_file):
+        with open(os.path.join(bigecyhmm_output_file, 'functions.tsv'), 'r') as open_functions_file:
+            all_functions = [line.rstrip('\n') for line in open_functions_file]
+    else:
+        all_functions = pd.read_csv(bigecyhmm_output_file, sep='\t', usecols=['function'])['function'].tolist()
+
+    return all_functions
+
+
 def compute_bigecyhmm_functions_occurrence(bigecyhmm_output_file, tax_id_names_observation_names=None):
     """Read pathway_presence.tsv or function_presence.tsv created by bigecyhmm to compute the occurrence of each functions/pathways.
+    It can also be the sparse folder of these files (only the non-zero values are then read).
 
     Args:
-        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv).
+        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv) or to its sparse folder.
         tax_id_names_observation_names (dict): dictionary associating tax_id_name with organism name.
 
     Returns:
         function_occurrence_organisms (dict): dictionary containing function as key and subdict with organism as key and value of function in organism.
         all_studied_organisms (list): list of all organisms in community.
     """
+    import pandas as pd
+    if os.path.isdir(bigecyhmm_output_file):
+        return compute_sparse_functions_occurrence(bigecyhmm_output_file, tax_id_names_observation_names)
+
     bigecyhmm_function_df = pd.read_csv(bigecyhmm_output_file, sep='\t')
     bigecyhmm_function_df.set_index('function', inplace=True)
 
@@ -232,70 +305,279 @@ def compute_bigecyhmm_functions_occurrence(bigecyhmm_output_file, tax_id_names_o
     return function_occurrence_organisms, all_studied_organisms
 
 
-def compute_bigecyhmm_functions_abundance(bigecyhmm_output_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names=None):
+def compute_sparse_functions_occurrence(bigecyhmm_sparse_folder, tax_id_names_observation_names=None):
+    """Same as compute_bigecyhmm_functions_occurrence but from the sparse folder of pathway_presence or function_presence.
+
+    Args:
+        bigecyhmm_sparse_folder (str): path to the sparse presence folder created by bigecyhmm.
+        tax_id_names_observation_names (dict): dictionary associating tax_id_name with organism name.
+
+    Returns:
+        function_occurrence_organisms (dict): dictionary containing function as key and subdict with organism as key and value of function in organism.
+        all_studied_organisms (list): list of all organisms in community.
+    """
+    presences, all_functions, all_studied_organisms = read_sparse_presence(bigecyhmm_sparse_folder)
+
+    if tax_id_names_observation_names is not None:
+        all_studied_organisms = list(set([observation_name for tax_id in all_studied_organisms for observation_name in tax_id_names_observation_names[tax_id]]))
+
+    function_occurrence_organisms = {}
+    for function_name in all_functions:
+        for organism in presences[function_name]:
+            # Keep the same conversion as with the tsv file (value truncated to int but kept with its type).
+            presence_value = presences[function_name][organism]
+            organism_value = type(presence_value)(int(presence_value))
+            if organism_value > 0:
+                if tax_id_names_observation_names is not None:
+                    observation_names = tax_id_names_observation_names[organism]
+                else:
+                    observation_names = [organism]
+                if function_name not in function_occurrence_organisms:
+                    function_occurrence_organisms[function_name] = {}
+                for observation_name in observation_names:
+                    if observation_name not in function_occurrence_organisms[function_name]:
+                        function_occurrence_organisms[function_name][observation_name] = organism_value
+
+    for function_name in all_functions:
+        if function_name not in function_occurrence_organisms:
+            function_occurrence_organisms[function_name] = {}
+
+    return function_occurrence_organisms, all_studied_organisms
+
+
+def create_function_abundance_matrices(function_organisms, sample_abundance):
+    """Create aligned matrices of function occurrence in organisms and of organism abundance in samples.
+
+    Args:
+        function_organisms (dict): dictionary containing function as key and subdict with organism as key and value of function in organism.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms (or matrix from read_measures_matrix).
+
+    Returns:
+        function_matrix (scipy.sparse.csr_matrix): matrix with functions as rows and organisms as columns.
+        abundance_matrix (np.ndarray): matrix with organisms as rows and samples as columns (0 for organisms without abundance).
+        all_functions (list): functions of the rows of function_matrix.
+        all_organisms (list): organisms of the columns of function_matrix and of the rows of abundance_matrix.
+        all_samples (list): samples of the columns of abundance_matrix.
+    """
+    import numpy as np
+    from scipy import sparse
+    all_functions = list(function_organisms.keys())
+    # Organisms are ordered by their first occurrence (as pandas does when creating a dataframe from function_organisms).
+    organism_indexes = {}
+    rows = []
+    columns = []
+    values = []
+    for function_index, function_name in enumerate(all_functions):
+        for organism in function_organisms[function_name]:
+            if organism not in organism_indexes:
+                organism_indexes[organism] = len(organism_indexes)
+            rows.append(function_index)
+            columns.append(organism_indexes[organism])
+            values.append(function_organisms[function_name][organism])
+    all_organisms = list(organism_indexes.keys())
+    function_matrix = sparse.csr_matrix((np.array(values, dtype=float), (rows, columns)), shape=(len(all_functions), len(all_organisms)))
+
+    if isinstance(sample_abundance, MeasureMatrix):
+        abundance_organisms = set(sample_abundance.row_names)
+    else:
+        abundance_organisms = set([organism for sample in sample_abundance for organism in sample_abundance[sample]])
+    missing_organism_abundance = list(set(all_organisms) - abundance_organisms)
+    if len(missing_organism_abundance) > 0:
+        logger.critical('ERROR: Several organisms ({0}) having predicted functions are not present in abundance file.'.format(','.join(missing_organism_abundance)))
+        sys.exit(1)
+
+    # Organisms without functional predictions are not kept, organisms with missing abundance have an abundance of 0.
+    all_samples = list(sample_abundance.keys())
+    if isinstance(sample_abundance, MeasureMatrix):
+        # Select the rows of the organisms directly in the measure matrix (keeping its dtype).
+        row_indexes = {row_name: row_index for row_index, row_name in enumerate(sample_abundance.row_names)}
+        abundance_matrix = np.nan_to_num(sample_abundance.matrix[[row_indexes[organism] for organism in all_organisms]], copy=False)
+        return function_matrix, abundance_matrix, all_functions, all_organisms, all_samples
+
+    abundance_matrix = np.zeros((len(all_organisms), len(all_samples)))
+    for sample_index, sample in enumerate(all_samples):
+        for organism in sample_abundance[sample]:
+            if organism in organism_indexes:
+                organism_abundance = sample_abundance[sample][organism]
+                if not math.isnan(organism_abundance):
+                    abundance_matrix[organism_indexes[organism], sample_index] = organism_abundance
+
+    return function_matrix, abundance_matrix, all_functions, all_organisms, all_samples
+
+
+def compute_sample_function_participation(function_matrix, abundance_matrix, sample_index):
+    """Compute the abundance of functions brought by each organism in a sample.
+    Only the organisms and the functions with at least one non-zero value are kept.
+
+    Args:
+        function_matrix (scipy.sparse.csr_matrix): matrix with functions as rows and organisms as columns.
+        abundance_matrix (np.ndarray): matrix with organisms as rows and samples as columns.
+        sample_index (int): index of the sample column in abundance_matrix.
+
+    Returns:
+        participation_matrix (np.ndarray): matrix with the kept organisms as rows and the kept functions as columns.
+        kept_organism_indexes (np.ndarray): indexes (in function_matrix columns) of the kept organisms.
+        kept_function_indexes (np.ndarray): indexes (in function_matrix rows) of the kept functions.
+    """
+    import numpy as np
+    sample_organism_indexes = np.flatnonzero(abundance_matrix[:, sample_index])
+    sample_participation = function_matrix[:, sample_organism_indexes].multiply(abundance_matrix[sample_organism_indexes, sample_index]).tocsc()
+    sample_participation.eliminate_zeros()
+
+    kept_organisms = np.flatnonzero(np.diff(sample_participation.indptr))
+    kept_function_indexes = np.unique(sample_participation.indices)
+    participation_matrix = sample_participation[kept_function_indexes][:, kept_organisms].toarray().T
+
+    return participation_matrix, sample_organism_indexes[kept_organisms], kept_function_indexes
+
+
+def write_function_participation(function_matrix, abundance_matrix, all_functions, all_organisms, all_samples, output_functions, output_folder):
+    """Write one tsv file per sample with the abundance of functions brought by each organism.
+    Samples are computed and written one after the other, so only the table of one sample is in memory.
+
+    Args:
+        function_matrix (scipy.sparse.csr_matrix): matrix with functions as rows and organisms as columns.
+        abundance_matrix (np.ndarray): matrix with organisms as rows and samples as columns.
+        all_functions (list): functions of the rows of function_matrix.
+        all_organisms (list): organisms of the columns of function_matrix.
+        all_samples (list): samples of the columns of abundance_matrix.
+        output_functions (list): functions written as columns in the output files.
+        output_folder (str): path to the output folder.
+    """
+    import pandas as pd
+    import numpy as np
+    for sample_index, sample in enumerate(all_samples):
+        participation_matrix, organism_indexes, function_indexes = compute_sample_function_participation(function_matrix, abundance_matrix, sample_index)
+        data_participation_df = pd.DataFrame(participation_matrix, index=[all_organisms[index] for index in organism_indexes],
+                                             columns=[all_functions[index] for index in function_indexes])
+        data_participation_df = data_participation_df.reindex(columns=output_functions, fill_value=0)
+        data_participation_df.index.name = 'organism'
+        data_participation_df.to_csv(os.path.join(output_folder, sample+'.tsv'), sep='\t')
+
+
+def write_long_function_participation(function_matrix, abundance_matrix, all_functions, all_organisms, all_samples, output_file):
+    """Write a single long-format tsv file (sample, organism, function, abundance) with the abundance of functions brought by each organism.
+    Only non-zero abundances are written, in one pass over the samples (only the participation of one sample is in memory).
+    For each sample, rows are sorted by organism (same order as the per-sample files) then by function.
+
+    Args:
+        function_matrix (scipy.sparse.csr_matrix): matrix with functions as rows and organisms as columns.
+        abundance_matrix (np.ndarray): matrix with organisms as rows and samples as columns.
+        all_functions (list): functions of the rows of function_matrix.
+        all_organisms (list): organisms of the columns of function_matrix.
+        all_samples (list): samples of the columns of abundance_matrix.
+        output_file (str): path to the output tsv file.
+    """
+    import numpy as np
+    function_names = np.array(all_functions, dtype=object)
+    organism_names = np.array(all_organisms, dtype=object)
+    with open(output_file, 'w') as open_output_file:
+        csvwriter = csv.writer(open_output_file, delimiter='\t', lineterminator='\n')
+        csvwriter.writerow(LONG_PARTICIPATION_COLUMNS)
+        for sample_index, sample in enumerate(all_samples):
+            sample_organism_indexes = np.flatnonzero(abundance_matrix[:, sample_index])
+            sample_participation = function_matrix[:, sample_organism_indexes].multiply(abundance_matrix[sample_organism_indexes, sample_index]).tocsc()
+            sample_participation.eliminate_zeros()
+            sample_participation.sort_indices()
+            # Column of each non-zero value (organism), in the order of the csc data.
+            value_organism_indexes = np.repeat(sample_organism_indexes, np.diff(sample_participation.indptr))
+            csvwriter.writerows(zip([sample] * sample_participation.nnz, organism_names[value_organism_indexes], function_names[sample_participation.indices],
+                                    sample_participation.data.tolist()))
+
+
+def read_long_function_participation(participation_file, sample, functions=None):
+    """Read the participation of organisms to functions for one sample from a long-format participation file.
+    It returns the same table as the per-sample participation files (organisms as rows, functions as columns).
+
+    Args:
+        participation_file (str): path to the long-format participation file (written by write_long_function_participation).
+        sample (str): name of the sample to read.
+        functions (list): functions used as columns (by default, all functions of the file sorted).
+
+    Returns:
+        data_participation_df (pd.DataFrame): abundance of functions brought by each organism in the sample.
+    """
+    import pandas as pd
+    sample_participation = {}
+    file_functions = set()
+    with open(participation_file, 'r') as open_participation_file:
+        csvreader = csv.DictReader(open_participation_file, delimiter='\t')
+        for row in csvreader:
+            file_functions.add(row['function'])
+            if row['sample'] == sample:
+                if row['organism'] not in sample_participation:
+                    sample_participation[row['organism']] = {}
+                sample_participation[row['organism']][row['function']] = float(row['abundance'])
+
+    if functions is None:
+        functions = sorted(file_functions)
+
+    data_participation_df = pd.DataFrame.from_dict(sample_participation, orient='index')
+    data_participation_df = data_participation_df.reindex(columns=functions, fill_value=0).fillna(0)
+    data_participation_df.index.name = 'organism'
+
+    return data_participation_df
+
+
+def compute_bigecyhmm_functions_abundance(bigecyhmm_output_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names=None,
+                                          participation_output_folder=None, participation_functions=None, participation_long_file=None):
     """Read pathway_presence.tsv or function_presence.tsv created by bigecyhmm to compute the occurrence of each functions/pathways.
+    Abundances are computed with matrix products between function matrix (functions x organisms) and abundance matrix (organisms x samples).
 
     Args:
-        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv).
+        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv) or to its sparse folder.
         sample_abundance (dict): for each sample, subdict with the abundance of the different organisms.
         sample_tot_abundance (dict): for each sample, the total abundance of all organisms in the sample.
         tax_id_names_observation_names (dict): dictionary associating tax_id_name with organism name.
+        participation_output_folder (str): if not None, participation of each sample is written in this folder (one tsv per sample) instead of being returned.
+        participation_functions (list): functions written as columns in participation files (by default, all functions sorted).
+        participation_long_file (str): if not None (and participation_output_folder is None), participation of all samples is written in this long-format tsv file instead of being returned.
 
     Returns:
         function_abundance_samples (dict): dictionary containing sample as dict and a subdict containing function associated with abundance
         function_relative_abundance_samples (dict): dictionary containing sample as dict and a subdict containing function associated with relative abundance
-        function_participation_samples (dict): dictionary containing sample as dict and a subdict containing organism associated with function and their abundance
+        function_participation_samples (dict): dictionary containing sample as dict and a subdict containing organism associated with function and their abundance (None if participation_output_folder or participation_long_file is used)
     """
-    bigecyhmm_function_df = pd.read_csv(bigecyhmm_output_file, sep='\t')
-    bigecyhmm_function_df.set_index('function', inplace=True)
-
-    sample_abundance_dataframe = pd.DataFrame(sample_abundance)
-
+    import pandas as pd
+    import numpy as np
     # Compute the occurrence of functions in organism from bigecyhmm file.
     function_organisms, all_studied_organisms = compute_bigecyhmm_functions_occurrence(bigecyhmm_output_file, tax_id_names_observation_names)
-    # Transpose the dataframe to get function as rows and organisms as columns.
-    function_dataframe = pd.DataFrame(function_organisms).T
-    # Replace nan by 0.
-    function_dataframe = function_dataframe.fillna(0)
-
-    missing_organism_abundance = list(set(function_dataframe.columns) - set(sample_abundance_dataframe.index))
-    if len(missing_organism_abundance) > 0:
-        logger.critical('ERROR: Several organisms ({0}) having predicted functions are not present in abundance file.'.format(','.join(missing_organism_abundance)))
-        sys.exit(1)
-    # Ensure that indexes in sample_abundance_dataframe are the same than the columns in function_dataframe.
-    # There can be more indexes in sample_abundance_dataframe if some organisms do not have functional predictions.
-    sample_abundance_dataframe = sample_abundance_dataframe.reindex(function_dataframe.columns)
-    # Replace nan by 0.
-    sample_abundance_dataframe = sample_abundance_dataframe.fillna(0)
+    function_matrix, abundance_matrix, all_functions, all_organisms, all_samples = create_function_abundance_matrices(function_organisms, sample_abundance)
 
     # Matrix multiplication between function matrix and abundance matrix.
-    abundance_function_df = function_dataframe.dot(sample_abundance_dataframe)
-
+    abundance_function_matrix = function_matrix @ abundance_matrix
     # Matrix division by the total abundance in each sample to get relative abundace
-    relative_abundance_df = abundance_function_df.div(sample_tot_abundance)
+    relative_abundance_matrix = abundance_function_matrix / np.array([sample_tot_abundance[sample] for sample in all_samples])
+
+    function_abundance_samples = pd.DataFrame(abundance_function_matrix, index=all_functions, columns=all_samples).to_dict()
+    function_relative_abundance_samples = pd.DataFrame(relative_abundance_matrix, index=all_functions, columns=all_samples).to_dict()
 
-    function_abundance_samples = abundance_function_df.to_dict()
-    function_relative_abundance_samples = relative_abundance_df.to_dict()
+    if participation_output_folder is not None:
+        if participation_functions is None:
+            participation_functions = sorted(all_functions)
+        write_function_participation(function_matrix, abundance_matrix, all_functions, all_organisms, all_samples, participation_functions, participation_output_folder)
+        return function_abundance_samples, function_relative_abundance_samples, None
+    if participation_long_file is not None:
+        write_long_function_participation(function_matrix, abundance_matrix, all_functions, all_organisms, all_samples, participation_long_file)
+        return function_abundance_samples, function_relative_abundance_samples, None
 
     # For each sample compute the abundance of function according to the organisms.
     function_participation_samples = {}
-    for sample in sample_abundance:
-        # Multiply each function by the abundance of the organism.
-        function_participation_df = function_dataframe.mul(sample_abundance_dataframe[sample])
-        # Remove row (organism) containing only zero.
-        function_participation_df = function_participation_df.loc[~(function_participation_df == 0).all(axis=1)]
-        # Remove column (function) containing only zero.
-        function_participation_df = function_participation_df[function_participation_df.columns[~(function_participation_df == 0).all(axis=0)]]
-        function_participation_samples[sample] = function_participation_df.to_dict()
+    for sample_index, sample in enumerate(all_samples):
+        participation_matrix, organism_indexes, function_indexes = compute_sample_function_participation(function_matrix, abundance_matrix, sample_index)
+        function_participation_samples[sample] = {}
+        for participation_row, organism_index in zip(participation_matrix, organism_indexes):
+            function_participation_samples[sample][all_organisms[organism_index]] = {all_functions[function_index]: participation_value
+                                                                                     for function_index, participation_value in zip(function_indexes, participation_row.tolist())}
 
     return function_abundance_samples, function_relative_abundance_samples, function_participation_samples
 
 
 def get_hmm_per_organism(bigecyhmm_output, tax_id_names_observation_names):
-    """ Get for each organism, the number of matching HMMs to their proteomes.
+    """ Get for each organism, the number of proteins matching each HMM.
 
     Args:
-        bigecyhmm_output_file (str): path to the output file of bigecyhmm (either pathway_presence.tsv or function_presence.tsv).
+        bigecyhmm_output_file (str): path to the output folder of bigecyhmm containing hmm_results.
         tax_id_names_observation_names (dict): dictionary associating tax_id_name with organism name.
 
     Returns:
@@ -313,12 +595,17 @@ def get_hmm_per_organism(bigecyhmm_output, tax_id_names_observation_names):
             observation_names = [organism_name]
 
         organism_result_file_path = os.path.join(hmm_found_folder, organism_result_file)
-        hmm_found_df = pd.read_csv(organism_result_file_path, sep='\t')
-        hmm_found_df['HMM'] = hmm_found_df['HMM'].str.replace('.hmm', '')
-        # Group the dataframe by the hmm and merged all proteins found for an HMM with a ';'.
-        hmm_founds = hmm_found_df.groupby('HMM').apply(lambda x: '; '.join(x.protein), include_groups=False).to_dict()
+        # Gather the proteins found for each HMM.
+        hmm_proteins = {}
+        with open(organism_result_file_path, 'r') as open_organism_result_file:
+            csvreader = csv.DictReader(open_organism_result_file, delimiter='\t')
+            for line in csvreader:
+                hmm_found = line['HMM'].replace('.hmm', '')
+                if hmm_found not in hmm_proteins:
+                    hmm_proteins[hmm_found] = set()
+                hmm_proteins[hmm_found].add(line['protein'])
         # Count the number of protein found for each HMM.
-        hmm_occurrence_org = {hmm: len(set(hmm_founds[hmm])) for hmm in hmm_founds}
+        hmm_occurrence_org = {hmm: len(hmm_proteins[hmm]) for hmm in hmm_proteins}
 
         for observation_name in observation_names:
             hmm_occurrences[observation_name] = hmm_occurrence_org
@@ -326,6 +613,85 @@ def get_hmm_per_organism(bigecyhmm_output, tax_id_names_observation_names):
     return hmm_occurrences
 
 
+def compute_hmm_abundances(hmm_occurrences, sample_abundance, sample_chunk_size=256):
+    """ Compute HMM abundance in each sample by multiplying an organism x HMM presence matrix with the organism x sample abundance matrix.
+    Samples are processed by chunks of sample_chunk_size columns to bound the size of the dense abundance matrix.
+
+    Args:
+        hmm_occurrences (dict): dictionary containing organism as value and a subdict containing HMM occurrence.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms (or matrix from read_measures_matrix).
+        sample_chunk_size (int): number of samples multiplied at once.
+
+    Returns:
+        hmm_abundance_df (pd.DataFrame): dataframe with HMMs as rows, samples as columns and the sum of the abundance of organisms having the HMM as values.
+    """
+    import pandas as pd
+    import numpy as np
+    from scipy import sparse
+    all_samples = list(sample_abundance.keys())
+
+    # Organisms having at least one HMM and an abundance in a sample, ordered by their first occurrence.
+    organism_indexes = {}
+    if isinstance(sample_abundance, MeasureMatrix):
+        # Rows of the organisms in the measure matrix.
+        organism_rows = {}
+        for row_index, organism in enumerate(sample_abundance.row_names):
+            if organism in hmm_occurrences:
+                if organism not in organism_indexes:
+                    organism_indexes[organism] = len(organism_indexes)
+                organism_rows[organism] = row_index
+        organism_rows = [organism_rows[organism] for organism in organism_indexes]
+    else:
+        for sample in all_samples:
+            for organism in sample_abundance[sample]:
+                if organism not in organism_indexes and organism in hmm_occurrences:
+                    organism_indexes[organism] = len(organism_indexes)
+    all_organisms = list(organism_indexes.keys())
+
+    all_hmms = sorted(set([hmm_found for organism in all_organisms for hmm_found in hmm_occurrences[organism]
+                           if hmm_occurrences[organism][hmm_found] > 0]))
+    hmm_indexes = {hmm_found: hmm_index for hmm_index, hmm_found in enumerate(all_hmms)}
+    rows = []
+    columns = []
+    for organism_index, organism in enumerate(all_organisms):
+        for hmm_found in hmm_occurrences[organism]:
+            if hmm_occurrences[organism][hmm_found] > 0:
+                rows.append(hmm_indexes[hmm_found])
+                columns.append(organism_index)
+    hmm_matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(all_hmms), len(all_organisms)))
+
+    hmm_abundance_matrix = np.zeros((len(all_hmms), len(all_samples)))
+    for chunk_start in range(0, len(all_samples), sample_chunk_size):
+        chunk_samples = all_samples[chunk_start:chunk_start+sample_chunk_size]
+        if isinstance(sample_abundance, MeasureMatrix):
+            # All organisms of the measure matrix are in all samples.
+            hmm_abundance_matrix[:, chunk_start:chunk_start+sample_chunk_size] = hmm_matrix @ sample_abundance.matrix[organism_rows, chunk_start:chunk_start+sample_chunk_size]
+            continue
+        abundance_matrix = np.zeros((len(all_organisms), len(chunk_samples)))
+        # Indicator of the organisms listed in each sample, to keep HMMs without any organism in a sample as missing values.
+        occurrence_matrix = np.zeros((len(all_organisms), len(chunk_samples)))
+        for sample_index, sample in enumerate(chunk_samples):
+            sample_organisms = [organism for organism in sample_abundance[sample] if organism in organism_indexes]
+            sample_organism_indexes = [organism_indexes[organism] for organism in sample_organisms]
+            abundance_matrix[sample_organism_indexes, sample_index] = [sample_abundance[sample][organism] for organism in sample_organisms]
+            occurrence_matrix[sample_organism_indexes, sample_index] = 1
+        chunk_abundance = hmm_matrix @ abundance_matrix
+        chunk_abundance[(hmm_matrix @ occurrence_matrix) == 0] = np.nan
+        hmm_abundance_matrix[:, chunk_start:chunk_start+sample_chunk_size] = chunk_abundance
+
+    hmm_abundance_df = pd.DataFrame(hmm_abundance_matrix, index=all_hmms, columns=all_samples)
+    # Keep integer abundances as integers (as long as there is no missing value), measure matrices only contain floats.
+    if not isinstance(sample_abundance, MeasureMatrix):
+        for sample in all_samples:
+            sample_values = sample_abundance[sample].values()
+            if len(sample_values) > 0 and all(isinstance(value, (int, np.integer)) for value in sample_values):
+                if not hmm_abundance_df[sample].isna().any():
+                    hmm_abundance_df[sample] = hmm_abundance_df[sample].astype(int)
+    hmm_abundance_df.index.name = 'function'
+
+    return hmm_abundance_df
+
+
 def create_ko_functional_profile(bigecyhmm_output, sample_abundance, output_folder_abundance, tax_id_names_observation_names):
     """ Compute HMM abundance in each sample and write it in a tsv file..
 
@@ -336,26 +702,7 @@ def create_ko_functional_profile(bigecyhmm_output, sample_abundance, output_fold
         tax_id_names_observation_names (dict): dictionary associating tax_id_name with organism name.
     """
     hmm_occurrences = get_hmm_per_organism(bigecyhmm_output, tax_id_names_observation_names)
-
-    hmm_abundance = {}
-    for sample in sample_abundance:
-        if sample not in hmm_abundance:
-            hmm_abundance[sample] = {}
-        for organism in sample_abundance[sample]:
-            if organism in hmm_occurrences:
-                for hmm_found in hmm_occurrences[organism]:
-                    # Compute the abundance of function in the sample.
-                    if hmm_found not in hmm_abundance[sample]:
-                        if hmm_occurrences[organism][hmm_found] > 0:
-                            hmm_abundance[sample][hmm_found] = 1*sample_abundance[sample][organism]
-                    else:
-                        if hmm_occurrences[organism][hmm_found] > 0:
-                            hmm_abundance[sample][hmm_found] = 1*sample_abundance[sample][organism] + hmm_abundance[sample][hmm_found]
-
-
-    hmm_abundance_df = pd.DataFrame(hmm_abundance)
-    hmm_abundance_df.index.name = 'function'
-    hmm_abundance_df.sort_index(inplace=True)
+    hmm_abundance_df = compute_hmm_abundances(hmm_occurrences, sample_abundance)
     hmm_abundance_df.to_csv(os.path.join(output_folder_abundance, 'hmm_functional_profile.tsv'), sep='\t')
 
 
@@ -367,6 +714,9 @@ def create_polar_plot(df_seaborn_abundance, output_file):
         df_seaborn_abundance (pd.DataFrame): DataFrame containing abundance of metabolic functions in samples.
         output_file (str): path to the output file.
     """
+    import pandas as pd
+    import numpy as np
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(1, 1, figsize=(10, 18), subplot_kw={'projection': 'polar'})
 
     removed_functions = ['N-S-10:Nitric oxide dismutase', 'S-S-10:Polysulfide reduction']
@@ -423,6 +773,8 @@ def generate_bubble_plot(melted_cycle_relative_abundance_samples_df, output_file
         output_file_name (str): path to the output file.
         group_file_path (str): path to group file.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
     function_in_cycle = {function_name: cycle_name for cycle_name in FUNCTION_GROUP_TEMPLATE for function_name in FUNCTION_GROUP_TEMPLATE[cycle_name]}
     function_in_cycle_set = set(function_in_cycle.keys())
 
@@ -523,6 +875,9 @@ def visualise_barplot_category(category, function_categories, df_seaborn_abundan
         df_seaborn_abundance (pd.DataFrame): dataframe pandas containing a column with the name of function, a second column with the relative abundance of organisms having it in the community and a third column for the sample
         output_file_name (str): path to the output file.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     fig, axes = plt.subplots(figsize=(40,20))
     plt.rc('font', size=30)
     if isinstance(category, str):
@@ -548,6 +903,9 @@ def create_heatmap_functions(df, output_heatmap_filepath):
         df (pd.DataFrame): dataframe pandas containing a column with the name of function, one column by sample and the abundance of function in sample as value.
         output_heatmap_filepath (str): path to the output file.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     sns.set_theme(font_scale=0.5)
     fig, axes = plt.subplots(figsize=(35,70))
     g = sns.heatmap(data=df, xticklabels=1, cmap='viridis_r', linewidths=1, linecolor='black', square=True)
@@ -565,6 +923,7 @@ def add_abundance_and_measure_to_graph(graph_file, output_folder, metabolite_mea
         metabolite_measure (str): path to metaboltie measure file.
         cycle_relative_abundance_samples_df (pd.DataFrame): DataFrame containing relative abundance of metabolic functions.
     """
+    import pandas as pd
     import networkx as nx
     pathway_graph = nx.read_graphml(graph_file)
 
@@ -607,11 +966,14 @@ def generate_barplot_esmecata_taxon_abundance(sample_abundance, observation_name
     This allows to identify the coverage of taxon found by esmecata compared to all the organisms in the sample.
 
     Args:
-        sample_abundance (dict): for each sample, subdict with the abundance of the different organisms.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms.
         observation_names_tax_ranks (dict): dictionary associating organism name with tax_id_name
         sample_tot_abundance (dict): for each sample, the total abundance of all organisms in the sample.
         output_folder_abundance (str): path to output folder containing abundance related results.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    rank_sorted = get_rank_sorted()
     data_abundance_taxon_sample, sample_abundance_tax_rank, data_abundance_organism_sample = compute_abundance_per_tax_rank(sample_abundance, 
                                                                                                                             observation_names_tax_ranks, sample_tot_abundance)
 
@@ -624,7 +986,7 @@ def generate_barplot_esmecata_taxon_abundance(sample_abundance, observation_name
 
     df_abundance_taxon_sample = pd.DataFrame(data_abundance_taxon_sample, columns=['Sample', 'Taxonomic rank selected by EsMeCaTa', 'Relative abundance'])
     # Sort the dataframe using taxonomic rank, from lowest (species, genus) to highest (kingdom).
-    df_abundance_taxon_sample.sort_values(by="Taxonomic rank selected by EsMeCaTa", key=lambda column: column.map(lambda e: RANK_SORTED.index(e)), inplace=True)
+    df_abundance_taxon_sample.sort_values(by="Taxonomic rank selected by EsMeCaTa", key=lambda column: column.map(lambda e: rank_sorted.index(e)), inplace=True)
     output_taxon_rank_abundance_plot_file = os.path.join(output_folder_abundance, 'barplot_esmecata_found_taxon_sample.png')
 
     df_abundance_taxon_sample = df_abundance_taxon_sample.set_index(['Sample', 'Taxonomic rank selected by EsMeCaTa'])['Relative abundance'].unstack().reset_index()
@@ -644,7 +1006,7 @@ def generate_barplot_esmecata_taxon_abundance(sample_abundance, observation_name
     if nb_samples > 150:
         fig_width = nb_samples / 10
     # Sort the dataframe using taxonomic rank, from lowest (species, genus) to highest (kingdom).
-    sorted_columns = [rank for rank in RANK_SORTED if rank in df_abundance_taxon_sample.columns]
+    sorted_columns = [rank for rank in rank_sorted if rank in df_abundance_taxon_sample.columns]
     df_abundance_taxon_sample = df_abundance_taxon_sample[sorted_columns]
     df_abundance_taxon_sample.plot(kind='bar', stacked=True, color=color_ranks, figsize=(fig_width, 14))
     plt.legend(loc='center left', bbox_to_anchor=(1.0, 0.5))
@@ -659,10 +1021,16 @@ def taxon_function_heatmap(df_cycle_occurrence_organisms, proteome_tax_id_file,
     Args:
         df_cycle_occurrence_organisms (pd.DataFrame): occurrence of metabolic pathways/cycle in organisms.
         proteome_tax_id_file (str): path to EsMECaTa proteome_tax_id_file.
-        sample_abundance (dict): for each sample, subdict with the abundance of the different organisms.
+        sample_abundance (dict or MeasureMatrix): for each sample, subdict with the abundance of the different organisms.
         output_folder (str): path to output folder.
     """
-    df_abundance = pd.DataFrame(sample_abundance)
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if isinstance(sample_abundance, MeasureMatrix):
+        df_abundance = pd.DataFrame(sample_abundance.matrix, index=sample_abundance.row_names, columns=sample_abundance.column_names)
+    else:
+        df_abundance = pd.DataFrame(sample_abundance)
     for col in df_abundance.columns:
         df_abundance[col] = df_abundance[col] / df_abundance[col].sum()
     nb_samples = len(df_abundance.columns)
@@ -713,6 +1081,8 @@ def generate_graph_figure(bigecyhmm_database_folder, graph_output_file):
         bigecyhmm_database_folder (str): path to bigecyhmm database output folder (containing reference graphml file).
         graph_output_file (str): path to output background image.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
     try:
         from networkx.drawing.nx_agraph import graphviz_layout
         graph_layout = "graphviz"
@@ -777,8 +1147,84 @@ def generate_graph_figure(bigecyhmm_database_folder, graph_output_file):
     plt.clf()
 
 
+def init_plot_worker():
+    """Use the non-interactive Agg backend of matplotlib in plot worker processes.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+@profile_stage('plotting')
+def run_plot_job(plot_job):
+    """Run one plotting job and close all its figures.
+    Each job runs in its own matplotlib rc context, so a style set by a job (such as a seaborn theme) is not inherited by the next jobs.
+
+    Args:
+        plot_job (tuple): plotting function, its positional arguments (tuple) and its keyword arguments (dict).
+
+    Returns:
+        plot_output: output of the plotting function.
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    plot_function, plot_args, plot_kwargs = plot_job
+    with matplotlib.rc_context():
+        plot_output = plot_function(*plot_args, **plot_kwargs)
+    plt.close('all')
+
+    return plot_output
+
+
+@profile_stage('plotting')
+def run_plot_jobs(plot_jobs, core_number=1):
+    """Run independent plotting jobs, in a process pool if more than one core is given.
+    Output file names are set when the jobs are created, so they do not depend on the order in which jobs are run.
+
+    Args:
+        plot_jobs (list): list of plotting jobs (plotting function, positional arguments, keyword arguments).
+        core_number (int): number of processes used to draw figures.
+
+    Returns:
+        plot_outputs (list): outputs of the plotting functions, in the order of plot_jobs.
+    """
+    if core_number > 1 and len(plot_jobs) > 1:
+        plot_pool = Pool(processes=min(core_number, len(plot_jobs)), initializer=init_plot_worker)
+        plot_outputs = plot_pool.map(run_plot_job, plot_jobs, chunksize=1)
+        plot_pool.close()
+        plot_pool.join()
+    else:
+        plot_outputs = [run_plot_job(plot_job) for plot_job in plot_jobs]
+
+    return plot_outputs
+
+
+def split_in_chunks(elements, chunk_number):
+    """Split a list into at most chunk_number contiguous chunks of similar sizes.
+
+    Args:
+        elements (list): list of elements to split.
+        chunk_number (int): number of chunks.
+
+    Returns:
+        chunks (list): list of chunks (list of elements).
+    """
+    chunk_number = max(1, min(chunk_number, len(elements)))
+    chunk_size, remainder = divmod(len(elements), chunk_number)
+    chunks = []
+    start = 0
+    for chunk_index in range(chunk_number):
+        end = start + chunk_size + (1 if chunk_index < remainder else 0)
+        chunks.append(elements[start:end])
+        start = end
+
+    return chunks
+
+
+@profile_stage('aggregation')
 def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder=None, abundance_file_path=None, group_file=None, metabolite_measure=None,
-                         bigecyhmm_run_database=None, background_path_donut_plot=None):
+                         bigecyhmm_run_database=None, background_path_donut_plot=None, diagram_format='png', core_number=1, participation_format='per_sample',
+                         abundance_storage='dict', group_test='kruskal', nb_permutations=9999, permutation_seed=0):
     """Create visualisation plots from esmecata, bigecyhmm output folders
 
     Args:
@@ -790,21 +1236,41 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
         metabolite_measure (str): path to metaboltie measure file indicating the abundance of metabolites in samples.
         bigecyhmm_run_database (sttr): path to bigecyhmm run internal database (only when used with bigecyhmm_custom).
         background_path_donut_plot (str): path to background figure for donut plot.
+        diagram_format (str): format of the cycle diagrams, png or svg.
+        core_number (int): number of processes used to draw figures.
+        participation_format (str): format of participation outputs, per_sample (one tsv per sample) or long (one long-format tsv with non-zero values).
+        abundance_storage (str): storage of the abundance file, dict (dictionaries), float32 (float32 matrix read by chunks) or memmap (float32 matrix in a memory-mapped file).
+        group_test (str): statistical test between groups, kruskal (Kruskal-Wallis p-values) or permutation (exact or permutation p-values of Kruskal-Wallis H statistic).
+        nb_permutations (int): maximal number of permutations with permutation group test.
+        permutation_seed (int): seed of the permutations with permutation group test.
     """
+    import pandas as pd
+    import numpy as np
     start_time = time.time()
 
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
 
+    # Independent figures are collected as plotting jobs and drawn at the end (in parallel if core_number > 1).
+    plot_jobs = []
+
     output_folder_occurrence = os.path.join(output_folder, 'function_occurrence')
     if not os.path.exists(output_folder_occurrence):
         os.mkdir(output_folder_occurrence)
 
     if abundance_file_path is not None:
-        sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
         output_folder_abundance = os.path.join(output_folder, 'function_abundance')
         if not os.path.exists(output_folder_abundance):
             os.mkdir(output_folder_abundance)
+        if abundance_storage == 'dict':
+            sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
+        else:
+            # Very large abundance files are read by chunks in a float32 matrix (possibly memory-mapped) given directly to the abundance computations.
+            if abundance_storage == 'memmap':
+                abundance_memmap_file = os.path.join(output_folder_abundance, 'abundance_matrix.npy')
+            else:
+                abundance_memmap_file = None
+            sample_abundance, sample_tot_abundance = read_measures_matrix(abundance_file_path, memmap_file=abundance_memmap_file)
     else:
         sample_abundance = None
         sample_tot_abundance = None
@@ -842,16 +1308,19 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
 
     logger.info("## Compute function occurrences and create visualisation.")
     logger.info("  -> Read bigecyhmm cycle output files.")
-    bigecyhmm_pathway_presence_file = os.path.join(bigecyhmm_output, 'pathway_presence.tsv')
+    bigecyhmm_pathway_presence_file = get_bigecyhmm_presence_input(bigecyhmm_output, 'pathway_presence')
     cycle_occurrence_organisms, all_studied_organisms = compute_bigecyhmm_functions_occurrence(bigecyhmm_pathway_presence_file, tax_id_names_observation_names)
 
     if abundance_file_path is not None:
-        if abundance_file_path.endswith('.tsv'):
-            delimiter = '\t'
-        elif abundance_file_path.endswith('.csv'):
-            delimiter = ','
-        abundance_data_df = pd.read_csv(abundance_file_path, sep=delimiter)
-        all_studied_organisms = abundance_data_df.index.tolist()
+        if isinstance(sample_abundance, MeasureMatrix):
+            all_studied_organisms = sample_abundance.row_names
+        else:
+            if abundance_file_path.endswith('.tsv'):
+                delimiter = '\t'
+            elif abundance_file_path.endswith('.csv'):
+                delimiter = ','
+            abundance_data_df = pd.read_csv(abundance_file_path, sep=delimiter)
+            all_studied_organisms = abundance_data_df.index.tolist()
 
     df_cycle_occurrence_organisms = pd.DataFrame(cycle_occurrence_organisms)
     df_cycle_occurrence_organisms.index.name = 'function'
@@ -869,7 +1338,7 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
     cycle_occurrence_community_df.to_csv(os.path.join(output_folder_occurrence, 'cycle_occurrence.tsv'), sep='\t')
     cycle_occurrences = cycle_occurrence_community_df['ratio'].to_dict()
 
-    all_cycles = pd.read_csv(bigecyhmm_pathway_presence_file, sep='\t')['function'].tolist()
+    all_cycles = get_bigecyhmm_presence_functions(bigecyhmm_pathway_presence_file)
     all_bigecyhmm_template_cycles = pd.read_csv(PATHWAY_TEMPLATE_FILE, sep='\t')['Pathways'].tolist()
 
     custom_central_hydrogen_template_df = pd.read_csv(CUSTOM_HYDROGEN_TABLE, sep='\t')
@@ -877,7 +1346,7 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
     all_custom_central_hydrogen_template_cycles = custom_central_hydrogen_template_df['ID'].tolist()
 
     if set(all_bigecyhmm_template_cycles).issubset(set(all_cycles)):
-        logger.info("  -> Create diagrams.")
+        logger.info("  -> Compute diagram data.")
         diagram_data = {}
         for cycle_name in all_cycles:
             if cycle_name in cycle_occurrences:
@@ -885,20 +1354,11 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
             else:
                 diagram_data[cycle_name] = (0, 0)
 
-        carbon_cycle_file = os.path.join(output_folder_occurrence, 'diagram_carbon_cycle.png')
-        create_carbon_cycle(diagram_data, carbon_cycle_file, 'Occurrence', 'Percentage')
-
-        nitrogen_cycle_file = os.path.join(output_folder_occurrence, 'diagram_nitrogen_cycle.png')
-        create_nitrogen_cycle(diagram_data, nitrogen_cycle_file, 'Occurrence', 'Percentage')
-
-        sulfur_cycle_file = os.path.join(output_folder_occurrence, 'diagram_sulfur_cycle.png')
-        create_sulfur_cycle(diagram_data, sulfur_cycle_file, 'Occurrence', 'Percentage')
-
-        other_cycle_file = os.path.join(output_folder_occurrence, 'diagram_other_cycle.png')
-        create_other_cycle(diagram_data, other_cycle_file, 'Occurrence', 'Percentage')
+        plot_jobs.append((create_cycle_diagrams, ({'community': diagram_data}, output_folder_occurrence, ['carbon_cycle', 'nitrogen_cycle', 'sulfur_cycle', 'other_cycle'],
+                          'Occurrence', 'Percentage'), {'filename_pattern': 'diagram_{cycle}', 'output_format': diagram_format}))
 
     logger.info("  -> Read bigecyhmm functions output files.")
-    bigecyhmm_function_presence_file = os.path.join(bigecyhmm_output, 'function_presence.tsv')
+    bigecyhmm_function_presence_file = get_bigecyhmm_presence_input(bigecyhmm_output, 'function_presence')
     function_occurrence_organisms, all_studied_organisms = compute_bigecyhmm_functions_occurrence(bigecyhmm_function_presence_file, tax_id_names_observation_names)
 
     df_function_occurrence_organisms = pd.DataFrame(function_occurrence_organisms)
@@ -916,28 +1376,35 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
     function_occurrence_community_df.set_index('name', inplace=True)
     function_occurrence_community_df.to_csv(os.path.join(output_folder_occurrence, 'function_occurrence.tsv'), sep='\t')
 
-    logger.info("  -> Create heatmap.")
     output_heatmap_filepath = os.path.join(output_folder_occurrence, 'heatmap_occurrence.png')
-    create_heatmap_functions(function_occurrence_community_df, output_heatmap_filepath)
+    plot_jobs.append((create_heatmap_functions, (function_occurrence_community_df, output_heatmap_filepath), {}))
 
     if abundance_file_path is not None:
         logger.info("## Compute function abundances and create visualisation.")
-        logger.info("  -> Read abundance file.")
-        sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
-        output_folder_abundance = os.path.join(output_folder, 'function_abundance')
-        if not os.path.exists(output_folder_abundance):
-            os.mkdir(output_folder_abundance)
 
         if observation_names_tax_ranks is not None:
-            generate_barplot_esmecata_taxon_abundance(sample_abundance, observation_names_tax_ranks, sample_tot_abundance, output_folder_abundance)
+            plot_jobs.append((generate_barplot_esmecata_taxon_abundance, (sample_abundance, observation_names_tax_ranks, sample_tot_abundance, output_folder_abundance), {}))
             specific_function_folder = os.path.join(output_folder_abundance, 'cycle_taxa_abundance')
             if not os.path.exists(specific_function_folder):
                 os.mkdir(specific_function_folder)
-            taxon_function_heatmap(df_cycle_occurrence_organisms, proteome_tax_id_file, sample_abundance, specific_function_folder)
+            # One heatmap is drawn per cycle, split the cycles between the plotting jobs.
+            for chunk_cycles in split_in_chunks(df_cycle_occurrence_organisms.columns.tolist(), core_number):
+                plot_jobs.append((taxon_function_heatmap, (df_cycle_occurrence_organisms[chunk_cycles], proteome_tax_id_file, sample_abundance, specific_function_folder), {}))
 
         logger.info("  -> Read bigecyhmm cycle output files.")
-        bigecyhmm_pathway_presence_file = os.path.join(bigecyhmm_output, 'pathway_presence.tsv')
-        cycle_abundance_samples, cycle_relative_abundance_samples, cycle_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_pathway_presence_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names)
+        bigecyhmm_pathway_presence_file = get_bigecyhmm_presence_input(bigecyhmm_output, 'pathway_presence')
+        if participation_format == 'long':
+            output_folder_cycle_participation = None
+            cycle_participation_long_file = os.path.join(output_folder_abundance, 'cycle_participation.tsv')
+        else:
+            output_folder_cycle_participation = os.path.join(output_folder_abundance, 'cycle_participation')
+            if not os.path.exists(output_folder_cycle_participation):
+                os.mkdir(output_folder_cycle_participation)
+            cycle_participation_long_file = None
+        logger.info("  -> Compute function abundance participation in each sample.")
+        cycle_abundance_samples, cycle_relative_abundance_samples, _ = compute_bigecyhmm_functions_abundance(bigecyhmm_pathway_presence_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names,
+                                                                                                               participation_output_folder=output_folder_cycle_participation, participation_functions=all_cycles,
+                                                                                                               participation_long_file=cycle_participation_long_file)
 
         cycle_raw_abundance_samples_df = pd.DataFrame(cycle_abundance_samples)
         cycle_raw_abundance_samples_df.index.name = 'name'
@@ -952,22 +1419,6 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
             cycle_relative_abundance_samples_df = cycle_relative_abundance_samples_df.reindex(all_custom_central_hydrogen_template_cycles)
         cycle_relative_abundance_samples_df.to_csv(cycle_abundance_sample_filepath, sep='\t')
 
-        logger.info("  -> Compute function abundance participation in each sample.")
-        output_folder_cycle_participation = os.path.join(output_folder_abundance, 'cycle_participation')
-        if not os.path.exists(output_folder_cycle_participation):
-            os.mkdir(output_folder_cycle_participation)
-
-        for sample in cycle_participation_samples:
-            data_cycle_participation = []
-            index_organism_names = []
-            for organism in cycle_participation_samples[sample]:
-                data_cycle_participation.append([*[cycle_participation_samples[sample][organism][function_name] if function_name in cycle_participation_samples[sample][organism] else 0 for function_name in all_cycles]])
-                index_organism_names.append(organism)
-            data_cycle_participation_df = pd.DataFrame(data_cycle_participation, index=index_organism_names, columns=all_cycles)
-            data_cycle_participation_df.index.name = 'organism'
-            data_cycle_participation_df.to_csv(os.path.join(output_folder_cycle_participation, sample+'.tsv'), sep='\t')
-
-        logger.info("  -> Create polarplot.")
         cycle_relative_abundance_samples_df.reset_index(inplace=True)
         melted_cycle_relative_abundance_samples_df = pd.melt(cycle_relative_abundance_samples_df, id_vars='name', value_vars=cycle_relative_abundance_samples_df.columns.tolist())
         melted_cycle_relative_abundance_samples_df.columns = ['name', 'sample', 'ratio']
@@ -979,14 +1430,14 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
         for sample in melted_cycle_relative_abundance_samples_df['sample'].unique():
             output_polar_plot = os.path.join(output_folder_polar_plot, 'polar_plot_abundance_sample_'+sample+'.png')
             sample_melted_cycle_relative_abundance_samples_df = melted_cycle_relative_abundance_samples_df[melted_cycle_relative_abundance_samples_df['sample']==sample]
-            create_polar_plot(sample_melted_cycle_relative_abundance_samples_df, output_polar_plot)
+            plot_jobs.append((create_polar_plot, (sample_melted_cycle_relative_abundance_samples_df, output_polar_plot), {}))
 
-        logger.info("  -> Create diagrams.")
         output_folder_cycle_diagram = os.path.join(output_folder_abundance, 'cycle_diagrams_abundance')
         if not os.path.exists(output_folder_cycle_diagram):
             os.mkdir(output_folder_cycle_diagram)
 
         if set(all_bigecyhmm_template_cycles).issubset(set(all_cycles)):
+            samples_diagram_data = {}
             for sample in cycle_relative_abundance_samples:
                 diagram_data = {}
                 for cycle_name in all_cycles:
@@ -994,22 +1445,14 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
                         diagram_data[cycle_name] = (round(cycle_abundance_samples[sample][cycle_name], 1), round(cycle_relative_abundance_samples[sample][cycle_name]*100, 1))
                     else:
                         diagram_data[cycle_name] = (0, 0)
-
-                carbon_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_carbon_cycle.png')
-                create_carbon_cycle(diagram_data, carbon_cycle_file, 'Abundance', 'Percentage')
-
-                nitrogen_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_nitrogen_cycle.png')
-                create_nitrogen_cycle(diagram_data, nitrogen_cycle_file, 'Abundance', 'Percentage')
-
-                sulfur_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_sulfur_cycle.png')
-                create_sulfur_cycle(diagram_data, sulfur_cycle_file, 'Abundance', 'Percentage')
-
-                other_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_other_cycle.png')
-                create_other_cycle(diagram_data, other_cycle_file, 'Abundance', 'Percentage')
-
-                phosphorus_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_phosphorus_cycle.png')
-                create_phosphorus_cycle(diagram_data, phosphorus_cycle_file, 'Abundance', 'Percentage')
-
+                samples_diagram_data[sample] = diagram_data
+            # Diagram templates are loaded once per job, so samples are split in as many jobs as cores.
+            for chunk_samples in split_in_chunks(list(samples_diagram_data.keys()), core_number):
+                chunk_samples_diagram_data = {sample: samples_diagram_data[sample] for sample in chunk_samples}
+                plot_jobs.append((create_cycle_diagrams, (chunk_samples_diagram_data, output_folder_cycle_diagram, DIAGRAM_CYCLES, 'Abundance', 'Percentage'),
+                                  {'output_format': diagram_format}))
+
+        from bigecyhmm.group_analysis import statNut_run
         if background_path_donut_plot is None and set(all_bigecyhmm_template_cycles).issubset(set(all_cycles)):
             background_path_donut_plot = TEMPLATE_BACKGROUND_BIGECYHMM
         if background_path_donut_plot is None and set(all_custom_central_hydrogen_template_cycles).issubset(set(all_cycles)):
@@ -1023,7 +1466,8 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
             group_medians_donut_file = os.path.join(output_folder_plots, 'group_medians_donut.png')
             group_stats_table_file = os.path.join(output_folder_plots, 'group_stats_table.png')
             statNut_run(input_tsv=cycle_abundance_sample_filepath, sample_groups_tsv=group_file, background_path=background_path_donut_plot,
-                        output_stats_csv=group_stats_file, output_cleaned_csv=cleaned_data_file, output_donut_png=group_medians_donut_file, output_table_png=group_stats_table_file)
+                        output_stats_csv=group_stats_file, output_cleaned_csv=cleaned_data_file, output_donut_png=group_medians_donut_file, output_table_png=group_stats_table_file,
+                        stat_test=group_test, nb_permutations=nb_permutations, seed=permutation_seed, core_number=core_number)
             """Function to: 
             - resolve sample groups based on an input-tsv 
             - calculate stats on groups (kruskal-wallis with Benjamini-hochberg correction) 
@@ -1046,14 +1490,26 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
             group_medians_donut_file = os.path.join(output_folder_graph_plots, 'group_medians_donut.png')
             group_stats_table_file = os.path.join(output_folder_graph_plots, 'group_stats_table.png')
             statNut_run(input_tsv=cycle_abundance_sample_filepath, sample_groups_tsv=group_file, background_path=background_graph_output_file,
-                        output_stats_csv=group_stats_file, output_cleaned_csv=cleaned_data_file, output_donut_png=group_medians_donut_file, output_table_png=group_stats_table_file)
+                        output_stats_csv=group_stats_file, output_cleaned_csv=cleaned_data_file, output_donut_png=group_medians_donut_file, output_table_png=group_stats_table_file,
+                        stat_test=group_test, nb_permutations=nb_permutations, seed=permutation_seed, core_number=core_number)
 
         bubble_plot_output_file = os.path.join(output_folder_abundance, 'cycle_pathways_bubble_plot.png')
-        generate_bubble_plot(melted_cycle_relative_abundance_samples_df, bubble_plot_output_file, group_file)
+        plot_jobs.append((generate_bubble_plot, (melted_cycle_relative_abundance_samples_df, bubble_plot_output_file, group_file), {}))
 
         logger.info("  -> Read bigecyhmm function output files.")
-        bigecyhmm_function_presence_file = os.path.join(bigecyhmm_output, 'function_presence.tsv')
-        function_abundance_samples, function_relative_abundance_samples, function_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_function_presence_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names)
+        bigecyhmm_function_presence_file = get_bigecyhmm_presence_input(bigecyhmm_output, 'function_presence')
+        if participation_format == 'long':
+            output_folder_function_participation = None
+            function_participation_long_file = os.path.join(output_folder_abundance, 'function_participation.tsv')
+        else:
+            output_folder_function_participation = os.path.join(output_folder_abundance, 'function_participation')
+            if not os.path.exists(output_folder_function_participation):
+                os.mkdir(output_folder_function_participation)
+            function_participation_long_file = None
+        logger.info("  -> Compute function abundance participation in each sample.")
+        function_abundance_samples, function_relative_abundance_samples, _ = compute_bigecyhmm_functions_abundance(bigecyhmm_function_presence_file, sample_abundance, sample_tot_abundance, tax_id_names_observation_names,
+                                                                                                                     participation_output_folder=output_folder_function_participation,
+                                                                                                                     participation_long_file=function_participation_long_file)
 
         function_relative_abundance_samples_df = pd.DataFrame(function_relative_abundance_samples)
         function_relative_abundance_samples_df.index.name = 'name'
@@ -1065,31 +1521,14 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
         function_absolute_abundance_samples_df.sort_index(inplace=True)
         function_absolute_abundance_samples_df.to_csv(os.path.join(output_folder_abundance, 'function_abundance_sample_raw.tsv'), sep='\t')
 
-        logger.info("  -> Compute function abundance participation in each sample.")
-        output_folder_function_participation = os.path.join(output_folder_abundance, 'function_participation')
-        if not os.path.exists(output_folder_function_participation):
-            os.mkdir(output_folder_function_participation)
-
-        all_functions = function_relative_abundance_samples_df.index.tolist()
-
-        for sample in function_participation_samples:
-            data_function_participation = []
-            index_organism_names = []
-            for organism in function_participation_samples[sample]:
-                data_function_participation.append([*[function_participation_samples[sample][organism][function_name] if function_name in function_participation_samples[sample][organism] else 0 for function_name in all_functions]])
-                index_organism_names.append(organism)
-            data_function_participation_df = pd.DataFrame(data_function_participation, index=index_organism_names, columns=all_functions)
-            data_function_participation_df.index.name = 'organism'
-            data_function_participation_df.to_csv(os.path.join(output_folder_function_participation, sample+'.tsv'), sep='\t')
-
-        logger.info("  -> Create heatmap.")
         output_heatmap_filepath = os.path.join(output_folder_abundance, 'heatmap_abundance_samples.png')
         function_relative_abundance_samples_df = function_relative_abundance_samples_df.replace(0, np.nan)
-        create_heatmap_functions(function_relative_abundance_samples_df, output_heatmap_filepath)
+        plot_jobs.append((create_heatmap_functions, (function_relative_abundance_samples_df, output_heatmap_filepath), {}))
         output_heatmap_filepath = os.path.join(output_folder_abundance, 'heatmap_abundance_samples.svg')
-        create_heatmap_functions(function_relative_abundance_samples_df, output_heatmap_filepath)
+        plot_jobs.append((create_heatmap_functions, (function_relative_abundance_samples_df, output_heatmap_filepath), {}))
 
-        function_relative_abundance_samples_df.reset_index(inplace=True)
+        # Not in place, as the dataframe is used by the heatmap plotting jobs.
+        function_relative_abundance_samples_df = function_relative_abundance_samples_df.reset_index()
         melted_function_relative_abundance_samples_df = pd.melt(function_relative_abundance_samples_df, id_vars='name', value_vars=function_relative_abundance_samples_df.columns.tolist())
         melted_function_relative_abundance_samples_df.columns = ['name', 'sample', 'ratio']
 
@@ -1103,6 +1542,9 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
         logger.info("  -> Create HMM functional profiles.")
         create_ko_functional_profile(bigecyhmm_output, sample_abundance, output_folder_abundance, tax_id_names_observation_names)
 
+    logger.info("## Create {0} figures (heatmaps, diagrams, polar plots, bubble plot) with {1} process(es).".format(len(plot_jobs), core_number))
+    run_plot_jobs(plot_jobs, core_number)
+
     # If there is a graph in bigecyhmm folder, run graph analyses.
     graph_file = os.path.join(bigecyhmm_output, 'input_graph.graphml')
     if os.path.exists(graph_file):
@@ -1116,12 +1558,12 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
     metadata_json['tool_dependencies']['python_package'] = {}
     metadata_json['tool_dependencies']['python_package']['Python_version'] = sys.version
     metadata_json['tool_dependencies']['python_package']['bigecyhmm'] = bigecyhmm_version
-    metadata_json['tool_dependencies']['python_package']['pandas'] = pandas_version
-    metadata_json['tool_dependencies']['python_package']['matplotlib'] = matplotlib_version
-    metadata_json['tool_dependencies']['python_package']['seaborn'] = seaborn_version
+    metadata_json['tool_dependencies']['python_package']['pandas'] = package_version('pandas')
+    metadata_json['tool_dependencies']['python_package']['matplotlib'] = package_version('matplotlib')
+    metadata_json['tool_dependencies']['python_package']['seaborn'] = package_version('seaborn')
 
     metadata_json['input_parameters'] = {'esmecata_output_folder': esmecata_output_folder, 'bigecyhmm_output': bigecyhmm_output, 'output_folder': output_folder,
-                                         'abundance_file_path': abundance_file_path}
+                                         'abundance_file_path': abundance_file_path, 'core_number': core_number, 'participation_format': participation_format}
     metadata_json['duration'] = duration
 
     metadata_file = os.path.join(output_folder, 'bigecyhmm_visualisation_metadata.json')
@@ -1129,71 +1571,67 @@ def create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder
         json.dump(metadata_json, ouput_file, indent=4)
 
 
-def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_file=None):
+def compute_ko_pathway_abundances(df_ko_abundance, pathway_hmms, pathway_expression, sorted_pathways):
+    """Compute the abundance of pathways in samples from the abundance of KEGG Orthologs (KO).
+    A pathway is present in a sample if its boolean expression is true with the KOs having a positive abundance in this sample.
+    The abundance of a present pathway is the maximal abundance of the KOs of its expression (except the ones negated by "not").
+    Each pathway expression is compiled once and evaluated on all samples at once with the KO x sample matrix.
+
+    Args:
+        df_ko_abundance (pd.DataFrame): abundance of KOs (rows, without .hmm extension) in samples (columns).
+        pathway_hmms (dict): dictionary with functions as key and list of HMMS as value
+        pathway_expression (dict): for each pathway boolean expression associated with pathway
+        sorted_pathways (list): ordered list of functions
+
+    Returns:
+        sample_pathway_df (pd.DataFrame): abundance of pathways (rows) in samples (columns).
+    """
+    import pandas as pd
+    import numpy as np
+    ko_abundance_matrix = df_ko_abundance.to_numpy()
+    nb_samples = ko_abundance_matrix.shape[1]
+    ko_indexes = {ko + '.hmm': ko_index for ko_index, ko in enumerate(df_ko_abundance.index)}
+
+    pathway_abundance_matrix = np.zeros((len(sorted_pathways), nb_samples), dtype=ko_abundance_matrix.dtype)
+    for pathway_index, pathway in enumerate(sorted_pathways):
+        compiled_expression, positive_hmms = compile_pathway_expression(pathway_expression[pathway], pathway_hmms[pathway])
+        # Presence of the HMMs of the pathway in samples, HMMs missing from the KO table are absent from all samples.
+        hmm_presence = np.zeros((len(pathway_hmms[pathway]), nb_samples), dtype=bool)
+        for hmm_index, hmm in enumerate(pathway_hmms[pathway]):
+            if hmm in ko_indexes:
+                hmm_presence[hmm_index] = ko_abundance_matrix[ko_indexes[hmm]] > 0
+        pathway_presence = evaluate_pathway_expression(compiled_expression, hmm_presence)
+
+        positive_ko_indexes = [ko_indexes[hmm] for hmm in positive_hmms if hmm in ko_indexes]
+        if len(positive_ko_indexes) > 0:
+            pathway_abundance = np.fmax(np.fmax.reduce(ko_abundance_matrix[positive_ko_indexes], axis=0), 0)
+            pathway_abundance_matrix[pathway_index] = np.where(pathway_presence, pathway_abundance, 0)
+
+    sample_pathway_df = pd.DataFrame(pathway_abundance_matrix, index=sorted_pathways, columns=df_ko_abundance.columns)
+    # Keep the type of each sample column of the KO table (int or float).
+    sample_pathway_df = sample_pathway_df.astype(df_ko_abundance.dtypes.to_dict())
+
+    return sample_pathway_df
+
+
+@profile_stage('aggregation')
+def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_file=None, diagram_format='png', core_number=1):
     """Create visualisation plots from abundance file with KEGG Orthologs.
 
     Args:
         ko_abundance_file (str): path to ko abundance file.
         output_folder (str): path to the output folder where files will be created.
+        diagram_format (str): format of the cycle diagrams, png or svg.
+        core_number (int): number of processes used to draw diagrams.
     """
+    import pandas as pd
     start_time = time.time()
 
     pathway_hmms, pathway_expression, sorted_pathways = get_diagram_pathways_hmms(PATHWAY_TEMPLATE_FILE)
     df_ko_abundance = pd.read_csv(ko_abundance_file, sep='\t', index_col=0)
-    kegg_ortholog_abundance_samples = df_ko_abundance.to_dict()
-
-    all_kos = df_ko_abundance.index.tolist()
-
-    sample_data_pathway = {}
-    for sample in kegg_ortholog_abundance_samples:
-        ko_sample_list = [ko+'.hmm' for ko in kegg_ortholog_abundance_samples[sample] if  kegg_ortholog_abundance_samples[sample][ko] > 0]
-        for pathway in sorted_pathways:
-            pathway_checks = []
-            hmms_in_org = []
-            # For AND group of HMMs in pathway, check if their corresponding HMMs are there.
-            pathway_functions = []
-            for hmm_combination in pathway_hmms[pathway]:
-                pathway_check = False
-                negative_hmms = [hmm.replace('NO|', '') for hmm in hmm_combination if 'NO' in hmm]
-                # Check if there are negative HMMs in pathway string.
-                if len(negative_hmms) > 0:
-                    hmm_combination = [hmm.replace('NO|', '') for hmm in hmm_combination]
-                intersection_hmms = set(hmm_combination).intersection(ko_sample_list)
-                intersection_negative_hmms = set(negative_hmms).intersection(ko_sample_list)
-
-                # First check if all combination corresponds to negative HMMs.
-                if len(hmm_combination) == len(negative_hmms):
-                    # If all HMMs of the combination are negative ones and are not present in organism, then this combination is checked.
-                    if len(intersection_hmms) == 0:
-                        pathway_check = True
-                else:
-                    # If all HMMs of the combination present in the organism are not negative HMMs, then this combination of HMMs is checked.
-                    if len(intersection_hmms) > 0:
-                        if len(intersection_negative_hmms) == 0:
-                            pathway_check = True
-                        # But if there are at least one negative HMMs, it is not checked.
-                        elif len(intersection_negative_hmms) > 0:
-                            pathway_check = False
-                pathway_checks.append(pathway_check)
-                positive_hmms = list(set(intersection_hmms) - set(intersection_negative_hmms))
-                found_hmms = list(positive_hmms + ['NO|' + hmm for hmm in intersection_negative_hmms])
-                if len(found_hmms) > 0:
-                    hmms_in_org.append(', '.join(found_hmms))
-                    pathway_functions.extend([kegg_ortholog_abundance_samples[sample][ko.replace('.hmm', '')] for ko in found_hmms if kegg_ortholog_abundance_samples[sample][ko.replace('.hmm', '')] > 0])
-
-            # If all combination HMMs have been checked, keep the pathway.
-            if all(pathway_checks) is True:
-                if sample not in sample_data_pathway:
-                    sample_data_pathway[sample] = {}
-                func_abundance = max(pathway_functions)
-                sample_data_pathway[sample][pathway] = func_abundance
 
-            else:
-                if sample not in sample_data_pathway:
-                    sample_data_pathway[sample] = {}
-                sample_data_pathway[sample][pathway] = 0
-
-    sample_pathway_df = pd.DataFrame(sample_data_pathway)
+    sample_pathway_df = compute_ko_pathway_abundances(df_ko_abundance, pathway_hmms, pathway_expression, sorted_pathways)
+    sample_data_pathway = sample_pathway_df.to_dict()
     output_folder_cycle_tsv = os.path.join(output_folder, 'pathway_presence_abundance.tsv')
     sample_pathway_df.index.name = 'pathway'
     sample_pathway_df.to_csv(output_folder_cycle_tsv, sep='\t')
@@ -1202,6 +1640,7 @@ def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_fi
     if not os.path.exists(output_folder_cycle_diagram):
         os.mkdir(output_folder_cycle_diagram)
 
+    samples_diagram_data = {}
     for sample in sample_data_pathway:
         diagram_data = {}
         for cycle_name in sample_data_pathway[sample]:
@@ -1209,21 +1648,12 @@ def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_fi
                 diagram_data[cycle_name] = (round(sample_data_pathway[sample][cycle_name], 1), 0)
             else:
                 diagram_data[cycle_name] = (0, 0)
-
-        carbon_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_carbon_cycle.png')
-        create_carbon_cycle(diagram_data, carbon_cycle_file)
-
-        nitrogen_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_nitrogen_cycle.png')
-        create_nitrogen_cycle(diagram_data, nitrogen_cycle_file)
-
-        sulfur_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_sulfur_cycle.png')
-        create_sulfur_cycle(diagram_data, sulfur_cycle_file)
-
-        other_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_other_cycle.png')
-        create_other_cycle(diagram_data, other_cycle_file)
-
-        phosphorus_cycle_file = os.path.join(output_folder_cycle_diagram, sample + '_phosphorus_cycle.png')
-        create_phosphorus_cycle(diagram_data, phosphorus_cycle_file)
+        samples_diagram_data[sample] = diagram_data
+    plot_jobs = []
+    for chunk_samples in split_in_chunks(list(samples_diagram_data.keys()), core_number):
+        chunk_samples_diagram_data = {sample: samples_diagram_data[sample] for sample in chunk_samples}
+        plot_jobs.append((create_cycle_diagrams, (chunk_samples_diagram_data, output_folder_cycle_diagram, DIAGRAM_CYCLES), {'output_format': diagram_format}))
+    run_plot_jobs(plot_jobs, core_number)
 
     duration = time.time() - start_time
     metadata_json = {}
@@ -1231,11 +1661,11 @@ def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_fi
     metadata_json['tool_dependencies']['python_package'] = {}
     metadata_json['tool_dependencies']['python_package']['Python_version'] = sys.version
     metadata_json['tool_dependencies']['python_package']['bigecyhmm'] = bigecyhmm_version
-    metadata_json['tool_dependencies']['python_package']['pandas'] = pandas_version
-    metadata_json['tool_dependencies']['python_package']['matplotlib'] = matplotlib_version
-    metadata_json['tool_dependencies']['python_package']['seaborn'] = seaborn_version
+    metadata_json['tool_dependencies']['python_package']['pandas'] = package_version('pandas')
+    metadata_json['tool_dependencies']['python_package']['matplotlib'] = package_version('matplotlib')
+    metadata_json['tool_dependencies']['python_package']['seaborn'] = package_version('seaborn')
 
-    metadata_json['input_parameters'] = {'ko_abundance_file': ko_abundance_file, 'output_folder': output_folder}
+    metadata_json['input_parameters'] = {'ko_abundance_file': ko_abundance_file, 'output_folder': output_folder, 'core_number': core_number}
     metadata_json['duration'] = duration
 
     metadata_file = os.path.join(output_folder, 'bigecyhmm_visualisation_metadata.json')
@@ -1246,7 +1676,9 @@ def create_visualisation_from_ko_file(ko_abundance_file, output_folder, group_fi
 
 
 def visualisation_input_handler(bigecyhmm_output, output_folder, esmecata_output_folder=None, abundance_file_path=None,
-                                group_file=None, metabolite_measure=None, background_path_donut_plot=None):
+                                group_file=None, metabolite_measure=None, background_path_donut_plot=None, diagram_format='png', core_number=1,
+                                participation_format='per_sample', abundance_storage='dict', group_test='kruskal', nb_permutations=9999,
+                                permutation_seed=0):
     """Create visualisation plots from esmecata, bigecyhmm output folders
 
     Args:
@@ -1257,6 +1689,13 @@ def visualisation_input_handler(bigecyhmm_output, output_folder, esmecata_output
         group_file_path (str): path to group file.
         metabolite_measure (str): path to metaboltie measure file indicating the abundance of metabolites in samples.
         background_path_donut_plot (str): path to background figure for donut plot.
+        diagram_format (str): format of the cycle diagrams, png or svg.
+        core_number (int): number of processes used to draw figures.
+        participation_format (str): format of participation outputs, per_sample (one tsv per sample) or long (one long-format tsv with non-zero values).
+        abundance_storage (str): storage of the abundance file, dict (dictionaries), float32 (float32 matrix read by chunks) or memmap (float32 matrix in a memory-mapped file).
+        group_test (str): statistical test between groups, kruskal (Kruskal-Wallis p-values) or permutation (exact or permutation p-values of Kruskal-Wallis H statistic).
+        nb_permutations (int): maximal number of permutations with permutation group test.
+        permutation_seed (int): seed of the permutations with permutation group test.
     """
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
@@ -1265,10 +1704,12 @@ def visualisation_input_handler(bigecyhmm_output, output_folder, esmecata_output
     # Output files are directly in input folder, run bigecyhmm visualisation on it.
     if os.path.exists(bigecyhmm_pathway_presence_file):
         logger.info("|bigecyhmm|visualisation| Launch analyses on {0}.".format(bigecyhmm_output))
-        create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder, abundance_file_path, group_file, metabolite_measure)
+        create_visualisation(bigecyhmm_output, output_folder, esmecata_output_folder, abundance_file_path, group_file, metabolite_measure,
+                             diagram_format=diagram_format, core_number=core_number, participation_format=participation_format,
+                             abundance_storage=abundance_storage, group_test=group_test, nb_permutations=nb_permutations,
+                             permutation_seed=permutation_seed)
     # If there is no such files but if there are subfolders, check if bigecyhmm output files are not in subfolders. 
     else:
-        bigecyhmm_run_internal_database_path = os.path.join(bigecyhmm_output, 'database')
         for bigecyhmm_input_folder in os.listdir(bigecyhmm_output):
             bigecyhmm_input_folder_path = os.path.join(bigecyhmm_output, bigecyhmm_input_folder)
             bigecyhmm_pathway_presence_file = os.path.join(bigecyhmm_input_folder_path, 'pathway_presence.tsv')
@@ -1276,10 +1717,15 @@ def visualisation_input_handler(bigecyhmm_output, output_folder, esmecata_output
                 # If yes, then run each time bigecyhmm visualisation on these different subfolders.
                 logger.info("|bigecyhmm|visualisation| Found one subfolder {0} from {1}, launch analysis on it.".format(bigecyhmm_input_folder_path, bigecyhmm_output))
                 subfolder_output_folder = os.path.join(output_folder, bigecyhmm_input_folder)
+                # bigecyhmm_custom writes database files in the subfolder of each custom database (in the output folder for older versions).
+                bigecyhmm_run_internal_database_path = os.path.join(bigecyhmm_input_folder_path, 'database')
+                if os.path.exists(bigecyhmm_run_internal_database_path) is False:
+                    bigecyhmm_run_internal_database_path = os.path.join(bigecyhmm_output, 'database')
                 if os.path.exists(bigecyhmm_run_internal_database_path) is False:
                     bigecyhmm_run_internal_database_path = None
                 create_visualisation(bigecyhmm_input_folder_path, subfolder_output_folder, esmecata_output_folder, abundance_file_path, group_file, metabolite_measure,
-                                     bigecyhmm_run_internal_database_path, background_path_donut_plot)
+                                     bigecyhmm_run_internal_database_path, background_path_donut_plot, diagram_format, core_number, participation_format,
+                                     abundance_storage, group_test, nb_permutations, permutation_seed)
 
 
 def main():
@@ -1361,6 +1807,75 @@ def main():
         help='Background figure file for donut plot with group.',
         metavar='INPUT_FILE')
 
+    parent_parser_diagram_format = argparse.ArgumentParser(add_help=False)
+    parent_parser_diagram_format.add_argument(
+        '--diagram-format',
+        dest='diagram_format',
+        required=False,
+        help='Format of the cycle diagrams: png (default) or svg (lighter, the diagrams link to a single copy of the templates).',
+        choices=DIAGRAM_FORMATS,
+        default='png')
+
+    parent_parser_core = argparse.ArgumentParser(add_help=False)
+    parent_parser_core.add_argument(
+        '-c',
+        '--core',
+        dest='core',
+        required=False,
+        help='Number of processes used to draw figures and to compute permutations (with --group-test permutation).',
+        type=int,
+        default=1)
+
+    parent_parser_profile = argparse.ArgumentParser(add_help=False)
+    parent_parser_profile.add_argument(
+        '--profile',
+        dest='profile',
+        required=False,
+        help='Profile the stages of the run (aggregation, plotting) with cProfile in all processes. Merged profiles (bigecyhmm_visualisation_profile_STAGE.pstats) and a summary of the slowest functions (bigecyhmm_visualisation_profile.txt) are written in the output folder.',
+        action='store_true',
+        default=False)
+
+    parent_parser_participation_format = argparse.ArgumentParser(add_help=False)
+    parent_parser_participation_format.add_argument(
+        '--participation-format',
+        dest='participation_format',
+        required=False,
+        help='Format of the participation outputs: per_sample (default, one tsv file per sample) or long (one tsv file with sample, organism, function and abundance columns, only non-zero values).',
+        choices=PARTICIPATION_FORMATS,
+        default='per_sample')
+
+    parent_parser_abundance_storage = argparse.ArgumentParser(add_help=False)
+    parent_parser_abundance_storage.add_argument(
+        '--abundance-storage',
+        dest='abundance_storage',
+        required=False,
+        help='Storage of the abundance file: dict (default), float32 (file read by chunks in a float32 matrix, for very large abundance files) or memmap (float32 matrix stored in function_abundance/abundance_matrix.npy instead of memory).',
+        choices=ABUNDANCE_STORAGES,
+        default='dict')
+
+    parent_parser_group_test = argparse.ArgumentParser(add_help=False)
+    parent_parser_group_test.add_argument(
+        '--group-test',
+        dest='group_test',
+        required=False,
+        help='Statistical test between groups (with --group-file): kruskal (default, Kruskal-Wallis p-values) or permutation (exact or permutation p-values of Kruskal-Wallis H statistic, for small or unbalanced groups).',
+        choices=GROUP_TESTS,
+        default='kruskal')
+    parent_parser_group_test.add_argument(
+        '--permutations',
+        dest='permutations',
+        required=False,
+        help='Maximal number of permutations with --group-test permutation (default 9999). If there are fewer distinct assignments of samples to groups, all of them are tested (exact test).',
+        type=int,
+        default=9999)
+    parent_parser_group_test.add_argument(
+        '--seed',
+        dest='seed',
+        required=False,
+        help='Seed of the permutations with --group-test permutation (default 0).',
+        type=int,
+        default=0)
+
     # subparsers
     subparsers = parser.add_subparsers(
         title='subcommands',
@@ -1373,7 +1888,8 @@ def main():
         parents=[
             parent_parser_esmecata, parent_parser_bigecyhmm, parent_parser_abundance_file,
             parent_parser_output_folder, parent_parser_group_file, parent_parser_measure_file,
-            parent_parser_background_figure_file
+            parent_parser_background_figure_file, parent_parser_diagram_format, parent_parser_core,
+            parent_parser_participation_format, parent_parser_abundance_storage, parent_parser_group_test, parent_parser_profile
             ],
         allow_abbrev=False)
     genomes_parser = subparsers.add_parser(
@@ -1382,14 +1898,16 @@ def main():
         parents=[
             parent_parser_bigecyhmm, parent_parser_abundance_file,
             parent_parser_output_folder, parent_parser_group_file,
-            parent_parser_measure_file
+            parent_parser_measure_file, parent_parser_diagram_format, parent_parser_core,
+            parent_parser_participation_format, parent_parser_abundance_storage, parent_parser_group_test, parent_parser_profile
             ],
         allow_abbrev=False)
     ko_parser = subparsers.add_parser(
         'ko',
         help='Creates visualisation from a table containing the abundances of HMM (especially KO) for different samples.',
         parents=[
-            parent_parser_ko_file, parent_parser_output_folder, parent_parser_group_file
+            parent_parser_ko_file, parent_parser_output_folder, parent_parser_group_file,
+            parent_parser_diagram_format, parent_parser_core, parent_parser_profile
             ],
         allow_abbrev=False)
 
@@ -1415,6 +1933,12 @@ def main():
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
+    # Figures are only written to files, use the non-interactive Agg backend of matplotlib (unless another backend is set by the user).
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    if args.profile:
+        enable_profiling(args.output)
+
     logger.info("--- Create visualisation ---")
 
     if args.cmd in ['esmecata', 'genomes']:
@@ -1428,13 +1952,23 @@ def main():
         else:
             group_file = args.group_file
 
-    if args.cmd in ['esmecata']:
-        visualisation_input_handler(args.bigecyhmm, args.output, esmecata_output_folder=args.esmecata, abundance_file_path=abundance_file, group_file=group_file, metabolite_measure=args.measure_file,
-                                    background_path_donut_plot=args.background_file)
-    elif args.cmd in ['genomes']:
-        visualisation_input_handler(args.bigecyhmm, args.output, abundance_file_path=abundance_file, group_file=group_file, metabolite_measure=args.measure_file)
-    elif args.cmd in ['ko']:
-        create_visualisation_from_ko_file(args.ko_file, args.output)
+    try:
+        if args.cmd in ['esmecata']:
+            visualisation_input_handler(args.bigecyhmm, args.output, esmecata_output_folder=args.esmecata, abundance_file_path=abundance_file, group_file=group_file, metabolite_measure=args.measure_file,
+                                        background_path_donut_plot=args.background_file, diagram_format=args.diagram_format, core_number=args.core,
+                                        participation_format=args.participation_format, abundance_storage=args.abundance_storage,
+                                        group_test=args.group_test, nb_permutations=args.permutations, permutation_seed=args.seed)
+        elif args.cmd in ['genomes']:
+            visualisation_input_handler(args.bigecyhmm, args.output, abundance_file_path=abundance_file, group_file=group_file, metabolite_measure=args.measure_file,
+                                        diagram_format=args.diagram_format, core_number=args.core, participation_format=args.participation_format,
+                                        abundance_storage=args.abundance_storage, group_test=args.group_test, nb_permutations=args.permutations,
+                                        permutation_seed=args.seed)
+        elif args.cmd in ['ko']:
+            create_visualisation_from_ko_file(args.ko_file, args.output, diagram_format=args.diagram_format, core_number=args.core)
+    finally:
+        # Profiles are also written if the visualisation fails, which removes their temporary folder.
+        if args.profile:
+            write_profiles(args.output, 'bigecyhmm_visualisation')
 
     duration = time.time() - start_time
     logger.info("--- Total runtime %.2f seconds ---" % (duration))
@@ -0,0 +1,55 @@
+import os
+import shutil
+
+from bigecyhmm.api import HMMDatabase, write_hit_files, write_presence_files
+from bigecyhmm.hmm_search import search_hmm
+
+
+def test_hmm_database_search():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+    output_folder = 'output_folder'
+    search_output_folder = os.path.join(output_folder, 'search_hmm')
+    api_output_folder = os.path.join(output_folder, 'api')
+
+    search_hmm(input_file, search_output_folder)
+
+    database = HMMDatabase()
+    search_result = database.search(input_file)
+    assert search_result.name == 'meta_organism_test'
+    assert ('sp|P06292|RBL_MARPO', 'rubisco_form_I.hmm') in [(hit.protein, hit.hmm) for hit in search_result.hits]
+    assert search_result.pathway_presence['C-S-02:Carbon fixation'] == 1
+
+    # Sequences given as a dictionary and as fasta content must give the same hits.
+    sequences = {}
+    with open(input_file, 'r') as open_input_file:
+        fasta_content = open_input_file.read()
+    for fasta_record in fasta_content.split('>')[1:]:
+        fasta_lines = fasta_record.split('\n')
+        sequences[fasta_lines[0].split(' ')[0]] = ''.join(fasta_lines[1:])
+    search_results = database.search_batch({'meta_organism_test': sequences, 'fasta_content': fasta_content})
+    assert [hit.protein for hit in search_results[0].hits] == [hit.protein for hit in search_result.hits]
+    assert [hit.score for hit in search_results[1].hits] == [hit.score for hit in search_result.hits]
+
+    # Writers must give the same files as search_hmm.
+    write_hit_files([search_result], os.path.join(api_output_folder, 'hmm_results'))
+    write_presence_files([search_result], api_output_folder, database)
+    for result_file in [os.path.join('hmm_results', 'meta_organism_test.tsv'), 'function_presence.tsv', 'pathway_presence.tsv']:
+        with open(os.path.join(search_output_folder, result_file), 'r') as open_search_result_file:
+            search_results_content = open_search_result_file.read()
+        with open(os.path.join(api_output_folder, result_file), 'r') as open_api_result_file:
+            api_results_content = open_api_result_file.read()
+        assert search_results_content == api_results_content
+
+    shutil.rmtree(output_folder)
+
+
+def test_hmm_database_search_strategies():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+
+    database = HMMDatabase()
+    # hmmsearch (one search per HMM) and hmmscan (one search per sequence) must give the same hits.
+    search_result = database.search(input_file, search_strategy='search')
+    scan_result = database.search(input_file, search_strategy='scan')
+    assert len(search_result.hits) > 0
+    assert scan_result.hits == search_result.hits
+    assert scan_result.pathway_presence == search_result.pathway_presence
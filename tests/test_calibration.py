@@ -0,0 +1,24 @@
+import os
+import shutil
+import csv
+
+from bigecyhmm.calibration import calibrate_search_profile
+
+
+def test_calibrate_search_profile():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+    output_folder = 'output_folder'
+
+    calibration_summary = calibrate_search_profile(input_file, output_folder, 'fast')
+    assert calibration_summary['lost_hits'] == 0
+    assert calibration_summary['speedup'] > 0
+    assert os.path.exists(os.path.join(output_folder, 'calibration_fast.json'))
+
+    hmm_hits = {}
+    with open(os.path.join(output_folder, 'calibration_fast.tsv'), 'r') as open_calibration_file:
+        csvreader = csv.DictReader(open_calibration_file, delimiter='\t')
+        for line in csvreader:
+            hmm_hits[line['HMM']] = (int(line['default_hits']), int(line['fast_hits']))
+    assert hmm_hits['rubisco_form_I.hmm'] == (1, 1)
+
+    shutil.rmtree(output_folder)
@@ -3,9 +3,9 @@ import csv
 import subprocess
 import shutil
 
-from bigecyhmm.custom_db import identify_run_custom_db_search, search_hmm_custom_db, generate_pathway_file_from_json
+from bigecyhmm.custom_db import identify_run_custom_db_search, search_hmm_custom_db, generate_pathway_file_from_json, compile_custom_db
 from bigecyhmm import HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE
-from bigecyhmm.hmm_search import query_fasta_file, get_hmm_thresholds, extract_hmm_to_function
+from bigecyhmm.hmm_search import query_fasta_file, get_hmm_thresholds, extract_hmm_to_function, search_hmm
 from bigecyhmm.diagram_cycles import extract_hmm_to_pathway
 from bigecyhmm.utils import is_valid_dir
 
@@ -113,6 +113,84 @@ def test_query_fasta_file_custom_db_gene_in_both_motif_and_motif_pair():
     assert "pmoA.hmm" in pmoa_matching_hmms and "amoA.hmm" not in pmoa_matching_hmms
 
 
+def test_identify_run_custom_db_search_folder():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+    output_folder = 'output_folder'
+    custom_db_folder = os.path.join('input_data', 'mini_custom_db')
+
+    identify_run_custom_db_search(input_file, custom_db_folder, output_folder)
+
+    # HMMs are searched once for both databases, results must be the same as a search with each database.
+    nb_predicted_hits = 0
+    for custom_db_name in ['carbon_cycle', 'phosphorus_cycle']:
+        hmm_thresholds = get_hmm_thresholds(os.path.join(custom_db_folder, custom_db_name + '.tsv'))
+        expected_results = query_fasta_file(input_file, hmm_thresholds, pyhmmer_core=1)
+        expected_hits = [(result[1], result[2]) for result in expected_results]
+
+        predicted_hmm_file = os.path.join(output_folder, custom_db_name, 'hmm_results', 'meta_organism_test.tsv')
+        with open(predicted_hmm_file, 'r') as open_predicted_hmm_file:
+            csvreader = csv.DictReader(open_predicted_hmm_file, delimiter='\t')
+            predicted_hits = [(line['protein'], line['HMM']) for line in csvreader]
+
+        assert predicted_hits == expected_hits
+        assert os.path.exists(os.path.join(output_folder, custom_db_name, 'pathway_presence.tsv'))
+        nb_predicted_hits += len(predicted_hits)
+
+    assert nb_predicted_hits > 0
+
+    shutil.rmtree(output_folder)
+
+
+def test_identify_run_custom_db_search_bundle():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+    output_folder = 'output_folder'
+    custom_db_folder = os.path.join('input_data', 'mini_custom_db')
+    bundle_file = os.path.join(output_folder, 'mini_custom_db.bigecyhmm')
+    folder_output_folder = os.path.join(output_folder, 'folder')
+    bundle_output_folder = os.path.join(output_folder, 'bundle')
+
+    is_valid_dir(output_folder)
+    compile_custom_db(custom_db_folder, bundle_file)
+    identify_run_custom_db_search(input_file, custom_db_folder, folder_output_folder)
+    identify_run_custom_db_search(input_file, bundle_file, bundle_output_folder)
+
+    # Results with the compiled bundle must be the same as results with the custom database folder.
+    for custom_db_name in ['carbon_cycle', 'phosphorus_cycle']:
+        for result_file in [os.path.join('hmm_results', 'meta_organism_test.tsv'), 'pathway_presence.tsv']:
+            with open(os.path.join(folder_output_folder, custom_db_name, result_file), 'r') as open_folder_result_file:
+                folder_results = open_folder_result_file.read()
+            with open(os.path.join(bundle_output_folder, custom_db_name, result_file), 'r') as open_bundle_result_file:
+                bundle_results = open_bundle_result_file.read()
+            assert folder_results == bundle_results
+        assert os.path.exists(os.path.join(bundle_output_folder, custom_db_name, 'database', 'input_graph.graphml'))
+
+    shutil.rmtree(output_folder)
+
+
+def test_identify_run_custom_db_search_previous_run():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+    output_folder = 'output_folder'
+    custom_db_folder = os.path.join('input_data', 'mini_custom_db')
+    previous_output_folder = os.path.join(output_folder, 'previous')
+    searched_output_folder = os.path.join(output_folder, 'searched')
+    reused_output_folder = os.path.join(output_folder, 'reused')
+
+    search_hmm(input_file, previous_output_folder)
+    identify_run_custom_db_search(input_file, custom_db_folder, searched_output_folder)
+    identify_run_custom_db_search(input_file, custom_db_folder, reused_output_folder, previous_run_folder=previous_output_folder)
+
+    # Results reusing hits of the previous bigecyhmm run must be the same as results with a new search.
+    for custom_db_name in ['carbon_cycle', 'phosphorus_cycle']:
+        for result_file in [os.path.join('hmm_results', 'meta_organism_test.tsv'), 'pathway_presence.tsv']:
+            with open(os.path.join(searched_output_folder, custom_db_name, result_file), 'r') as open_searched_result_file:
+                searched_results = open_searched_result_file.read()
+            with open(os.path.join(reused_output_folder, custom_db_name, result_file), 'r') as open_reused_result_file:
+                reused_results = open_reused_result_file.read()
+            assert searched_results == reused_results
+
+    shutil.rmtree(output_folder)
+
+
 def test_search_hmm_custom_db_cli():
     input_file = os.path.join('input_data', 'meta_organism_test.faa')
     output_folder = 'output_folder'
@@ -1,8 +1,12 @@
 import os
 import csv
+import shutil
 import zipfile
 
-from bigecyhmm.diagram_cycles import check_diagram_pathways, check_boolean_expression
+import numpy as np
+
+from bigecyhmm.diagram_cycles import check_diagram_pathways, check_boolean_expression, create_cycle_diagrams, get_diagram_layout, DIAGRAM_CYCLES, \
+                                     compile_pathway_expression, evaluate_pathway_expression
 
 def test_check_diagram_pathways():
     sorted_pathways = ['S-S-09:Thiosulfate disproportionation 2']
@@ -39,3 +43,67 @@ def test_check_boolean_expression():
 
     for org in expected_org_pathways:
         assert pathway_presences[org] == expected_org_pathways[org]
+
+
+def test_compile_pathway_expression():
+    org_hmms = {'org_1': ['soxX.hmm', 'soxY.hmm', 'soxZ.hmm', 'soxA.hmm'],
+                'org_2': ['soxX.hmm', 'soxY.hmm', 'soxZ.hmm', 'soxA.hmm', 'soxC.hmm', 'soxD.hmm'],
+                'org_3': ['soxC.hmm', 'soxD.hmm']}
+    pathway_hmms = ['soxX.hmm', 'soxY.hmm', 'soxZ.hmm', 'soxA.hmm', 'soxC.hmm', 'soxD.hmm']
+    hmm_boolean_expression = "(soxX.hmm or soxY.hmm or soxZ.hmm or soxA.hmm) and (not soxC.hmm and not soxD.hmm)"
+
+    compiled_expression, positive_hmms = compile_pathway_expression(hmm_boolean_expression, pathway_hmms)
+    assert positive_hmms == ['soxX.hmm', 'soxY.hmm', 'soxZ.hmm', 'soxA.hmm']
+
+    # Presence matrix with HMMs as rows and organisms as columns.
+    hmm_presence = np.array([[hmm in org_hmms[org] for org in org_hmms] for hmm in pathway_hmms])
+    pathway_presences = evaluate_pathway_expression(compiled_expression, hmm_presence)
+    for org_index, org in enumerate(org_hmms):
+        assert pathway_presences[org_index] == check_boolean_expression(hmm_boolean_expression, org_hmms[org], pathway_hmms)
+
+def test_create_cycle_diagrams():
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    diagram_layout = get_diagram_layout()
+    samples_diagram_data = {}
+    for sample in ['sample_1', 'sample_2']:
+        samples_diagram_data[sample] = {label['pathway']: (1, 50.0) for cycle_name in diagram_layout for label in diagram_layout[cycle_name]['labels']}
+
+    diagram_files = create_cycle_diagrams(samples_diagram_data, output_folder, DIAGRAM_CYCLES, 'Abundance', 'Percentage')
+
+    for sample in samples_diagram_data:
+        for cycle_name in DIAGRAM_CYCLES:
+            expected_file = os.path.join(output_folder, sample + '_' + cycle_name + '.png')
+            assert diagram_files[sample][cycle_name] == expected_file
+            assert os.path.exists(expected_file)
+
+    shutil.rmtree(output_folder)
+
+
+def test_create_cycle_diagrams_svg():
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    diagram_layout = get_diagram_layout()
+    samples_diagram_data = {}
+    for sample in ['sample_1', 'sample_2']:
+        samples_diagram_data[sample] = {label['pathway']: (1, 50.0) for cycle_name in diagram_layout for label in diagram_layout[cycle_name]['labels']}
+
+    diagram_files = create_cycle_diagrams(samples_diagram_data, output_folder, DIAGRAM_CYCLES, 'Abundance', 'Percentage', output_format='svg')
+
+    for cycle_name in DIAGRAM_CYCLES:
+        template_file = os.path.join(output_folder, 'diagram_templates', os.path.basename(diagram_layout[cycle_name]['template']))
+        assert os.path.exists(template_file)
+        for sample in samples_diagram_data:
+            expected_file = os.path.join(output_folder, sample + '_' + cycle_name + '.svg')
+            assert diagram_files[sample][cycle_name] == expected_file
+            with open(expected_file, 'r') as open_svg_file:
+                svg_content = open_svg_file.read()
+            assert 'href="diagram_templates/' + os.path.basename(template_file) + '"' in svg_content
+            assert svg_content.count('>Abundance: 1</tspan>') == len(diagram_layout[cycle_name]['labels'])
+            assert svg_content.count('>Percentage: 50.0%</tspan>') == len(diagram_layout[cycle_name]['labels'])
+
+    shutil.rmtree(output_folder)
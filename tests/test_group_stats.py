@@ -180,6 +180,96 @@ def test_run_statistics():
     shutil.rmtree(output_folder)
     
 
+def test_compute_kruskal_wallis():
+
+    from bigecyhmm.group_analysis import build_group_matrix, rank_rows, compute_kruskal_wallis, benjamini_hochberg
+    from scipy.stats import kruskal
+    import numpy as np
+
+    df = pd.DataFrame([[1, 2, 2, 5, 6, 6, 7, 9], [0.5, np.nan, 0.1, 0.3, 0.3, np.nan, 0.9, 0.2], [3, 3, 1, 1, 2, 2, 4, 4]],
+                      index=['function_1', 'function_2', 'function_3'], columns=['sample_{0}'.format(i) for i in range(1, 9)])
+    group_col_names = [['sample_1', 'sample_2', 'sample_3'], ['sample_4', 'sample_5'], ['sample_6', 'sample_7', 'sample_8']]
+
+    group_values, group_labels = build_group_matrix(df, group_col_names)
+    assert group_labels.tolist() == [0, 0, 0, 1, 1, 2, 2, 2]
+    ranks, tie_sums = rank_rows(group_values)
+    assert ranks[0].tolist() == [1, 2.5, 2.5, 4, 5.5, 5.5, 7, 8]
+    assert tie_sums.tolist() == [12, 6, 24]
+
+    # Same results as scipy for each function (with missing values removed).
+    H_stats, p_values, effect_sizes_eps2, nb_valid_groups, nb_values = compute_kruskal_wallis(ranks, tie_sums, group_labels, len(group_col_names))
+    for function_index, function_name in enumerate(df.index):
+        expected_H, expected_p = kruskal(*[df.loc[function_name, cols].dropna().values for cols in group_col_names])
+        assert np.isclose(H_stats[function_index], expected_H)
+        assert np.isclose(p_values[function_index], expected_p)
+    assert nb_values.tolist() == [8, 6, 8]
+
+    # Same corrected p-values as statsmodels multipletests (fdr_bh), missing p-values are kept.
+    p_values_bh, rejected = benjamini_hochberg(np.array([0.01, np.nan, 0.04, 0.03, 0.2]), alpha=0.05)
+    assert np.allclose(p_values_bh, [0.04, np.nan, 0.16/3, 0.16/3, 0.2], equal_nan=True)
+    assert rejected.tolist() == [True, False, False, False, False]
+
+
+def test_run_statistics_permutation():
+
+    from bigecyhmm.group_analysis import run_statistics, count_group_labelings, enumerate_group_labelings
+    import numpy as np
+
+    input_folder = os.path.join('input_data', 'group_stats')
+    df = pd.read_csv(os.path.join(input_folder, 'cycle_abundance_sample.tsv'), sep='\t', index_col=0)
+    resolved_groups = [['sample_1', 'sample_2', 'sample_3'], ['sample_4', 'sample_5', 'sample_6'], ['sample_7', 'sample_8', 'sample_9']]
+
+    group_labels = np.array([0, 0, 1, 1, 2])
+    assert count_group_labelings(group_labels) == 30
+    labelings = enumerate_group_labelings(group_labels)
+    assert len(labelings) == 30
+    assert len(set(map(tuple, labelings.tolist()))) == 30
+    assert (np.sort(labelings, axis=1) == np.sort(group_labels)).all()
+
+    kruskal_results = run_statistics(df, resolved_groups)
+    # 1680 assignments of 9 samples to 3 groups of 3: exact test.
+    exact_results = run_statistics(df, resolved_groups, stat_test='permutation')
+    for kruskal_result, exact_result in zip(kruskal_results, exact_results):
+        assert kruskal_result.name == exact_result.name
+        assert kruskal_result.H == exact_result.H or (np.isnan(kruskal_result.H) and np.isnan(exact_result.H))
+        if np.isnan(kruskal_result.p):
+            assert np.isnan(exact_result.p)
+        else:
+            assert 0 < exact_result.p <= 1
+            assert np.isclose(exact_result.p * 1680, round(exact_result.p * 1680))
+
+    # Random permutations are reproducible with a seed, whatever the number of processes.
+    permutation_results = run_statistics(df, resolved_groups, stat_test='permutation', nb_permutations=500, seed=1)
+    permutation_results_2_cores = run_statistics(df, resolved_groups, stat_test='permutation', nb_permutations=500, seed=1, core_number=2)
+    for permutation_result, permutation_result_2_cores in zip(permutation_results, permutation_results_2_cores):
+        assert permutation_result.p == permutation_result_2_cores.p or (np.isnan(permutation_result.p) and np.isnan(permutation_result_2_cores.p))
+        if not np.isnan(permutation_result.p):
+            assert 1/501 <= permutation_result.p <= 1
+
+
+def test_compute_dunn():
+
+    from bigecyhmm.group_analysis import build_group_matrix, rank_rows, compute_dunn
+    import numpy as np
+
+    df = pd.DataFrame([[0, 0, 0, 0.9, 0.9, 0.9, np.nan, np.nan], [1, 2, 3, 4, 5, 6, 7, 8]],
+                      index=['function_1', 'function_2'], columns=['sample_{0}'.format(i) for i in range(1, 9)])
+    group_col_names = [['sample_1', 'sample_2', 'sample_3'], ['sample_4', 'sample_5', 'sample_6'], ['sample_7', 'sample_8']]
+    group_values, group_labels = build_group_matrix(df, group_col_names)
+    ranks, tie_sums = rank_rows(group_values)
+    dunn_z, dunn_p_bh, group_pairs = compute_dunn(ranks, tie_sums, group_labels, len(group_col_names))
+
+    assert group_pairs == [(0, 1), (0, 2), (1, 2)]
+    # Mean ranks 2 and 5, variance (6*7/12 - 48/60) * (1/3 + 1/3) with tie correction.
+    assert np.isclose(dunn_z[0, 0], -3 / np.sqrt(1.8))
+    assert np.isclose(dunn_p_bh[0, 0], 0.025347318677468252)
+    # No value in third group.
+    assert np.isnan(dunn_z[0, 1:]).all() and np.isnan(dunn_p_bh[0, 1:]).all()
+    # Without ties: mean ranks 2, 5 and 7.5.
+    assert np.allclose(dunn_z[1], [-3 / np.sqrt(6 * (1/3 + 1/3)), -5.5 / np.sqrt(6 * (1/3 + 1/2)), -2.5 / np.sqrt(6 * (1/3 + 1/2))])
+    assert (np.diff(dunn_p_bh[1][[1, 0, 2]]) >= 0).all()
+
+
 def test_donut_plot():
 
     from bigecyhmm.group_plot import plot_donut
@@ -251,6 +341,25 @@ def test_donut_plot_background_image():
     shutil.rmtree(output_folder)
 
 
+def test_compute_band_paths():
+    import numpy as np
+    from bigecyhmm.group_plot import compute_band_paths
+
+    segment_angles = np.array([[0, 0.5, 1], [1, 1.5, 2], [2, 2.5, 3]])
+    inner_radii = np.array([0.5, 0.2, np.nan])
+    outer_radii = np.array([[0.6, 0.2, 0.4], [0.7, 0.3, 0.4]])
+
+    band_paths = compute_band_paths(segment_angles, inner_radii, outer_radii)
+    assert len(band_paths) == 2
+    # First band: only first segment is kept (no range for the second one, missing value for the third one).
+    assert len(band_paths[0].vertices) == 7
+    assert np.allclose(band_paths[0].vertices[:, 0], [0, 0.5, 1, 1, 0.5, 0, 0])
+    assert np.allclose(band_paths[0].vertices[:, 1], [0.5, 0.5, 0.5, 0.6, 0.6, 0.6, 0.6])
+    # Second band: two polygons in the same path.
+    assert len(band_paths[1].vertices) == 14
+    assert np.allclose(band_paths[1].vertices[7:, 0], [1, 1.5, 2, 2, 1.5, 1, 1])
+    assert np.allclose(band_paths[1].vertices[7:, 1], [0.2, 0.2, 0.2, 0.3, 0.3, 0.3, 0.3])
+
 
 def test_plot_table():
 
@@ -2,11 +2,14 @@ import os
 import csv
 import json
 import subprocess
+import sys
 import shutil
 import pyhmmer
+import pytest
 import zipfile
 
-from bigecyhmm.hmm_search import search_hmm, check_motif_regex, check_motif_pair, extract_hmm_to_function
+from bigecyhmm.hmm_search import search_hmm, check_motif_regex, check_motif_pair, extract_hmm_to_function, estimate_worker_memory, estimate_sequences_memory, \
+    HitTable, select_previous_hits, write_results, FASTA_FILE_MEMORY_FACTOR, RESIDUE_MEMORY, SEQUENCE_MEMORY
 from bigecyhmm.diagram_cycles import extract_hmm_to_pathway
 from bigecyhmm import HMM_TEMPLATE_FILE, PATHWAY_TEMPLATE_FILE, MOTIF, MOTIF_PAIR, HMM_FOLDER
 
@@ -263,4 +266,119 @@ def test_search_hmm_folder_cli():
     for organism in EXPECTED_FUNCTIONS:
         assert set(EXPECTED_FUNCTIONS[organism]) == set(pathway_presence_predicted[organism])
 
-    shutil.rmtree(output_folder)
\ No newline at end of file
+    # Progress of the search workers written in the status file.
+    with open(os.path.join(output_folder, 'bigecyhmm_status.json'), 'r') as open_status_file:
+        status_json = json.load(open_status_file)
+    assert status_json['state'] == 'completed'
+    assert status_json['completed'] == 3
+    assert status_json['running'] == []
+    assert status_json['residues'] > 0
+    assert status_json['hits'] > 0
+
+    shutil.rmtree(output_folder)
+
+def test_search_hmm_memory_budget():
+    input_folder = os.path.join('input_data', 'org_prot')
+    output_folder = 'output_folder'
+    budget_output_folder = os.path.join(output_folder, 'memory_budget')
+    default_output_folder = os.path.join(output_folder, 'default')
+
+    # Budget fitting org_2 and org_3 but not org_1, which is searched by chunks.
+    memory_budget = (estimate_worker_memory(HMM_FOLDER) + estimate_sequences_memory(os.path.join(input_folder, 'org_2.faa'))) / 1024 ** 3
+    search_hmm(input_folder, budget_output_folder, core_number=2, memory_budget=memory_budget)
+    search_hmm(input_folder, default_output_folder, core_number=2)
+
+    with open(os.path.join(budget_output_folder, 'bigecyhmm_metadata.json'), 'r') as open_metadata_file:
+        metadata_json = json.load(open_metadata_file)
+    assert metadata_json['memory']['chunked_inputs'] == [os.path.join(input_folder, 'org_1.faa')]
+    assert metadata_json['memory']['peak_rss_search_workers_mb'] > 0
+
+    for org in ['org_1', 'org_2', 'org_3']:
+        with open(os.path.join(budget_output_folder, 'hmm_results', org + '.tsv'), 'r') as open_budget_file:
+            budget_results = open_budget_file.read()
+        with open(os.path.join(default_output_folder, 'hmm_results', org + '.tsv'), 'r') as open_default_file:
+            default_results = open_default_file.read()
+        assert budget_results == default_results
+
+    shutil.rmtree(output_folder)
+
+
+def test_estimate_sequences_memory():
+    output_folder = 'output_folder'
+    os.mkdir(output_folder)
+    input_file = os.path.join(output_folder, 'org_2.faa')
+    shutil.copyfile(os.path.join('input_data', 'org_prot', 'org_2.faa'), input_file)
+    input_file_size = os.path.getsize(input_file)
+
+    # Without fasta index, the memory is estimated from the size of the file.
+    assert estimate_sequences_memory(input_file) == FASTA_FILE_MEMORY_FACTOR * input_file_size
+
+    # With a fasta index, the memory is estimated from the number of sequences and residues.
+    sequence_lengths = [len(sequence.sequence) for sequence in pyhmmer.easel.SequenceFile(input_file)]
+    with open(input_file + '.fai', 'w') as open_fasta_index_file:
+        for sequence_index, sequence_length in enumerate(sequence_lengths):
+            open_fasta_index_file.write('seq_{0}\t{1}\t0\t60\t61\n'.format(sequence_index, sequence_length))
+    assert estimate_sequences_memory(input_file) == RESIDUE_MEMORY * sum(sequence_lengths) + SEQUENCE_MEMORY * len(sequence_lengths) \
+                                                   + input_file_size - sum(sequence_lengths)
+
+    shutil.rmtree(output_folder)
+
+
+def test_search_hmm_memory_budget_failed_search():
+    input_folder = os.path.join('output_folder', 'input')
+    output_folder = os.path.join('output_folder', 'output')
+    os.makedirs(input_folder)
+    shutil.copyfile(os.path.join('input_data', 'org_prot', 'org_2.faa'), os.path.join(input_folder, 'org_2.faa'))
+    with open(os.path.join(input_folder, 'org_incorrect.faa'), 'w') as open_input_file:
+        open_input_file.write('not a fasta file\n')
+
+    # The failure of a search stops the other searches and is raised.
+    with pytest.raises(ValueError):
+        search_hmm(input_folder, output_folder, core_number=2, memory_budget=4)
+
+    shutil.rmtree('output_folder')
+
+
+def test_hit_table():
+    output_folder = 'output_folder'
+    os.mkdir(output_folder)
+    hit_rows = [['org_1', 'P06292', 'rubisco_form_I.hmm', 1.2e-250, 850.5377807617188, 475],
+                ['org_1', 'prot"with\tquotes', 'K00001.hmm', 0.005, 20.25, 341],
+                ['org_1', 'P11766', 'K00001.hmm', 3.5e-120, 401.0, 375]]
+    hit_table = HitTable(hit_rows)
+    assert len(hit_table) == 3
+    assert [list(hit) for hit in hit_table] == hit_rows
+    assert hit_table[1][1] == 'prot"with\tquotes'
+
+    # Same file as the one written by csv.writer.
+    hit_file = os.path.join(output_folder, 'hits.tsv')
+    write_results(hit_table, hit_file)
+    expected_hit_file = os.path.join(output_folder, 'expected_hits.tsv')
+    with open(expected_hit_file, 'w') as open_expected_hit_file:
+        csvwriter = csv.writer(open_expected_hit_file, delimiter='\t')
+        csvwriter.writerow(['organism', 'protein', 'HMM', 'evalue', 'score', 'length'])
+        csvwriter.writerows(hit_rows)
+    with open(hit_file, 'rb') as open_hit_file, open(expected_hit_file, 'rb') as open_expected_hit_file:
+        assert open_hit_file.read() == open_expected_hit_file.read()
+
+    # Hits of a previous run with 10 times more HMMs: e-values are rescaled and the hit with an e-value above inclusion threshold is removed.
+    previous_results = HitTable([[str(value) for value in hit_row] for hit_row in hit_rows])
+    selected_hits = select_previous_hits('org_2', 'K00001_copy.hmm', previous_results, 10, 100)
+    assert list(selected_hits) == [('org_2', 'P06292', 'K00001_copy.hmm', 1.2e-249, 850.5377807617188, 475),
+                                   ('org_2', 'P11766', 'K00001_copy.hmm', 3.5e-119, 401.0, 375)]
+
+    hit_table.extend(selected_hits)
+    assert len(hit_table) == 5
+    assert hit_table[4] == ('org_2', 'P11766', 'K00001_copy.hmm', 3.5e-119, 401.0, 375)
+
+    shutil.rmtree(output_folder)
+
+
+def test_main_imports():
+    # Importing the search CLI must not load the heavy visualisation dependencies.
+    import_check = 'import sys, bigecyhmm.__main__; print(",".join(sorted(module.split(".")[0] for module in sys.modules)))'
+    imported_modules = subprocess.check_output([sys.executable, '-c', import_check], text=True).strip().split(',')
+
+    assert 'pyhmmer' in imported_modules
+    for heavy_module in ['pandas', 'numpy', 'matplotlib', 'seaborn', 'scipy', 'statsmodels', 'esmecata', 'networkx']:
+        assert heavy_module not in imported_modules
@@ -0,0 +1,42 @@
+import os
+import shutil
+import subprocess
+import sys
+
+from bigecyhmm.hmm_search import search_hmm
+from bigecyhmm.profiling import enable_profiling, write_profiles, PROFILE_FOLDER_VARIABLE
+
+
+def test_profile_search_hmm():
+    input_folder = os.path.join('input_data', 'org_prot')
+    output_folder = 'output_folder'
+
+    os.makedirs(output_folder)
+    profile_folder = enable_profiling(output_folder)
+    search_hmm(input_folder, output_folder, core_number=2)
+    summary_file = write_profiles(output_folder, 'bigecyhmm')
+
+    # Profiles of the search workers and of the main process are merged by stage.
+    for stage in ['search', 'filtering', 'aggregation', 'plotting']:
+        assert os.path.exists(os.path.join(output_folder, 'bigecyhmm_profile_{0}.pstats'.format(stage)))
+    with open(summary_file, 'r') as open_summary_file:
+        summary = open_summary_file.read()
+    assert '## Stage search:' in summary
+    assert 'query_fasta_file' in summary
+    assert 'filtering_hit' in summary
+    assert not os.path.exists(profile_folder)
+    assert PROFILE_FOLDER_VARIABLE not in os.environ
+
+    shutil.rmtree(output_folder)
+
+
+def test_profile_failed_search():
+    output_folder = 'output_folder'
+
+    # Profiles are written and their temporary folder is removed even if the search fails.
+    completed_process = subprocess.run([sys.executable, '-m', 'bigecyhmm', '-i', os.path.join('input_data', 'missing.faa'), '-o', output_folder, '--profile'])
+    assert completed_process.returncode == 1
+    assert os.path.exists(os.path.join(output_folder, 'bigecyhmm_profile.txt'))
+    assert not any(filename.startswith('profiles_') for filename in os.listdir(output_folder))
+
+    shutil.rmtree(output_folder)
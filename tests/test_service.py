@@ -0,0 +1,98 @@
+import os
+import json
+import http.client
+import threading
+import urllib.error
+import urllib.request
+
+from bigecyhmm.service import create_search_server, close_search_server
+from bigecyhmm.hmm_search import query_fasta_file, get_hmm_thresholds
+from bigecyhmm import HMM_TEMPLATE_FILE
+
+
+def send_request(server_url, path, search_request=None):
+    if search_request is not None:
+        request = urllib.request.Request(server_url + path, data=json.dumps(search_request).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    else:
+        request = urllib.request.Request(server_url + path)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_search_service():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+
+    search_server = create_search_server(port=0, core_number=1, max_body_size=1024 ** 2, allowed_root='input_data')
+    server_thread = threading.Thread(target=search_server.serve_forever)
+    server_thread.start()
+    server_url = 'http://{0}:{1}'.format(*search_server.server_address[:2])
+
+    try:
+        status_code, search_result = send_request(server_url, '/search', {'path': os.path.abspath(input_file)})
+        assert status_code == 200
+        hmm_thresholds = get_hmm_thresholds(HMM_TEMPLATE_FILE)
+        expected_results = query_fasta_file(input_file, hmm_thresholds)
+        assert [(hit['protein'], hit['hmm']) for hit in search_result['hits']] == [(result[1], result[2]) for result in expected_results]
+        assert search_result['name'] == 'meta_organism_test'
+        assert search_result['pathway_presence']['C-S-02:Carbon fixation'] == 1
+
+        # Same search with the content of the fasta file.
+        with open(input_file, 'r') as open_input_file:
+            fasta_content = open_input_file.read()
+        status_code, fasta_search_result = send_request(server_url, '/search', {'fasta': fasta_content, 'name': 'meta_organism_test'})
+        assert status_code == 200
+        assert fasta_search_result['hits'] == search_result['hits']
+
+        status_code, error_result = send_request(server_url, '/search', {'name': 'no_input'})
+        assert status_code == 400
+
+        status_code, error_result = send_request(server_url, '/search', {'fasta': [fasta_content]})
+        assert status_code == 400
+
+        # Files are only searched in the allowed root, relative paths being relative to it.
+        status_code, path_search_result = send_request(server_url, '/search', {'path': 'meta_organism_test.faa'})
+        assert status_code == 200
+        assert path_search_result['hits'] == search_result['hits']
+        status_code, error_result = send_request(server_url, '/search', {'path': os.path.join('..', 'test_service.py')})
+        assert status_code == 403
+        status_code, error_result = send_request(server_url, '/search', {'path': os.path.abspath('test_service.py')})
+        assert status_code == 403
+
+        # Body larger than the maximal body size is rejected from its Content-Length, before reading it.
+        connection = http.client.HTTPConnection(*search_server.server_address[:2])
+        connection.putrequest('POST', '/search')
+        connection.putheader('Content-Length', str(2 * 1024 ** 2))
+        connection.endheaders()
+        assert connection.getresponse().status == 413
+        connection.close()
+
+        status_code, metrics = send_request(server_url, '/metrics')
+        assert status_code == 200
+        assert metrics['completed'] == 3
+        assert metrics['max_requests'] == 2
+        assert metrics['latency']['max'] > 0
+    finally:
+        search_server.shutdown()
+        server_thread.join()
+        close_search_server(search_server)
+
+
+def test_search_service_without_allowed_root():
+    input_file = os.path.join('input_data', 'meta_organism_test.faa')
+
+    search_server = create_search_server(port=0, core_number=1)
+    server_thread = threading.Thread(target=search_server.serve_forever)
+    server_thread.start()
+    server_url = 'http://{0}:{1}'.format(*search_server.server_address[:2])
+
+    try:
+        # Without allowed root, files can not be searched with "path".
+        status_code, error_result = send_request(server_url, '/search', {'path': os.path.abspath(input_file)})
+        assert status_code == 403
+    finally:
+        search_server.shutdown()
+        server_thread.join()
+        close_search_server(search_server)
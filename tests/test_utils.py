@@ -1,6 +1,9 @@
 import os
+import shutil
+import pytest
+import numpy as np
 
-from bigecyhmm.utils import read_measures_file, read_esmecata_proteome_file
+from bigecyhmm.utils import read_measures_file, read_esmecata_proteome_file, write_sparse_presence, read_sparse_presence, read_measures_matrix
 
 
 def test_read_measures_file():
@@ -23,6 +26,53 @@ def test_read_measures_file():
         assert expected_sample_tot_abundance[sample] == sample_tot_abundance[sample]
 
 
+def test_read_measures_matrix():
+    abundance_file_path = os.path.join('input_data', 'proteome_tax_id_abundance.tsv')
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    expected_matrix = np.array([[100, 0, 0], [100, 200, 120], [0, 600, 400]], dtype='float32')
+    expected_sample_tot_abundance = {'sample_1': 200, 'sample_2': 800, 'sample_3': 520}
+    for memmap_file in [None, os.path.join(output_folder, 'abundance_matrix.npy')]:
+        measure_matrix, sample_tot_abundance = read_measures_matrix(abundance_file_path, chunk_size=2, memmap_file=memmap_file)
+        assert measure_matrix.row_names == ['org_1', 'org_2', 'org_3']
+        assert measure_matrix.column_names == ['sample_1', 'sample_2', 'sample_3']
+        assert list(measure_matrix.keys()) == ['sample_1', 'sample_2', 'sample_3']
+        assert measure_matrix.matrix.dtype == np.float32
+        np.testing.assert_array_equal(measure_matrix.matrix, expected_matrix)
+        assert sample_tot_abundance == expected_sample_tot_abundance
+
+    np.testing.assert_array_equal(np.load(os.path.join(output_folder, 'abundance_matrix.npy')), expected_matrix)
+
+    abundance_file_path = os.path.join('input_data', 'proteome_tax_id_abundance_incorrect.tsv')
+    with pytest.raises(SystemExit) as system_exit:
+        read_measures_matrix(abundance_file_path)
+    assert system_exit.value.code == 1
+
+    shutil.rmtree(output_folder)
+
+
+def test_read_measures_matrix_multiline_field():
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    # The quoted name of the first organism spans two lines, so the file has more lines than rows.
+    abundance_file_path = os.path.join(output_folder, 'multiline_abundance.csv')
+    with open(abundance_file_path, 'w') as open_abundance_file:
+        open_abundance_file.write('observation_name,sample_1,sample_2\n"org\n1",100,0\norg_2,100,200\norg_3,0,600\n')
+
+    expected_matrix = np.array([[100, 0], [100, 200], [0, 600]], dtype='float32')
+    for chunk_size in [2, 100]:
+        measure_matrix, sample_tot_abundance = read_measures_matrix(abundance_file_path, chunk_size=chunk_size)
+        assert measure_matrix.row_names == ['org\n1', 'org_2', 'org_3']
+        np.testing.assert_array_equal(measure_matrix.matrix, expected_matrix)
+        assert sample_tot_abundance == {'sample_1': 200, 'sample_2': 800}
+
+    shutil.rmtree(output_folder)
+
+
 def test_read_esmecata_proteome_file():
     proteome_tax_id_file = os.path.join('input_data', 'esmecata_output_folder', '0_proteomes', 'proteome_tax_id.tsv')
     observation_names_tax_id_names, observation_names_tax_ranks = read_esmecata_proteome_file(proteome_tax_id_file)
@@ -35,3 +85,18 @@ def test_read_esmecata_proteome_file():
 
     for org in expected_observation_names_tax_ranks:
         assert expected_observation_names_tax_ranks[org] == observation_names_tax_ranks[org]
+
+
+def test_write_read_sparse_presence():
+    output_folder = 'output_folder'
+    presences = {'org_1': {'function_1': 1.0, 'function_3': 0.5},
+                 'org_2': {'function_2': 1, 'function_3': 0},
+                 'org_3': {}}
+    write_sparse_presence(presences, ['function_1', 'function_2', 'function_3'], ['org_1', 'org_2', 'org_3'], output_folder)
+
+    read_presences, row_names, column_names = read_sparse_presence(output_folder)
+    assert row_names == ['function_1', 'function_2', 'function_3']
+    assert column_names == ['org_1', 'org_2', 'org_3']
+    assert read_presences == {'function_1': {'org_1': 1.0}, 'function_2': {'org_2': 1.0}, 'function_3': {'org_1': 0.5}}
+
+    shutil.rmtree(output_folder)
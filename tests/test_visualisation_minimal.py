@@ -1,13 +1,18 @@
 import os
 import pandas as pd
 import subprocess
+import sys
 import shutil
 import pytest
 import networkx as nx
 
 from bigecyhmm.visualisation import compute_relative_abundance_per_tax_id, read_esmecata_proteome_file, compute_bigecyhmm_functions_abundance, \
-                                    compute_bigecyhmm_functions_occurrence, create_visualisation, compute_abundance_per_tax_rank
-from bigecyhmm.utils import read_measures_file
+                                    compute_bigecyhmm_functions_occurrence, create_visualisation, compute_abundance_per_tax_rank, \
+                                    create_polar_plot, run_plot_jobs, split_in_chunks, read_long_function_participation, compute_ko_pathway_abundances, \
+                                    get_hmm_per_organism, compute_hmm_abundances
+from bigecyhmm.diagram_cycles import get_diagram_pathways_hmms
+from bigecyhmm.utils import read_measures_file, read_measures_matrix
+from bigecyhmm.hmm_search import create_major_functions
 
 
 def test_compute_relative_abundance_per_tax_id():
@@ -107,6 +112,24 @@ def test_compute_bigecyhmm_functions_occurrence_functions_from_esmecata():
             assert function_occurrence_organisms[function][organism] == expected_function_occurrence_organisms[function][organism]
 
 
+def test_compute_bigecyhmm_functions_occurrence_functions_sparse():
+    hmm_result_folder = os.path.join('input_data', 'bigecyhmm_output_folder', 'hmm_results')
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+    function_presence_file = os.path.join(output_folder, 'function_presence.tsv')
+    function_presence_sparse_folder = os.path.join(output_folder, 'function_presence_sparse')
+    create_major_functions(hmm_result_folder, function_presence_file, sparse_output_folder=function_presence_sparse_folder)
+
+    function_occurrence_organisms, all_studied_organisms = compute_bigecyhmm_functions_occurrence(function_presence_file)
+    sparse_function_occurrence_organisms, sparse_all_studied_organisms = compute_bigecyhmm_functions_occurrence(function_presence_sparse_folder)
+
+    assert sparse_function_occurrence_organisms == function_occurrence_organisms
+    assert list(sparse_all_studied_organisms) == list(all_studied_organisms)
+
+    shutil.rmtree(output_folder)
+
+
 def test_compute_bigecyhmm_functions_abundance_functions():
     abundance_file_path = os.path.join('input_data', 'abundance_file_from_genomes.tsv')
     bigecyhmm_cycle_file = os.path.join('input_data', 'bigecyhmm_output_folder', 'function_presence.tsv')
@@ -144,6 +167,21 @@ def test_compute_bigecyhmm_functions_abundance_functions_missing_organism():
     assert system_exit.value.code == 1
 
 
+def test_compute_bigecyhmm_functions_abundance_measure_matrix():
+    abundance_file_path = os.path.join('input_data', 'abundance_file_from_genomes.tsv')
+    bigecyhmm_cycle_file = os.path.join('input_data', 'bigecyhmm_output_folder', 'pathway_presence.tsv')
+
+    sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
+    expected_abundance_samples, expected_relative_abundance_samples, expected_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, sample_abundance, sample_tot_abundance)
+
+    # Abundances computed from the float32 matrix are the same as the ones computed from dictionaries.
+    measure_matrix, sample_tot_abundance = read_measures_matrix(abundance_file_path)
+    function_abundance_samples, function_relative_abundance_samples, function_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, measure_matrix, sample_tot_abundance)
+    assert function_abundance_samples == expected_abundance_samples
+    assert function_relative_abundance_samples == expected_relative_abundance_samples
+    assert function_participation_samples == expected_participation_samples
+
+
 def test_compute_bigecyhmm_functions_occurrence_cycles():
     bigecyhmm_cycle_file = os.path.join('input_data', 'bigecyhmm_output_folder', 'pathway_presence.tsv')
 
@@ -204,6 +242,61 @@ def test_compute_bigecyhmm_functions_abundance_cycles():
                 assert function_participation_samples[sample][organism][function] == expected_function_participation_samples[sample][organism][function]
 
 
+def test_compute_bigecyhmm_functions_abundance_cycles_participation_files():
+    abundance_file_path = os.path.join('input_data', 'abundance_file_from_genomes.tsv')
+    bigecyhmm_cycle_file = os.path.join('input_data', 'bigecyhmm_output_folder', 'pathway_presence.tsv')
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
+
+    function_abundance_samples, function_relative_abundance_samples, function_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, sample_abundance, sample_tot_abundance)
+    file_function_abundance_samples, file_function_relative_abundance_samples, file_function_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, sample_abundance, sample_tot_abundance,
+                                                                                                                                                        participation_output_folder=output_folder)
+
+    assert file_function_participation_samples is None
+    assert file_function_abundance_samples == function_abundance_samples
+    assert file_function_relative_abundance_samples == function_relative_abundance_samples
+    for sample in function_participation_samples:
+        participation_df = pd.read_csv(os.path.join(output_folder, sample + '.tsv'), sep='\t', index_col='organism')
+        assert participation_df.index.tolist() == list(function_participation_samples[sample].keys())
+        for organism in function_participation_samples[sample]:
+            for function in participation_df.columns:
+                if function in function_participation_samples[sample][organism]:
+                    assert participation_df.loc[organism, function] == function_participation_samples[sample][organism][function]
+                else:
+                    assert participation_df.loc[organism, function] == 0
+
+    shutil.rmtree(output_folder)
+
+
+def test_compute_bigecyhmm_functions_abundance_cycles_participation_long_file():
+    abundance_file_path = os.path.join('input_data', 'abundance_file_from_genomes.tsv')
+    bigecyhmm_cycle_file = os.path.join('input_data', 'bigecyhmm_output_folder', 'pathway_presence.tsv')
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+    participation_long_file = os.path.join(output_folder, 'cycle_participation.tsv')
+
+    sample_abundance, sample_tot_abundance = read_measures_file(abundance_file_path)
+
+    compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, sample_abundance, sample_tot_abundance, participation_output_folder=output_folder)
+    _, _, long_function_participation_samples = compute_bigecyhmm_functions_abundance(bigecyhmm_cycle_file, sample_abundance, sample_tot_abundance,
+                                                                                      participation_long_file=participation_long_file)
+    assert long_function_participation_samples is None
+
+    participation_long_df = pd.read_csv(participation_long_file, sep='\t')
+    assert participation_long_df.columns.tolist() == ['sample', 'organism', 'function', 'abundance']
+    assert (participation_long_df['abundance'] > 0).all()
+
+    for sample in sample_abundance:
+        participation_df = pd.read_csv(os.path.join(output_folder, sample + '.tsv'), sep='\t', index_col='organism')
+        long_participation_df = read_long_function_participation(participation_long_file, sample, participation_df.columns.tolist())
+        pd.testing.assert_frame_equal(participation_df, long_participation_df, check_dtype=False)
+
+    shutil.rmtree(output_folder)
+
 def test_compute_bigecyhmm_functions_abundance_cycles_from_esmecata():
     proteome_tax_id_file = os.path.join('input_data', 'esmecata_output_folder', '0_proteomes', 'proteome_tax_id.tsv')
     abundance_file_path = os.path.join('input_data', 'proteome_tax_id_abundance.tsv')
@@ -273,3 +366,79 @@ def test_create_visualisation_abundance_from_esmecata():
 
     shutil.rmtree(output_folder)
 
+
+
+def test_compute_ko_pathway_abundances():
+    pathway_hmms, pathway_expression, sorted_pathways = get_diagram_pathways_hmms()
+    df_ko_abundance = pd.DataFrame({'sample_1': [100, 0, 50, 0, 30], 'sample_2': [0, 800, 0, 20, 0], 'sample_3': [0, 0, 0, 0, 0]},
+                                   index=['K00001', 'K00169', 'soxA', 'soxC', 'K00402'])
+
+    sample_pathway_df = compute_ko_pathway_abundances(df_ko_abundance, pathway_hmms, pathway_expression, sorted_pathways)
+    assert sample_pathway_df.index.tolist() == sorted_pathways
+    assert sample_pathway_df.columns.tolist() == ['sample_1', 'sample_2', 'sample_3']
+
+    # Maximal abundance of the KOs of the pathway.
+    assert sample_pathway_df.loc['C-S-06:Fermentation', 'sample_1'] == 100
+    assert sample_pathway_df.loc['C-S-06:Fermentation', 'sample_2'] == 800
+    assert sample_pathway_df.loc['C-S-03:Ethanol oxidation', 'sample_1'] == 100
+    assert sample_pathway_df.loc['C-S-03:Ethanol oxidation', 'sample_2'] == 0
+    # Pathway with negated KOs: soxA without soxC in sample_1, soxC without soxA in sample_2.
+    assert sample_pathway_df.loc['S-S-09:Thiosulfate disproportionation 2', 'sample_1'] == 50
+    assert sample_pathway_df.loc['S-S-09:Thiosulfate disproportionation 2', 'sample_2'] == 0
+    assert sample_pathway_df.loc['S-S-07:Thiosulfate oxidation', 'sample_1'] == 0
+    assert sample_pathway_df.loc['S-S-07:Thiosulfate oxidation', 'sample_2'] == 0
+    assert (sample_pathway_df['sample_3'] == 0).all()
+
+def test_compute_hmm_abundances():
+    hmm_occurrences = get_hmm_per_organism('input_data/bigecyhmm_output_folder', None)
+    assert hmm_occurrences['tax_id_name_2']['K00249'] == 5
+    assert hmm_occurrences['tax_id_name_2']['DmkB'] == 2
+
+    hmm_occurrences = {'org_1': {'K00001': 2, 'K00002': 1}, 'org_2': {'K00001': 1, 'K00003': 0}, 'org_3': {'K00004': 1}, 'org_4': {'K00005': 1}}
+    sample_abundance = {'sample_1': {'org_1': 100, 'org_2': 50, 'org_3': 0}, 'sample_2': {'org_1': 0, 'org_2': 20},
+                        'sample_3': {'org_1': 0.5, 'org_2': 0.25, 'org_3': 1.0}}
+    for sample_chunk_size in [1, 256]:
+        hmm_abundance_df = compute_hmm_abundances(hmm_occurrences, sample_abundance, sample_chunk_size)
+        # HMMs found only in organisms without abundance (K00005) or without protein (K00003) are not kept.
+        assert hmm_abundance_df.index.tolist() == ['K00001', 'K00002', 'K00004']
+        assert hmm_abundance_df.columns.tolist() == ['sample_1', 'sample_2', 'sample_3']
+        assert hmm_abundance_df['sample_1'].tolist() == [150, 100, 0]
+        assert hmm_abundance_df['sample_3'].tolist() == [0.75, 0.5, 1.0]
+        # org_3 is not listed in sample_2, so K00004 has a missing value.
+        assert hmm_abundance_df.loc['K00001', 'sample_2'] == 20
+        assert pd.isna(hmm_abundance_df.loc['K00004', 'sample_2'])
+        assert hmm_abundance_df['sample_1'].dtype == int
+
+
+def test_run_plot_jobs():
+    assert split_in_chunks(['sample_1', 'sample_2', 'sample_3', 'sample_4', 'sample_5'], 2) == [['sample_1', 'sample_2', 'sample_3'], ['sample_4', 'sample_5']]
+    assert split_in_chunks(['sample_1'], 4) == [['sample_1']]
+
+    output_folder = 'output_folder'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    melted_df = pd.DataFrame([['C-S-01:Organic carbon oxidation', 'sample_1', 0.5], ['C-S-02:Carbon fixation', 'sample_1', 0.8],
+                              ['C-S-01:Organic carbon oxidation', 'sample_2', 0.2], ['C-S-02:Carbon fixation', 'sample_2', 0.9]],
+                              columns=['name', 'sample', 'ratio'])
+    plot_jobs = []
+    expected_files = []
+    for sample in ['sample_1', 'sample_2']:
+        output_polar_plot = os.path.join(output_folder, 'polar_plot_abundance_sample_'+sample+'.png')
+        plot_jobs.append((create_polar_plot, (melted_df[melted_df['sample']==sample], output_polar_plot), {}))
+        expected_files.append(output_polar_plot)
+    run_plot_jobs(plot_jobs, core_number=2)
+
+    for expected_file in expected_files:
+        assert os.path.exists(expected_file)
+
+    shutil.rmtree(output_folder)
+
+
+def test_visualisation_imports():
+    # Importing the visualisation CLI must only load the plotting and statistics dependencies when they are used.
+    import_check = 'import sys, bigecyhmm.visualisation; print(",".join(sorted(module.split(".")[0] for module in sys.modules)))'
+    imported_modules = subprocess.check_output([sys.executable, '-c', import_check], text=True).strip().split(',')
+
+    for heavy_module in ['pandas', 'numpy', 'matplotlib', 'seaborn', 'scipy', 'statsmodels', 'esmecata', 'networkx']:
+        assert heavy_module not in imported_modules